@@ -5,9 +5,15 @@ app = Flask(__name__)
 
 import config
 
+import templating
+
 import models
 
+import journal
+
 import routes
 
+import commands
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,83 @@
+"""
+Memory and overlap-query time of a plan held as a list of schedule dicts vs a CompactPlan
+
+Builds the same synthetic plan both ways with tracemalloc running, then times the
+overlap query handle_same_deadline_jobs makes for every placed operation.
+
+    python benchmarks/compact_plan_memory.py [--operations 100000] [--procedures 50] [--queries 200]
+"""
+import argparse
+import os
+import random
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def synthetic_rows(operations, procedures, epoch, rng):
+    for index in range(operations):
+        start = epoch + timedelta(minutes=rng.randrange(0, 60 * 24 * 365))
+        yield {
+            'job_id': index // 6 + 1,
+            'procedure_id': rng.randrange(1, procedures + 1),
+            'start_datetime': start,
+            'end_datetime': start + timedelta(minutes=60 * rng.randint(1, 8)),
+            'planned_time': rng.randint(1, 8),
+            'planned_manpower': rng.randint(1, 4)
+        }
+
+def measure(build):
+    tracemalloc.start()
+    plan = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return plan, size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--operations', type=int, default=100000)
+    parser.add_argument('--procedures', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from compact_plan import CompactPlan, numpy
+
+    epoch = datetime(2025, 1, 1)
+
+    def build_dicts():
+        return list(synthetic_rows(args.operations, args.procedures, epoch, random.Random(1)))
+
+    def build_compact():
+        plan = CompactPlan(epoch)
+        for row in synthetic_rows(args.operations, args.procedures, epoch, random.Random(1)):
+            plan.append_row(row)
+        return plan
+
+    rows, dict_bytes = measure(build_dicts)
+    plan, compact_bytes = measure(build_compact)
+
+    rng = random.Random(2)
+    queries = [rows[rng.randrange(len(rows))] for _ in range(args.queries)]
+
+    started = perf_counter()
+    dict_hits = [[s for s in rows if s['procedure_id'] == q['procedure_id'] and s['start_datetime'] < q['end_datetime'] and s['end_datetime'] > q['start_datetime']]
+                 for q in queries]
+    dict_ms = (perf_counter() - started) * 1000
+
+    started = perf_counter()
+    compact_hits = [plan.overlapping(q['procedure_id'], q['start_datetime'], q['end_datetime']) for q in queries]
+    compact_ms = (perf_counter() - started) * 1000
+
+    assert [len(hits) for hits in dict_hits] == [len(hits) for hits in compact_hits]
+
+    print('{} operations, {} overlap queries, NumPy {}'.format(args.operations, args.queries, 'on' if numpy is not None else 'off'))
+    print('{:<12} {:>12} {:>10} {:>12}'.format('plan', 'bytes', 'B/op', 'query ms'))
+    print('{:<12} {:>12} {:>10.1f} {:>12.1f}'.format('dicts', dict_bytes, dict_bytes / args.operations, dict_ms))
+    print('{:<12} {:>12} {:>10.1f} {:>12.1f}'.format('compact', compact_bytes, compact_bytes / args.operations, compact_ms))
+    print('memory {:.1f}x smaller, queries {:.1f}x faster'.format(dict_bytes / compact_bytes, dict_ms / compact_ms))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Reader latency while regenerate_all_schedules holds its write transaction
+
+Seeds a throwaway SQLite database, starts a regeneration in one thread and runs
+the /schedule join in reader threads until it finishes, once per journal mode.
+Each mode runs in its own process because the engine settings are read at import.
+
+    python benchmarks/db_concurrency.py [--jobs 60] [--readers 4] [--modes DELETE WAL]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import date, time, timedelta
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run_mode(jobs, readers):
+    """Runs inside the child process with SQLITE_JOURNAL_MODE and the database URI already set"""
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from app import app
+    from models import db, Job, Procedure, Schedule
+    from scheduler import regenerate_all_schedules
+
+    rng = random.Random(1)
+    with app.app_context():
+        for sequence in range(6):
+            db.session.add(Procedure(sequence=sequence, procedure_name='P{}'.format(sequence), procedure_description='benchmark',
+                                     procedure_plantime=rng.randint(1, 10), procedure_planmanpower=2,
+                                     procedure_is_prod=sequence % 2 == 0, procedure_is_store=sequence % 2 == 1))
+        for number in range(jobs):
+            db.session.add(Job(job_name='J{}'.format(number), job_description='benchmark',
+                               deadline_date=date.today() + timedelta(days=30 + rng.randint(0, 40) // 3), deadline_time=time(12, 0)))
+        db.session.commit()
+        regenerate_all_schedules()
+
+    done = threading.Event()
+    latencies = []
+    errors = []
+
+    def regenerate():
+        with app.app_context():
+            regenerate_all_schedules()
+        done.set()
+
+    def read():
+        with app.app_context():
+            while not done.is_set():
+                started = perf_counter()
+                try:
+                    db.session.query(Schedule, Job.job_name, Procedure.procedure_name).join(Job, Schedule.job_id == Job.id).join(Procedure, Schedule.procedure_id == Procedure.id).all()
+                    latencies.append((perf_counter() - started) * 1000)
+                except Exception as error:
+                    errors.append(type(error).__name__)
+                db.session.rollback()
+
+    reader_threads = [threading.Thread(target=read) for _ in range(readers)]
+    for thread in reader_threads:
+        thread.start()
+    started = perf_counter()
+    writer = threading.Thread(target=regenerate)
+    writer.start()
+    writer.join()
+    regeneration_ms = (perf_counter() - started) * 1000
+    for thread in reader_threads:
+        thread.join()
+
+    print(json.dumps({
+        'regeneration_ms': round(regeneration_ms, 1),
+        'reads': len(latencies),
+        'errors': len(errors),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'max_ms': round(max(latencies, default=0.0), 2)
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=60)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--modes', nargs='+', default=['DELETE', 'WAL'])
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_mode(args.jobs, args.readers)
+        return
+
+    print('{:<8} {:>10} {:>7} {:>7} {:>9} {:>9} {:>9}'.format('mode', 'regen ms', 'reads', 'errors', 'p50 ms', 'p95 ms', 'max ms'))
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ)
+            env['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'benchmark.sqlite3')
+            env['SQLITE_JOURNAL_MODE'] = mode
+            env['PAGE_CACHE_MAX_BYTES'] = '0'
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', '--jobs', str(args.jobs), '--readers', str(args.readers)],
+                env=env, capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print('{:<8} {:>10} {:>7} {:>7} {:>9} {:>9} {:>9}'.format(
+                mode, result['regeneration_ms'], result['reads'], result['errors'], result['p50_ms'], result['p95_ms'], result['max_ms']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Role-based load test for the Flask app
+
+Each worker logs in as one of the seeded users and replays a weighted mix of page
+reads and job/procedure edits until the duration is up. Edits post the current
+form values back unchanged, so every edit still runs a full regeneration without
+drifting the data. Runs in-process through the Flask test client, or against a
+running server with --url.
+
+    python benchmarks/loadtest.py --workers 8 --duration 20
+    python benchmarks/loadtest.py --url http://127.0.0.1:5000 --mix schedule=60,job=20,procedure=15,edit_job=5
+"""
+import argparse
+import http.cookiejar
+import os
+import random
+import re
+import sys
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROLES = ['admin', 'prodmanager', 'storemanager', 'prodsupervisor', 'storesupervisor']
+
+# Operation -> roles allowed to perform it, as checked in routes.py
+OPERATIONS = {
+    'schedule': ROLES,
+    'job': ROLES,
+    'procedure': ['admin', 'prodmanager', 'storemanager'],
+    'edit_job': ['admin', 'prodmanager'],
+    'edit_procedure': ['admin', 'prodmanager', 'storemanager'],
+}
+
+DEFAULT_MIX = 'schedule=50,job=20,procedure=20,edit_job=5,edit_procedure=5'
+
+INPUT_VALUE = re.compile(r'<input[^>]*name="(\w+)"[^>]*value="([^"]*)"')
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, weight = part.split('=')
+        if name not in OPERATIONS:
+            raise SystemExit('Unknown operation {!r}; choose from {}'.format(name, ', '.join(OPERATIONS)))
+        weights[name] = float(weight)
+    return weights
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+class TestClientSession:
+    """Requests through the Flask test client, in this process"""
+    def __init__(self):
+        sys.path.insert(0, ROOT)
+        os.chdir(ROOT)
+        from app import app
+        self.client = app.test_client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, response.get_data(as_text=True)
+
+    def post(self, path, data):
+        response = self.client.post(path, data=data)
+        return response.status_code, response.get_data(as_text=True)
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class HttpSession:
+    """Requests to a running server, keeping the session cookie and not following redirects"""
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect)
+
+    def request(self, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(self.url + path, body) as response:
+                return response.status, response.read().decode('utf-8', 'replace')
+        except urllib.error.HTTPError as error:
+            return error.code, ''
+
+    def get(self, path):
+        return self.request(path)
+
+    def post(self, path, data):
+        return self.request(path, data)
+
+class Worker(threading.Thread):
+    def __init__(self, session, role, weights, deadline, seed, results, lock):
+        super().__init__()
+        self.session = session
+        self.role = role
+        self.operations = [name for name in weights if role in OPERATIONS[name]]
+        self.weights = [weights[name] for name in self.operations]
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.results = results
+        self.lock = lock
+        self.job_ids = []
+        self.procedure_ids = []
+
+    def record(self, name, started, status):
+        elapsed = (perf_counter() - started) * 1000
+        with self.lock:
+            latencies, errors = self.results.setdefault(name, ([], [0]))
+            latencies.append(elapsed)
+            if status >= 400:
+                errors[0] += 1
+
+    def edit(self, kind, ids):
+        """Post an entity's current form values back, timing only the POST"""
+        if not ids:
+            return
+        path = '/{}/{}/edit'.format(kind, self.rng.choice(ids))
+        status, page = self.session.get(path)
+        form = dict(INPUT_VALUE.findall(page))
+        started = perf_counter()
+        status, page = self.session.post(path, form)
+        self.record('edit_' + kind, started, status)
+
+    def run(self):
+        self.session.post('/login', {'email': '{}@gmail.com'.format(self.role), 'password': self.role})
+        self.job_ids = [int(i) for i in re.findall(r'/job/(\d+)/edit', self.session.get('/job')[1])]
+        if 'procedure' in self.operations:
+            self.procedure_ids = [int(i) for i in re.findall(r'/procedure/(\d+)/edit', self.session.get('/procedure')[1])]
+        if not self.operations:
+            return
+
+        while perf_counter() < self.deadline:
+            name = self.rng.choices(self.operations, self.weights)[0]
+            if name == 'edit_job':
+                self.edit('job', self.job_ids)
+            elif name == 'edit_procedure':
+                self.edit('procedure', self.procedure_ids)
+            else:
+                started = perf_counter()
+                status, page = self.session.get('/' + name)
+                self.record(name, started, status)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='server to load instead of the in-process test client')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='operation=weight,... from ' + ', '.join(OPERATIONS))
+    parser.add_argument('--roles', nargs='+', default=ROLES, choices=ROLES, help='assigned to workers in turn')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    results = {}
+    lock = threading.Lock()
+    sessions = [HttpSession(args.url) if args.url else TestClientSession() for _ in range(args.workers)]
+
+    started = perf_counter()
+    deadline = started + args.duration
+    workers = [Worker(session, args.roles[index % len(args.roles)], weights, deadline, args.seed + index, results, lock)
+               for index, session in enumerate(sessions)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = perf_counter() - started
+
+    print('{} workers for {:.1f} s against {}'.format(args.workers, elapsed, args.url or 'the test client'))
+    print('{:<16} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9}'.format('route', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    all_latencies = []
+    all_errors = 0
+    for name in OPERATIONS:
+        if name not in results:
+            continue
+        latencies, errors = results[name]
+        all_latencies.extend(latencies)
+        all_errors += errors[0]
+        print('{:<16} {:>8} {:>7} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+            name, len(latencies), errors[0], len(latencies) / elapsed,
+            percentile(latencies, 0.50), percentile(latencies, 0.95), percentile(latencies, 0.99)))
+    print('{:<16} {:>8} {:>7} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+        'total', len(all_latencies), all_errors, len(all_latencies) / elapsed,
+        percentile(all_latencies, 0.50), percentile(all_latencies, 0.95), percentile(all_latencies, 0.99)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Replan cost of one plant's edit against replanning every plant
+
+Seeds a database with several plants of the same size, each with its own procedures,
+jobs and a shutdown week of its own, then times regenerating a single plant (what
+an edit page does) and regenerating every plant, and checks that each plant's plan
+is the same whichever way it was made. Plants are regenerated concurrently only on
+a server database (SCHEDULER_PLANT_WORKERS), so pass --database to measure that;
+the default throwaway SQLite database goes one plant at a time.
+
+    python benchmarks/plant_regeneration.py [--plants 4] [--jobs 60] [--database postgresql://...]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import date, time, timedelta
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def seed(plants, jobs, procedures):
+    from models import db, Plant, Job, Procedure, Holiday
+    from plants import DEFAULT_PLANT_ID
+    from work_calendar import add_default_shifts
+    rng = random.Random(1)
+    plant_ids = [DEFAULT_PLANT_ID]
+    for number in range(1, plants):
+        plant = Plant(plant_name='Benchmark plant {}'.format(number))
+        db.session.add(plant)
+        db.session.flush()
+        add_default_shifts(plant.id)
+        plant_ids.append(plant.id)
+    for index, plant_id in enumerate(plant_ids):
+        for sequence in range(procedures):
+            db.session.add(Procedure(plant_id=plant_id, sequence=sequence, procedure_name='P{}'.format(sequence), procedure_description='benchmark',
+                                     procedure_plantime=rng.randint(1, 10), procedure_planmanpower=2,
+                                     procedure_is_prod=sequence % 2 == 0, procedure_is_store=sequence % 2 == 1))
+        for number in range(jobs):
+            db.session.add(Job(plant_id=plant_id, job_name='J{}'.format(number), job_description='benchmark',
+                               deadline_date=date.today() + timedelta(days=30 + rng.randint(0, 40) // 3), deadline_time=time(12, 0)))
+        shutdown = date.today() + timedelta(days=7 * (index + 1))
+        db.session.add(Holiday(plant_id=plant_id, holiday_name='Shutdown', start_date=shutdown, end_date=shutdown + timedelta(days=6)))
+    db.session.commit()
+    return plant_ids
+
+def plans(plant_ids):
+    """Each plant's plan as a sorted list of (job ID, procedure ID, start, end)"""
+    from plants import plant_schedules
+    return {plant_id: sorted((row.job_id, row.procedure_id, row.start_datetime, row.end_datetime) for row in plant_schedules(plant_id).all())
+            for plant_id in plant_ids}
+
+def timed(func, *args):
+    started = perf_counter()
+    func(*args)
+    return (perf_counter() - started) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--plants', type=int, default=4)
+    parser.add_argument('--jobs', type=int, default=60, help='Jobs per plant')
+    parser.add_argument('--procedures', type=int, default=6, help='Procedures per plant')
+    parser.add_argument('--database', default=None, help='Empty database to seed (default: a throwaway SQLite file)')
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    os.environ['SQLALCHEMY_DATABASE_URI'] = args.database or 'sqlite:///' + os.path.join(directory.name, 'benchmark.sqlite3')
+    os.environ['PAGE_CACHE_MAX_BYTES'] = '0'
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from app import app
+    from models import db
+    from work_calendar import invalidate_calendar
+    import scheduler
+
+    with app.app_context():
+        plant_ids = seed(args.plants, args.jobs, args.procedures)
+        invalidate_calendar()
+        scheduler.regenerate_all_schedules()
+        all_plans = plans(plant_ids)
+
+        single = [timed(scheduler.regenerate_all_schedules, plant_id) for plant_id in plant_ids]
+        same = plans(plant_ids) == all_plans
+        db.session.commit()
+        every = timed(scheduler.regenerate_all_schedules)
+        db.session.expire_all()
+        same = same and plans(plant_ids) == all_plans
+
+    concurrent = not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') and min(app.config['SCHEDULER_PLANT_WORKERS'], len(plant_ids)) > 1
+    print('{} plants of {} jobs on {} procedures, engine {}'.format(len(plant_ids), args.jobs, args.procedures, app.config['SCHEDULER_ENGINE']))
+    print('  one plant (an edit):   {:8.1f} ms mean, {:.1f} ms max'.format(sum(single) / len(single), max(single)))
+    print('  every plant:           {:8.1f} ms ({})'.format(every, 'concurrently' if concurrent else 'one at a time'))
+    print('  plans identical either way: {}'.format('yes' if same else 'NO'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Replay a captured change journal through the scheduler, offline and at full speed
+
+Reads a journal exported with `flask export-journal journal.jsonl` into a throwaway
+SQLite database and applies it one transaction (batch) at a time, regenerating the
+schedule of each plant the batch touched after it like the edit pages do, with no
+pauses between edits. Prints the regeneration time and SQL statements per batch, so
+engines and changes can be compared on the real production edit stream. The throwaway
+database has the default shift calendar and no routings, as neither is journaled.
+
+    python benchmarks/replay_journal.py journal.jsonl [--engine greedy] [--limit 500]
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+def replay(app, batches):
+    """Apply every batch and regenerate after each; returns (elapsed seconds, SQL statements) per batch"""
+    from journal import apply_entry
+    from models import db
+    from plants import DEFAULT_PLANT_ID, use_plant
+    from profiling import run_profiled
+    import scheduler
+
+    runs = []
+    with app.app_context():
+        for batch in batches:
+            for entry in batch:
+                apply_entry(entry)
+            db.session.flush()
+            elapsed = statements = 0
+            for plant_id in sorted({entry['values'].get('plant_id', DEFAULT_PLANT_ID) for entry in batch}):
+                with use_plant(plant_id):
+                    schedules, profile, plant_elapsed, dump_path = run_profiled(scheduler.build_all_schedules)
+                elapsed += plant_elapsed
+                statements += profile.sql_statements
+            runs.append((elapsed, statements))
+        db.session.remove()
+    return runs
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('journal', type=argparse.FileType('r', encoding='utf-8'))
+    parser.add_argument('--engine', choices=['chain', 'greedy', 'lanes'], default=None, help='SCHEDULER_ENGINE for the replay (default: as configured)')
+    parser.add_argument('--limit', type=int, default=None, help='Replay only the first LIMIT batches')
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory.name, 'replay.sqlite3')
+    os.environ['PAGE_CACHE_MAX_BYTES'] = '0'
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from app import app
+    from journal import read_batches
+
+    batches = read_batches(args.journal)[:args.limit]
+    if args.engine:
+        app.config['SCHEDULER_ENGINE'] = args.engine
+    print('{} batches, {} journal entries, engine {}'.format(len(batches), sum(len(batch) for batch in batches), app.config['SCHEDULER_ENGINE']))
+    runs = replay(app, batches)
+    if not runs:
+        return
+    elapsed = [seconds * 1000 for seconds, statements in runs]
+    print('regenerations: {:.2f} s in total, mean {:.1f} ms, p50 {:.1f} ms, p95 {:.1f} ms, max {:.1f} ms'.format(
+        sum(elapsed) / 1000, sum(elapsed) / len(elapsed), percentile(elapsed, 0.5), percentile(elapsed, 0.95), max(elapsed)))
+    print('SQL statements per regeneration: mean {:.1f}, max {}'.format(
+        sum(statements for seconds, statements in runs) / len(runs), max(statements for seconds, statements in runs)))
+
+if __name__ == '__main__':
+    main()
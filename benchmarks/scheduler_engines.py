@@ -0,0 +1,89 @@
+"""
+Searches per job of the single-pass scheduler against the original fallback chain
+
+Seeds a throwaway SQLite database with jobs whose deadlines cluster so procedures
+are contended, then regenerates it once per engine with profiling on. Slot searches
+are calls to the find_* slot functions for the chain (its overlap re-checks show up
+as SQL statements instead), and free-slot lookups on the conflict model for the
+single pass, which searches each operation once unless its job is right-shifted.
+
+    python benchmarks/scheduler_engines.py [--jobs 60] [--procedures 6] [--engines chain greedy]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import date, time, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def count_calls(cls, names, counts):
+    """Wrap methods of a class to count their calls into counts"""
+    for name in names:
+        method = getattr(cls, name)
+        def counted(*args, _method=method, **kwargs):
+            counts[0] += 1
+            return _method(*args, **kwargs)
+        setattr(cls, name, counted)
+
+def seed(jobs, procedures):
+    from models import db, Job, Procedure
+    rng = random.Random(1)
+    for sequence in range(procedures):
+        db.session.add(Procedure(sequence=sequence, procedure_name='P{}'.format(sequence), procedure_description='benchmark',
+                                 procedure_plantime=rng.randint(1, 10), procedure_planmanpower=2,
+                                 procedure_is_prod=sequence % 2 == 0, procedure_is_store=sequence % 2 == 1))
+    for number in range(jobs):
+        db.session.add(Job(job_name='J{}'.format(number), job_description='benchmark',
+                           deadline_date=date.today() + timedelta(days=30 + rng.randint(0, 40) // 3), deadline_time=time(12, 0)))
+    db.session.commit()
+
+def plan_quality(rows, target_datetimes):
+    """(overlapping operation pairs, late jobs) of the persisted plan"""
+    rows = sorted(rows, key=lambda row: (row.procedure_id, row.start_datetime))
+    overlaps = sum(1 for a, b in zip(rows, rows[1:]) if a.procedure_id == b.procedure_id and b.start_datetime < a.end_datetime)
+    job_ends = {}
+    for row in rows:
+        job_ends[row.job_id] = max(job_ends.get(row.job_id, row.end_datetime), row.end_datetime)
+    late = sum(1 for job_id, end in job_ends.items() if end > target_datetimes[job_id])
+    return overlaps, late
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=60)
+    parser.add_argument('--procedures', type=int, default=6)
+    parser.add_argument('--engines', nargs='+', default=['chain', 'greedy'], choices=['chain', 'greedy', 'lanes'])
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory.name, 'benchmark.sqlite3')
+    os.environ['PAGE_CACHE_MAX_BYTES'] = '0'
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from app import app
+    from models import Job, Schedule
+    from conflict_model import ConflictModel
+    from profiling import run_profiled
+    import scheduler
+
+    model_searches = [0]
+    count_calls(ConflictModel, ['latest_free_end', 'earliest_free_start'], model_searches)
+
+    with app.app_context():
+        seed(args.jobs, args.procedures)
+        target_datetimes = {job.id: scheduler.get_completion_target_datetime(job.deadline_date, job.deadline_time) for job in Job.query.all()}
+        print('{} jobs on {} procedures'.format(args.jobs, args.procedures))
+        print('{:<8} {:>9} {:>9} {:>10} {:>12} {:>9} {:>6}'.format('engine', 'regen ms', 'SQL', 'searches', 'searches/job', 'overlaps', 'late'))
+        for engine in args.engines:
+            app.config['SCHEDULER_ENGINE'] = engine
+            model_searches[0] = 0
+            schedules, profile, elapsed, dump_path = run_profiled(scheduler.build_all_schedules)
+            chain_searches = sum(calls for name, calls in profile.calls.items() if name.startswith('find_'))
+            searches = chain_searches + model_searches[0]
+            overlaps, late = plan_quality(Schedule.query.all(), target_datetimes)
+            print('{:<8} {:>9.1f} {:>9} {:>10} {:>12.1f} {:>9} {:>6}'.format(
+                engine, elapsed * 1000, profile.sql_statements, searches, searches / args.jobs, overlaps, late))
+
+if __name__ == '__main__':
+    main()
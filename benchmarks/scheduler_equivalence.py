@@ -0,0 +1,267 @@
+"""
+Check scheduling engines against the frozen reference plan on random inputs
+
+Generates random procedure, job, routing and holiday sets, biased towards weekend
+and holiday deadlines, operations that cross the lunch break or run over several
+days, and jobs contending for the same deadline. Each case is seeded into a throwaway
+SQLite database and planned by each engine (regenerate with SCHEDULER_ENGINE set),
+then compared operation by operation with scheduler_reference. Every plan is also
+checked for operations ending before they start, overlaps on a procedure, operations
+out of sequence within a job, operations starting or ending outside get_working_hours
+blocks and operations whose working time is not their planned time. A failing case is shrunk to a minimal one,
+printed as JSON and can be run again with --case.
+
+    python benchmarks/scheduler_equivalence.py [--cases 200] [--seed 1] [--engines greedy lanes]
+    python benchmarks/scheduler_equivalence.py --engines chain --allow-better
+    python benchmarks/scheduler_equivalence.py --case failing.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PLANTIMES = [0, 1, 2, 3, 4, 5, 8, 9, 12]
+DEADLINE_TIMES = ['00:00', '08:15', '12:59', '13:00', '13:30', '17:00', '23:59']
+MAX_SHRINK_STEPS = 500
+
+def random_case(rng, first_day):
+    """A random case as JSON-ready data; procedures and routing steps refer to procedures by index"""
+    procedure_count = rng.randint(1, 5)
+    procedures = [[sequence, rng.choice(PLANTIMES) if rng.random() > 0.02 else 500] for sequence in rng.sample(range(10), procedure_count)]
+    shared_deadlines = [first_day + timedelta(days=rng.randint(0, 21)) for _ in range(2)]
+    jobs = []
+    for _ in range(rng.randint(1, 10)):
+        if rng.random() < 0.4:
+            deadline = rng.choice(shared_deadlines)
+        else:
+            deadline = first_day + timedelta(days=rng.randint(0, 21))
+            if rng.random() < 0.3:
+                deadline += timedelta(days=(rng.choice([5, 6, 0]) - deadline.weekday()) % 7)  # Saturday, Sunday or Monday
+        deadline_time = rng.choice(DEADLINE_TIMES) if rng.random() < 0.7 else '{:02d}:{:02d}'.format(rng.randint(0, 23), rng.randint(0, 59))
+        routing = None
+        if rng.random() < 0.3:
+            indexes = rng.sample(range(procedure_count), rng.randint(1, procedure_count))
+            routing = [[index, sequence, rng.choice(PLANTIMES) if rng.random() < 0.5 else None]
+                       for index, sequence in zip(indexes, rng.sample(range(10), len(indexes)))]
+        jobs.append({'deadline': deadline.isoformat(), 'time': deadline_time, 'routing': routing})
+    holidays = []
+    if rng.random() < 0.3:
+        for _ in range(rng.randint(1, 2)):
+            deadline = date.fromisoformat(rng.choice(jobs)['deadline'])
+            holidays.append((deadline - timedelta(days=rng.randint(0, 3))).isoformat())
+    return {'procedures': procedures, 'jobs': jobs, 'holidays': holidays}
+
+def seed_case(case):
+    """Replace the database contents with a case"""
+    from models import db, Job, Procedure, Schedule, ScheduleSegment, UnscheduledJob, JobRouting, Holiday, ProcedureLoad, PlanKpi, ChangeJournal
+    from work_calendar import invalidate_calendar
+    for model in (ScheduleSegment, Schedule, UnscheduledJob, JobRouting, ProcedureLoad, PlanKpi, ChangeJournal, Job, Procedure, Holiday):
+        model.query.delete()
+    procedures = [Procedure(sequence=sequence, procedure_name='P{}'.format(index), procedure_description='fuzz',
+                            procedure_plantime=plantime, procedure_planmanpower=1, procedure_is_prod=True, procedure_is_store=False)
+                  for index, (sequence, plantime) in enumerate(case['procedures'])]
+    db.session.add_all(procedures)
+    db.session.flush()
+    for index, job_case in enumerate(case['jobs']):
+        job = Job(job_name='J{}'.format(index), job_description='fuzz', deadline_date=date.fromisoformat(job_case['deadline']),
+                  deadline_time=datetime.strptime(job_case['time'], '%H:%M').time())
+        db.session.add(job)
+        db.session.flush()
+        for procedure_index, sequence, plantime in job_case['routing'] or []:
+            db.session.add(JobRouting(job_id=job.id, procedure_id=procedures[procedure_index].id, sequence=sequence, plantime=plantime))
+    for index, day in enumerate(case['holidays']):
+        db.session.add(Holiday(holiday_name='H{}'.format(index), start_date=date.fromisoformat(day), end_date=date.fromisoformat(day)))
+    db.session.commit()
+    invalidate_calendar()
+
+def working_minutes_between(start, end):
+    """Working minutes in [start, end), walking get_working_hours day by day"""
+    from scheduler import get_working_hours
+    minutes = 0
+    day = start.date()
+    while day <= end.date():
+        for block_start, block_end in get_working_hours(day):
+            overlap = min(end, block_end) - max(start, block_start)
+            if overlap > timedelta(0):
+                minutes += overlap // timedelta(minutes=1)
+        day += timedelta(days=1)
+    return minutes
+
+def in_working_block(moment, at_end):
+    from scheduler import get_working_hours
+    return any((block_start < moment <= block_end) if at_end else (block_start <= moment < block_end)
+               for block_start, block_end in get_working_hours(moment.date()))
+
+def invariant_violations(operations, unscheduled, jobs, procedures, routing_steps):
+    """What is wrong with a plan, whatever engine made it"""
+    from scheduler_reference import reference_operations
+    violations = []
+    by_procedure = {}
+    for job_id, procedure_id, start, end in operations:
+        if end < start:
+            violations.append('Job {} procedure {} ends {} before it starts {}'.format(job_id, procedure_id, end, start))
+        elif end > start:
+            by_procedure.setdefault(procedure_id, []).append((start, end, job_id))
+    for procedure_id, intervals in by_procedure.items():
+        intervals.sort()
+        for (start_a, end_a, job_a), (start_b, end_b, job_b) in zip(intervals, intervals[1:]):
+            if start_b < end_a:
+                violations.append('Overlap on procedure {}: job {} {}-{} and job {} {}-{}'.format(procedure_id, job_a, start_a, end_a, job_b, start_b, end_b))
+
+    by_job = {}
+    for job_id, procedure_id, start, end in operations:
+        by_job.setdefault(job_id, {})[procedure_id] = (start, end)
+    for job in jobs:
+        expected = reference_operations(job, procedures, routing_steps)
+        placed = by_job.get(job.id, {})
+        if job.id in unscheduled or not expected:
+            if placed:
+                violations.append('Job {} is unscheduled but has operations'.format(job.id))
+            continue
+        if set(placed) != {operation.procedure_id for operation in expected}:
+            violations.append('Job {} has operations on {} instead of {}'.format(job.id, sorted(placed), sorted(operation.procedure_id for operation in expected)))
+            continue
+        previous_end = None
+        for operation in expected:
+            start, end = placed[operation.procedure_id]
+            if previous_end is not None and start < previous_end:
+                violations.append('Job {} procedure {} starts {} before the previous operation ends {}'.format(job.id, operation.procedure_id, start, previous_end))
+            previous_end = end
+            if operation.plantime:
+                if not in_working_block(start, False) or not in_working_block(end, True):
+                    violations.append('Job {} procedure {} {}-{} is outside working hours'.format(job.id, operation.procedure_id, start, end))
+                elif working_minutes_between(start, end) != operation.plantime * 60:
+                    violations.append('Job {} procedure {} {}-{} has {} working minutes, not {}'.format(
+                        job.id, operation.procedure_id, start, end, working_minutes_between(start, end), operation.plantime * 60))
+    return violations
+
+def tardiness(operations, jobs):
+    """Total working minutes jobs finish after their completion target"""
+    from scheduler import get_completion_target_datetime
+    from work_calendar import to_working_minute
+    ends = {}
+    for job_id, procedure_id, start, end in operations:
+        ends[job_id] = max(ends.get(job_id, end), end)
+    targets = {job.id: get_completion_target_datetime(job.deadline_date, job.deadline_time) for job in jobs}
+    return sum(max(0, to_working_minute(end) - to_working_minute(targets[job_id])) for job_id, end in ends.items())
+
+def check_case(app, case, engine, allow_better):
+    """
+    Plan a case with an engine and the reference
+    Returns (problems, better): problems is empty when the plans match, or when
+    allow_better and the engine's plan is sound, schedules no fewer jobs and is less late
+    """
+    from models import db, Job, Procedure, Schedule, UnscheduledJob, JobRouting
+    from scheduler import build_all_schedules
+    from scheduler_reference import reference_plan
+
+    with app.app_context():
+        seed_case(case)
+        app.config['SCHEDULER_ENGINE'] = engine
+        build_all_schedules()
+        jobs = Job.query.all()
+        procedures = Procedure.query.order_by(Procedure.sequence).all()
+        routing_steps = JobRouting.query.all()
+        operations = {(row.job_id, row.procedure_id, row.start_datetime, row.end_datetime) for row in Schedule.query.all()}
+        unscheduled = {row.job_id: row.precheck for row in UnscheduledJob.query.all()}
+        expected_operations, expected_unscheduled = reference_plan(jobs, procedures, routing_steps)
+
+        problems = ['Reference: ' + violation for violation in invariant_violations(expected_operations, expected_unscheduled, jobs, procedures, routing_steps)]
+        problems += invariant_violations(operations, unscheduled, jobs, procedures, routing_steps)
+        if operations == expected_operations and unscheduled == expected_unscheduled:
+            return problems, False
+        if allow_better and not problems and len(unscheduled) <= len(expected_unscheduled) and tardiness(operations, jobs) < tardiness(expected_operations, jobs):
+            return [], True
+        if unscheduled != expected_unscheduled:
+            problems.append('Unscheduled jobs {} instead of {}'.format(unscheduled, expected_unscheduled))
+        for job_id, procedure_id, start, end in sorted(operations - expected_operations)[:5]:
+            problems.append('Job {} procedure {}: {}-{} not in the reference plan'.format(job_id, procedure_id, start, end))
+        for job_id, procedure_id, start, end in sorted(expected_operations - operations)[:5]:
+            problems.append('Job {} procedure {}: reference plans {}-{}'.format(job_id, procedure_id, start, end))
+        return problems, False
+
+def smaller_cases(case):
+    """Cases with one thing removed or reduced, biggest reductions first"""
+    for index in range(len(case['jobs'])):
+        yield dict(case, jobs=case['jobs'][:index] + case['jobs'][index + 1:])
+    for index in range(len(case['holidays'])):
+        yield dict(case, holidays=case['holidays'][:index] + case['holidays'][index + 1:])
+    if len(case['procedures']) > 1:
+        for index in range(len(case['procedures'])):
+            def without(routing):
+                if routing is None:
+                    return None
+                return [[i - (i > index), sequence, plantime] for i, sequence, plantime in routing if i != index] or None
+            yield dict(case, procedures=case['procedures'][:index] + case['procedures'][index + 1:],
+                       jobs=[dict(job, routing=without(job['routing'])) for job in case['jobs']])
+    for index, job in enumerate(case['jobs']):
+        if job['routing'] is not None:
+            yield dict(case, jobs=case['jobs'][:index] + [dict(job, routing=None)] + case['jobs'][index + 1:])
+    for index, (sequence, plantime) in enumerate(case['procedures']):
+        if plantime > 0:
+            yield dict(case, procedures=case['procedures'][:index] + [[sequence, plantime // 2]] + case['procedures'][index + 1:])
+
+def shrink(app, case, engine, allow_better):
+    """Remove and reduce parts of a failing case for as long as it keeps failing"""
+    steps = 0
+    while steps < MAX_SHRINK_STEPS:
+        for smaller in smaller_cases(case):
+            steps += 1
+            if check_case(app, smaller, engine, allow_better)[0]:
+                case = smaller
+                break
+        else:
+            break
+    return case
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--engines', nargs='+', default=['greedy', 'lanes'], choices=['chain', 'greedy', 'lanes'])
+    parser.add_argument('--allow-better', action='store_true', help='Accept a different plan that is sound and less late')
+    parser.add_argument('--case', type=argparse.FileType('r', encoding='utf-8'), help='Check one case saved from a failure')
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory.name, 'equivalence.sqlite3')
+    os.environ['PAGE_CACHE_MAX_BYTES'] = '0'
+    os.environ['SCHEDULER_OPTIMIZER'] = 'off'
+    os.environ['SCHEDULER_FREEZE_WINDOW'] = 'False'
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from app import app
+
+    if args.case:
+        cases = [json.load(args.case)]
+    else:
+        rng = random.Random(args.seed)
+        first_day = date.today() + timedelta(days=7)
+        cases = [random_case(rng, first_day) for _ in range(args.cases)]
+
+    failed = 0
+    for engine in args.engines:
+        passed = better = 0
+        for number, case in enumerate(cases):
+            problems, is_better = check_case(app, case, engine, args.allow_better)
+            if not problems:
+                passed += 1
+                better += is_better
+                continue
+            failed += 1
+            minimal = shrink(app, case, engine, args.allow_better)
+            print('{} case {} failed; minimal case:'.format(engine, number))
+            print(json.dumps(minimal))
+            for problem in check_case(app, minimal, engine, args.allow_better)[0]:
+                print('  ' + problem)
+        print('{:<8} {} of {} cases match the reference{}'.format(
+            engine, passed, len(cases), ' ({} of them deliberately better)'.format(better) if args.allow_better else ''))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Template compile time after a restart and per-page render time, with and without template caching
+
+Compile: loads every template in a fresh Jinja environment, as a restarted worker
+does, once compiling from source and once from a warm bytecode cache. Render: requests
+each page as each seeded role through the Flask test client (page cache off) and times
+only the template rendering, with the navigation bar rendered every time and then
+cached per role combination.
+
+    python benchmarks/template_render.py [--jobs 20] [--repeat 50]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import date, time, timedelta
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROLES = ['admin', 'prodmanager', 'storemanager', 'prodsupervisor', 'storesupervisor']
+
+PAGES = ['/schedule', '/job', '/procedure', '/progress', '/profile']
+
+def seed(jobs):
+    from models import db, Job, Procedure
+    rng = random.Random(1)
+    for sequence in range(6):
+        db.session.add(Procedure(sequence=sequence, procedure_name='P{}'.format(sequence), procedure_description='benchmark',
+                                 procedure_plantime=rng.randint(1, 10), procedure_planmanpower=2,
+                                 procedure_is_prod=sequence % 2 == 0, procedure_is_store=sequence % 2 == 1))
+    for number in range(jobs):
+        db.session.add(Job(job_name='J{}'.format(number), job_description='benchmark',
+                           deadline_date=date.today() + timedelta(days=30 + rng.randint(0, 40) // 3), deadline_time=time(12, 0)))
+    db.session.commit()
+
+def compile_ms(app, bytecode_cache):
+    """Milliseconds to load every template in a new environment, as after a restart"""
+    from jinja2 import Environment
+    environment = Environment(loader=app.jinja_loader, bytecode_cache=bytecode_cache)
+    started = perf_counter()
+    for name in app.jinja_loader.list_templates():
+        environment.get_template(name)
+    return (perf_counter() - started) * 1000
+
+def render_ms(app, repeat):
+    """Mean template render milliseconds per page request over every role and page"""
+    from flask import before_render_template, template_rendered
+    timings = []
+    started = []
+
+    def before(sender, template, context, **extra):
+        started.append(perf_counter())
+
+    def after(sender, template, context, **extra):
+        timings.append(perf_counter() - started.pop())
+
+    before_render_template.connect(before, app)
+    template_rendered.connect(after, app)
+    try:
+        for role in ROLES:
+            client = app.test_client()
+            client.post('/login', data={'email': '{}@gmail.com'.format(role), 'password': role})
+            for _ in range(repeat):
+                for page in PAGES:
+                    client.get(page)
+    finally:
+        before_render_template.disconnect(before, app)
+        template_rendered.disconnect(after, app)
+    return sum(timings) * 1000 / len(timings), len(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory.name, 'benchmark.sqlite3')
+    os.environ['PAGE_CACHE_MAX_BYTES'] = '0'
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from jinja2 import FileSystemBytecodeCache
+    from app import app
+    import scheduler
+
+    with app.app_context():
+        seed(args.jobs)
+        scheduler.regenerate_all_schedules()
+
+    bytecode_cache = FileSystemBytecodeCache(directory.name)
+    compile_ms(app, bytecode_cache)  # Fills the bytecode cache
+    print('{} templates loaded after a restart'.format(len(app.jinja_loader.list_templates())))
+    print('  from source:         {:8.1f} ms'.format(compile_ms(app, None)))
+    print('  from bytecode cache: {:8.1f} ms'.format(compile_ms(app, bytecode_cache)))
+
+    print('Template render per page ({} roles x {} pages x {})'.format(len(ROLES), len(PAGES), args.repeat))
+    for label, nav_cache in (('navigation rendered', False), ('navigation cached', True)):
+        app.config['TEMPLATE_NAV_CACHE'] = nav_cache
+        mean, renders = render_ms(app, args.repeat)
+        print('  {:<20} {:8.3f} ms over {} renders'.format(label + ':', mean, renders))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+import csv
+import io
+from datetime import datetime, date
+
+from plants import DEFAULT_PLANT_ID
+
+JOB_COLUMNS = ['job_name', 'job_description', 'deadline_date', 'deadline_time']
+PROCEDURE_COLUMNS = ['sequence', 'procedure_name', 'procedure_description', 'procedure_plantime', 'procedure_planmanpower']
+PROCEDURE_TYPES = ('prod', 'store')
+
+def get_models():
+    """Get model classes and db object - lazy import to avoid circular imports"""
+    from models import Job, Procedure, db
+    return Job, Procedure, db
+
+def read_csv(text, columns):
+    """
+    Rows of a CSV file as (line number, dict), or an error when required columns are missing
+    An optional id column edits the row with that ID instead of adding one
+    """
+    reader = csv.DictReader(io.StringIO(text.lstrip('\ufeff')))
+    missing = [column for column in columns if column not in (reader.fieldnames or [])]
+    if missing:
+        return None, ['Missing column(s): {}.'.format(', '.join(missing))]
+    return [(reader.line_num, {key: (value or '').strip() for key, value in row.items() if key}) for row in reader], []
+
+def parse_id(row, model, errors, line, plant_id):
+    """Existing row of the plant to edit for an id column, or None to add a new one"""
+    row_id = row.get('id', '')
+    if row_id == '':
+        return None
+    if not row_id.isdigit():
+        errors.append('Line {}: ID must be a valid number.'.format(line))
+        return None
+    existing = model.query.get(int(row_id))
+    if not existing:
+        errors.append('Line {}: {} {} not found.'.format(line, model.__name__, row_id))
+    elif existing.plant_id != plant_id:
+        errors.append('Line {}: {} {} belongs to another plant.'.format(line, model.__name__, row_id))
+    return existing
+
+def parse_jobs(text, plant_id=DEFAULT_PLANT_ID):
+    """
+    Validate a whole jobs CSV for a plant before anything is written
+    Returns (list of (existing job or None, values), list of per-line errors)
+    """
+    Job, Procedure, db = get_models()
+    rows, errors = read_csv(text, JOB_COLUMNS)
+    if rows is None:
+        return [], errors
+
+    parsed = []
+    for line, row in rows:
+        existing = parse_id(row, Job, errors, line, plant_id)
+        if row['job_name'] == '':
+            errors.append('Line {}: Job Name cannot be empty.'.format(line))
+        if row['job_description'] == '':
+            errors.append('Line {}: Job Description cannot be empty.'.format(line))
+        try:
+            deadline_date = date.fromisoformat(row['deadline_date'])
+        except ValueError:
+            errors.append('Line {}: Completion Date must be a valid date.'.format(line))
+            continue
+        try:
+            deadline_time = datetime.strptime(row['deadline_time'], '%H:%M').time()
+        except ValueError:
+            errors.append('Line {}: Completion Time must be a valid time.'.format(line))
+            continue
+        parsed.append((existing, {'plant_id': plant_id, 'job_name': row['job_name'], 'job_description': row['job_description'], 'deadline_date': deadline_date, 'deadline_time': deadline_time}))
+    return parsed, errors
+
+def parse_procedures(text, procedure_type=None, plant_id=DEFAULT_PLANT_ID):
+    """
+    Validate a whole procedures CSV for a plant before anything is written
+    procedure_type (prod or store) is read from its column, or kept from the procedure
+    being edited, unless given here for managers who may only add and edit
+    procedures of their own type
+    Returns (list of (existing procedure or None, values), list of per-line errors)
+    """
+    Job, Procedure, db = get_models()
+    rows, errors = read_csv(text, PROCEDURE_COLUMNS)
+    if rows is None:
+        return [], errors
+
+    parsed = []
+    for line, row in rows:
+        error_count = len(errors)
+        existing = parse_id(row, Procedure, errors, line, plant_id)
+        if row['procedure_name'] == '':
+            errors.append('Line {}: Procedure Name cannot be empty.'.format(line))
+        if row['procedure_description'] == '':
+            errors.append('Line {}: Procedure Description cannot be empty.'.format(line))
+        if not row['procedure_plantime'].isdigit():
+            errors.append('Line {}: Procedure Plan Time must be a valid number.'.format(line))
+        if not row['procedure_planmanpower'].isdigit():
+            errors.append('Line {}: Procedure Plan Manpower must be a valid number.'.format(line))
+        if not row['sequence'].isdigit():
+            errors.append('Line {}: Sequence must be a valid number.'.format(line))
+        row_type = procedure_type or row.get('procedure_type', '')
+        if row_type == '' and existing:
+            row_type = 'prod' if existing.procedure_is_prod else 'store'
+        if row_type not in PROCEDURE_TYPES:
+            errors.append('Line {}: Procedure Type must be prod or store.'.format(line))
+        elif procedure_type and existing and not (existing.procedure_is_prod if procedure_type == 'prod' else existing.procedure_is_store):
+            errors.append('Line {}: You can only edit {} procedures.'.format(line, procedure_type))
+        if len(errors) > error_count:
+            continue
+        parsed.append((existing, {
+            'plant_id': plant_id,
+            'sequence': int(row['sequence']),
+            'procedure_name': row['procedure_name'],
+            'procedure_description': row['procedure_description'],
+            'procedure_plantime': int(row['procedure_plantime']),
+            'procedure_planmanpower': int(row['procedure_planmanpower']),
+            'procedure_is_prod': row_type == 'prod',
+            'procedure_is_store': row_type == 'store'
+        }))
+    return parsed, errors
+
+def apply_rows(model, parsed, plant_id=DEFAULT_PLANT_ID):
+    """
+    Add or edit every parsed row of a plant and replan the plant once, all in one transaction
+    regenerate_all_schedules commits the rows together with the new plan, so a
+    failure part way leaves neither. Returns (added, updated)
+    """
+    from scheduler import regenerate_all_schedules
+    Job, Procedure, db = get_models()
+
+    added = updated = 0
+    try:
+        for existing, values in parsed:
+            if existing is None:
+                db.session.add(model(**values))
+                added += 1
+            else:
+                for key, value in values.items():
+                    setattr(existing, key, value)
+                updated += 1
+        db.session.flush()
+        regenerate_all_schedules(plant_id)
+    except Exception:
+        db.session.rollback()
+        raise
+    return added, updated
+
+def import_csv(kind, text, procedure_type=None, plant_id=DEFAULT_PLANT_ID):
+    """
+    Validate and apply a jobs or procedures CSV, every row in one plant
+    Returns (added, updated, errors); nothing is written when there are errors
+    """
+    Job, Procedure, db = get_models()
+    if kind == 'jobs':
+        model = Job
+        parsed, errors = parse_jobs(text, plant_id)
+    else:
+        model = Procedure
+        parsed, errors = parse_procedures(text, procedure_type, plant_id)
+    if errors:
+        return 0, 0, errors
+    if not parsed:
+        return 0, 0, ['The file has no rows.']
+    added, updated = apply_rows(model, parsed, plant_id)
+    return added, updated, []
@@ -0,0 +1,74 @@
+import json
+from time import perf_counter
+
+import click
+
+from app import app
+from bulk_import import import_csv
+from journal import entry_dict
+from integrity import CHECKS, check_schedule
+from plants import DEFAULT_PLANT_ID, use_plant, plant_ids
+from work_calendar import add_default_shifts
+
+@app.cli.command('import-csv')
+@click.argument('kind', type=click.Choice(['jobs', 'procedures']))
+@click.argument('csv_file', type=click.File('r', encoding='utf-8'))
+@click.option('--plant', 'plant_id', type=int, default=DEFAULT_PLANT_ID, help='Plant ID the rows belong to.')
+def import_csv_command(kind, csv_file, plant_id):
+    """Import jobs or procedures of a plant from a CSV file in one transaction, then regenerate the plant once"""
+    from models import Plant, db
+    if db.session.get(Plant, plant_id) is None:
+        raise click.ClickException('Plant {} not found.'.format(plant_id))
+    added, updated, errors = import_csv(kind, csv_file.read(), plant_id=plant_id)
+    if errors:
+        for error in errors:
+            click.echo(error, err=True)
+        raise click.ClickException('Nothing was imported.')
+    click.echo('Imported {} new and {} updated {}.'.format(added, updated, kind))
+
+@app.cli.command('export-journal')
+@click.argument('out_file', type=click.File('w', encoding='utf-8'))
+@click.option('--since', type=int, default=0, help='Only entries after this journal ID.')
+def export_journal_command(out_file, since):
+    """Write the change journal as JSON lines, oldest first, for benchmarks/replay_journal.py"""
+    from models import ChangeJournal
+    exported = 0
+    for entry in ChangeJournal.query.filter(ChangeJournal.id > since).order_by(ChangeJournal.id).yield_per(1000):
+        out_file.write(json.dumps(entry_dict(entry)) + '\n')
+        exported += 1
+    click.echo('Exported {} journal entries.'.format(exported))
+
+@app.cli.command('add-plant')
+@click.argument('plant_name')
+def add_plant_command(plant_name):
+    """Add a plant; it starts with the default shift week and no jobs or procedures"""
+    from models import Plant, db
+    if Plant.query.filter_by(plant_name=plant_name).first():
+        raise click.ClickException('A plant named {} already exists.'.format(plant_name))
+    plant = Plant(plant_name=plant_name)
+    db.session.add(plant)
+    db.session.flush()
+    add_default_shifts(plant.id)
+    db.session.commit()
+    click.echo('Added plant {} with ID {}.'.format(plant_name, plant.id))
+
+@app.cli.command('check-schedule')
+@click.option('--plant', 'plant_id', type=int, default=None, help='Only this plant (default: every plant).')
+@click.option('--limit', type=int, default=20, help='Problems listed per check and plant.')
+def check_schedule_command(plant_id, limit):
+    """Check the stored plan for overlaps, off-shift, out-of-sequence and late operations"""
+    problems = 0
+    for plant in [plant_id] if plant_id is not None else plant_ids():
+        with use_plant(plant):
+            started = perf_counter()
+            violations, operation_count = check_schedule()
+            elapsed_ms = (perf_counter() - started) * 1000
+        click.echo('Plant {}: {} operations checked in {:.1f} ms.'.format(plant, operation_count, elapsed_ms))
+        for check in CHECKS:
+            found = [violation for violation in violations if violation.check == check]
+            click.echo('  {}: {}'.format(check, len(found)))
+            for violation in found[:limit]:
+                click.echo('    job {} procedure {}: {}'.format(violation.job_id, violation.procedure_id if violation.procedure_id is not None else '-', violation.detail))
+        problems += len(violations)
+    if problems:
+        raise click.ClickException('{} problems found.'.format(problems))
@@ -6,4 +6,40 @@ load_dotenv()
 
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS')
\ No newline at end of file
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS', 'False').lower() in ('true', '1', 'yes')
+
+# Connection pool for server databases (PostgreSQL, MySQL); SQLite keeps SQLAlchemy's default pool
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'True').lower() in ('true', '1', 'yes'),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800))
+    }
+
+# Applied to every new SQLite connection; WAL lets pages read while a regeneration is writing
+app.config['SQLITE_JOURNAL_MODE'] = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+app.config['SQLITE_SYNCHRONOUS'] = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['CALENDAR_HORIZON_PAST_DAYS'] = int(os.getenv('CALENDAR_HORIZON_PAST_DAYS', 400))
+app.config['CALENDAR_HORIZON_FUTURE_DAYS'] = int(os.getenv('CALENDAR_HORIZON_FUTURE_DAYS', 800))
+app.config['SCHEDULER_ENGINE'] = os.getenv('SCHEDULER_ENGINE', 'greedy')  # 'greedy' (single pass), 'chain' or 'lanes'
+app.config['SCHEDULER_WORKERS'] = int(os.getenv('SCHEDULER_WORKERS', 2))
+app.config['SCHEDULER_PLANT_WORKERS'] = int(os.getenv('SCHEDULER_PLANT_WORKERS', 4))  # plants regenerated at once; SQLite always goes one at a time
+app.config['SCHEDULER_OPTIMIZER'] = os.getenv('SCHEDULER_OPTIMIZER', 'off')  # 'off' or 'anneal'
+app.config['SCHEDULER_OPTIMIZER_BUDGET_MS'] = int(os.getenv('SCHEDULER_OPTIMIZER_BUDGET_MS', 2000))
+app.config['SCHEDULER_OPTIMIZER_SEED'] = os.getenv('SCHEDULER_OPTIMIZER_SEED')
+# Pin operations that have started or start within this many working hours; only later ones are replanned
+app.config['SCHEDULER_FREEZE_WINDOW'] = os.getenv('SCHEDULER_FREEZE_WINDOW', 'False').lower() in ('true', '1', 'yes')
+app.config['SCHEDULER_FREEZE_HOURS'] = int(os.getenv('SCHEDULER_FREEZE_HOURS', 8))
+app.config['AT_RISK_SLACK_MINUTES'] = int(os.getenv('AT_RISK_SLACK_MINUTES', 480))
+app.config['PAGE_CACHE_MAX_BYTES'] = int(os.getenv('PAGE_CACHE_MAX_BYTES', 16 * 1024 * 1024))  # 0 turns the page cache off
+# Compiled templates cached on disk ('' uses a per-user directory under the system temp directory)
+app.config['TEMPLATE_BYTECODE_CACHE'] = os.getenv('TEMPLATE_BYTECODE_CACHE', 'True').lower() in ('true', '1', 'yes')
+app.config['TEMPLATE_BYTECODE_CACHE_DIR'] = os.getenv('TEMPLATE_BYTECODE_CACHE_DIR', '')
+app.config['TEMPLATE_NAV_CACHE'] = os.getenv('TEMPLATE_NAV_CACHE', 'True').lower() in ('true', '1', 'yes')  # navigation bar rendered once per role combination
+app.config['PLAN_STREAM_KEEPALIVE_SECONDS'] = int(os.getenv('PLAN_STREAM_KEEPALIVE_SECONDS', 15))
+# Check the committed plan for overlaps, off-shift, out-of-sequence and late operations after every regeneration (see integrity)
+app.config['SCHEDULER_VALIDATE'] = os.getenv('SCHEDULER_VALIDATE', 'False').lower() in ('true', '1', 'yes')
+app.config['SCHEDULER_PROFILE'] = os.getenv('SCHEDULER_PROFILE', 'False').lower() in ('true', '1', 'yes')
+app.config['SCHEDULER_PROFILE_DIR'] = os.getenv('SCHEDULER_PROFILE_DIR', '')  # cProfile dump per run when set
\ No newline at end of file
@@ -0,0 +1,93 @@
+from bisect import bisect_left, bisect_right, insort
+
+class ConflictModel:
+    """
+    In-memory busy intervals per procedure, in working minutes (see work_calendar)
+    Intervals on one procedure never overlap, so starts and ends are both sorted
+    and every conflict check is a bisect instead of a database query
+    """
+    def __init__(self):
+        self.starts = {}
+        self.ends = {}
+
+    def copy(self):
+        model = ConflictModel()
+        model.starts = {procedure_id: list(starts) for procedure_id, starts in self.starts.items()}
+        model.ends = {procedure_id: list(ends) for procedure_id, ends in self.ends.items()}
+        return model
+
+    def add(self, procedure_id, start, end):
+        """Book a free interval on a procedure"""
+        insort(self.starts.setdefault(procedure_id, []), start)
+        insort(self.ends.setdefault(procedure_id, []), end)
+
+    def add_fixed(self, procedure_id, start, end):
+        """Book an interval that may overlap existing bookings, merging them into one busy interval"""
+        starts = self.starts.setdefault(procedure_id, [])
+        ends = self.ends.setdefault(procedure_id, [])
+        first = bisect_left(ends, start)
+        last = bisect_right(starts, end)
+        if first < last:
+            start = min(start, starts[first])
+            end = max(end, ends[last - 1])
+            del starts[first:last]
+            del ends[first:last]
+        starts.insert(first, start)
+        ends.insert(first, end)
+
+    def remove(self, procedure_id, start, end):
+        """Release an interval previously booked with add"""
+        starts = self.starts[procedure_id]
+        ends = self.ends[procedure_id]
+        del starts[bisect_left(starts, start)]
+        del ends[bisect_left(ends, end)]
+
+    def conflicts(self, procedure_id, start, end):
+        """True when [start, end) overlaps a booking on the procedure"""
+        ends = self.ends.get(procedure_id)
+        if not ends:
+            return False
+        i = bisect_right(ends, start)
+        return i < len(ends) and self.starts[procedure_id][i] < end
+
+    def latest_free_end(self, procedure_id, duration, end, floor):
+        """
+        Latest interval of the given duration ending at or before end and starting at or after floor
+        Returns (start, end) or None when the procedure is booked solid back to floor
+        """
+        starts = self.starts.get(procedure_id, [])
+        ends = self.ends.get(procedure_id, [])
+        while end - duration >= floor:
+            start = end - duration
+            i = bisect_right(ends, start)
+            if i >= len(ends) or starts[i] >= end:
+                return start, end
+            end = starts[i]
+        return None
+
+    def earliest_free_start(self, procedure_id, duration, start, ceiling=None):
+        """
+        Earliest interval of the given duration starting at or after start
+        Returns (start, end) or None when nothing fits before ceiling
+        """
+        starts = self.starts.get(procedure_id, [])
+        ends = self.ends.get(procedure_id, [])
+        while ceiling is None or start + duration <= ceiling:
+            end = start + duration
+            i = bisect_right(ends, start)
+            if i >= len(ends) or starts[i] >= end:
+                return start, end
+            j = bisect_left(starts, end) - 1
+            start = ends[j]
+        return None
+
+    def busy_minutes(self, procedure_id, start, end):
+        """Booked minutes on a procedure inside [start, end)"""
+        starts = self.starts.get(procedure_id, [])
+        ends = self.ends.get(procedure_id, [])
+        total = 0
+        for i in range(bisect_right(ends, start), len(starts)):
+            if starts[i] >= end:
+                break
+            total += min(ends[i], end) - max(starts[i], start)
+        return total
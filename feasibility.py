@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from work_calendar import to_working_minute
+
+# How far before its target a job may start, matching find_start_time_for_duration
+SEARCH_WINDOW_DAYS = 60
+
+def get_search_window(target_completion_datetime):
+    """(window start, target) in working minutes for a job's completion target"""
+    window_start = target_completion_datetime - timedelta(days=SEARCH_WINDOW_DAYS)
+    return to_working_minute(window_start), to_working_minute(target_completion_datetime)
+
+def job_window_shortfall(procedures, target_completion_datetime):
+    """
+    Reason the job can never be placed, or None
+    The procedures of a job run one after another, so all of them together must
+    fit in the working time of the search window before the target
+    """
+    window_start, target = get_search_window(target_completion_datetime)
+    demand = sum(procedure.procedure_plantime * 60 for procedure in procedures)
+    available = target - window_start
+    if demand > available:
+        return 'Needs {:.2f} working hours but only {:.2f} exist in the {} days before its completion target.'.format(
+            demand / 60, available / 60, SEARCH_WINDOW_DAYS)
+    return None
+
+def procedures_over_capacity(procedures, target_completion_datetime, capacity):
+    """
+    Procedures whose free time before the target is less than the job needs on them
+    capacity is a ConflictModel of the operations already placed in this run.
+    Any procedure returned here means backward placement cannot meet the target.
+    """
+    window_start, target = get_search_window(target_completion_datetime)
+    window_minutes = target - window_start
+    short = []
+    for procedure in procedures:
+        demand = procedure.procedure_plantime * 60
+        if demand and window_minutes - capacity.busy_minutes(procedure.id, window_start, target) < demand:
+            short.append(procedure)
+    return short
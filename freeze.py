@@ -0,0 +1,69 @@
+from datetime import datetime
+
+from app import app
+from conflict_model import ConflictModel
+from plants import plant_schedules
+from segments import clear_segments
+from work_calendar import to_working_minute, from_working_minute
+
+def get_models():
+    """Get model classes and db object - lazy import to avoid circular imports"""
+    from models import Schedule, db
+    return Schedule, db
+
+class FrozenWindow:
+    """
+    Operations a regeneration must leave where they are
+    Everything that has started, or starts before the horizon (now plus the freeze
+    window in working hours), stays planned as it is; the rest of a job is replanned
+    after its last frozen operation and never before the horizon
+    """
+    def __init__(self, horizon, rows):
+        self.horizon = horizon
+        self.rows = rows
+        self.by_job = {}
+        self.model = ConflictModel()
+        for row in rows:
+            self.by_job.setdefault(row.job_id, []).append(row)
+
+    def load_model(self, since=None):
+        """
+        Put the frozen operations that end after since (every one by default) on the
+        conflict model. Work replanned no earlier than since cannot conflict with the
+        others, so jobs finished long ago cost nothing to plan around
+        """
+        for row in self.rows:
+            if since is None or row.end_datetime > since:
+                self.model.add_fixed(row.procedure_id, to_working_minute(row.start_datetime), to_working_minute(row.end_datetime))
+        return self
+
+    def remaining(self, job_id, operations):
+        """A job's operations that still need a slot"""
+        frozen = {row.procedure_id for row in self.by_job.get(job_id, [])}
+        return [operation for operation in operations if operation.id not in frozen]
+
+    def earliest_start(self, job_id):
+        """Datetime the job's replanned operations may start from"""
+        return max([self.horizon] + [row.end_datetime for row in self.by_job.get(job_id, [])])
+
+def freeze_horizon(now=None):
+    """End of the frozen window starting now: now plus SCHEDULER_FREEZE_HOURS working hours"""
+    now = now or datetime.now()
+    return from_working_minute(to_working_minute(now) + app.config['SCHEDULER_FREEZE_HOURS'] * 60)
+
+def get_frozen_window(now=None):
+    """
+    The current plant's frozen window of a regeneration starting now, or None when
+    SCHEDULER_FREEZE_WINDOW is off. Deletes the plant's Schedule rows after the horizon,
+    which are about to be replanned, and their segments. The frozen rows are read as
+    plain tuples and nothing is on the conflict model until load_model
+    """
+    if not app.config['SCHEDULER_FREEZE_WINDOW']:
+        return None
+    Schedule, db = get_models()
+    horizon = freeze_horizon(now)
+    clear_segments(plant_schedules().filter(Schedule.start_datetime >= horizon))
+    plant_schedules().filter(Schedule.start_datetime >= horizon).delete()
+    rows = plant_schedules().with_entities(Schedule.id, Schedule.job_id, Schedule.procedure_id, Schedule.start_datetime, Schedule.end_datetime).filter(
+        Schedule.start_datetime < horizon).order_by(Schedule.start_datetime).all()
+    return FrozenWindow(horizon, rows)
@@ -0,0 +1,110 @@
+from datetime import datetime, date, time as dt_time, timedelta
+
+import numpy
+
+from segments import segments_between
+from work_calendar import to_working_minute
+
+BUCKETS = ('day', 'hour')
+
+# Longest range per bucket size, to keep the response small
+MAX_DAYS = {'day': 400, 'hour': 31}
+
+def bucket_edges(first_day, last_day, bucket):
+    """Bucket boundaries from midnight of first_day to midnight after last_day"""
+    start = datetime.combine(first_day, dt_time())
+    end = datetime.combine(last_day + timedelta(days=1), dt_time())
+    step = timedelta(days=1) if bucket == 'day' else timedelta(hours=1)
+    edges = []
+    moment = start
+    while moment <= end:
+        edges.append(moment)
+        moment += step
+    return edges
+
+def utilisation_grid(intervals, procedure_ids, edges):
+    """
+    Busy and capacity working minutes of each procedure in each bucket
+    intervals are (procedure ID, start, end) in working minutes, clipped to the range.
+    The busy minutes before a point are the sum of (point - start) over the starts before
+    it less the sum of (point - end) over the ends before it, so sorted starts and ends
+    with their prefix sums give it at every bucket edge through searchsorted, and a
+    bucket's busy minutes are the difference at its two edges. The procedures' ranges
+    are laid end to end on one axis so a single sort serves them all, and nothing is
+    sized by the minutes in the range. Capacity is the working minutes inside each
+    bucket, so gaps in the calendar never count against utilisation.
+    Returns (busy, capacity) as arrays shaped (procedures, buckets) and (buckets,)
+    """
+    edges = numpy.asarray(edges, dtype=numpy.int64)
+    first, last = int(edges[0]), int(edges[-1])
+    rows = {procedure_id: i for i, procedure_id in enumerate(procedure_ids)}
+    # Procedure i's range starts i range lengths along the axis
+    offsets = numpy.arange(len(procedure_ids), dtype=numpy.int64) * (last - first + 1)
+
+    starts = ends = numpy.zeros(0, dtype=numpy.int64)
+    if intervals:
+        procedures, starts, ends = (numpy.asarray(column, dtype=numpy.int64) for column in zip(*intervals))
+        row_index = numpy.fromiter((rows.get(procedure_id, -1) for procedure_id in procedures.tolist()), dtype=numpy.int64, count=len(procedures))
+        starts = numpy.minimum(numpy.maximum(starts, first), last)
+        ends = numpy.minimum(numpy.maximum(ends, first), last)
+        keep = (row_index >= 0) & (ends > starts)
+        starts = numpy.sort(starts[keep] - first + offsets[row_index[keep]])
+        ends = numpy.sort(ends[keep] - first + offsets[row_index[keep]])
+
+    points = (edges - first)[None, :] + offsets[:, None]
+    started = numpy.searchsorted(starts, points)
+    ended = numpy.searchsorted(ends, points)
+    start_sums = numpy.concatenate(([0], numpy.cumsum(starts)))
+    end_sums = numpy.concatenate(([0], numpy.cumsum(ends)))
+    busy_before = started * points - start_sums[started] - (ended * points - end_sums[ended])
+    return numpy.diff(busy_before, axis=1), numpy.diff(edges)
+
+def utilisation_heatmap(procedures, first_day, last_day, bucket='day'):
+    """
+    Procedure x bucket utilisation of the plan between two dates (inclusive)
+    Returns a dict with bucket start datetimes, capacity minutes per bucket and, per
+    procedure, busy minutes and utilisation (None where the calendar has no working time)
+    """
+    edges = bucket_edges(first_day, last_day, bucket)
+    working_edges = [to_working_minute(edge) for edge in edges]
+    procedure_ids = [procedure.id for procedure in procedures]
+
+    # A range scan of the stored working segments, not every operation that starts before the range
+    intervals = [(procedure_id, to_working_minute(start), to_working_minute(end))
+                 for procedure_id, start, end in segments_between(procedure_ids, edges[0], edges[-1])]
+
+    busy, capacity = utilisation_grid(intervals, procedure_ids, working_edges)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        utilisation = numpy.where(capacity > 0, busy / numpy.maximum(capacity, 1), numpy.nan)
+
+    return {
+        'bucket': bucket,
+        'buckets': edges[:-1],
+        'capacity_minutes': capacity.tolist(),
+        'procedures': [{
+            'procedure_id': procedure.id,
+            'procedure_name': procedure.procedure_name,
+            'busy_minutes': busy[i].tolist(),
+            'utilisation': [None if numpy.isnan(value) else round(float(value), 4) for value in utilisation[i]]
+        } for i, procedure in enumerate(procedures)]
+    }
+
+def parse_heatmap_args(args, today=None):
+    """
+    (first day, last day, bucket) from request arguments, or an error message
+    Defaults to four weeks from today by day
+    """
+    today = today or date.today()
+    bucket = args.get('bucket', 'day')
+    if bucket not in BUCKETS:
+        return None, 'Bucket must be day or hour.'
+    try:
+        first_day = date.fromisoformat(args['from']) if args.get('from') else today
+        last_day = date.fromisoformat(args['to']) if args.get('to') else first_day + timedelta(days=27 if bucket == 'day' else 6)
+    except ValueError:
+        return None, 'From and To must be valid dates.'
+    if last_day < first_day:
+        return None, 'To must not be before From.'
+    if (last_day - first_day).days + 1 > MAX_DAYS[bucket]:
+        return None, 'At most {} days can be shown by {}.'.format(MAX_DAYS[bucket], bucket)
+    return (first_day, last_day, bucket), None
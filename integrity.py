@@ -0,0 +1,111 @@
+from collections import namedtuple
+from time import perf_counter
+
+from app import app
+from plants import current_plant_id, plant_procedure_ids
+from work_calendar import to_working_minute, from_working_minute
+
+def get_models():
+    """Get model classes and db object - lazy import to avoid circular imports"""
+    from models import Job, Procedure, Schedule, JobRouting, db
+    return Job, Procedure, Schedule, JobRouting, db
+
+# One problem found in the stored plan; schedule_id is None for job-level problems
+Violation = namedtuple('Violation', ['check', 'schedule_id', 'job_id', 'procedure_id', 'detail'])
+
+CHECKS = ('overlap', 'working_hours', 'sequence', 'late')
+
+def overlapping_operations():
+    """
+    Operations of the current plant that start before an earlier operation on the same
+    procedure has ended. One window pass per procedure ordered by start: each row
+    carries the latest end of every row before it, so overlaps with operations further
+    back than the previous row are found too. Zero-length operations book no capacity
+    and are skipped
+    """
+    Job, Procedure, Schedule, JobRouting, db = get_models()
+    ordered = db.session.query(
+        Schedule.id, Schedule.job_id, Schedule.procedure_id, Schedule.start_datetime,
+        db.func.max(Schedule.end_datetime).over(
+            partition_by=Schedule.procedure_id, order_by=(Schedule.start_datetime, Schedule.id), rows=(None, -1)
+        ).label('busy_until')
+    ).filter(
+        Schedule.procedure_id.in_(plant_procedure_ids()),
+        Schedule.start_datetime < Schedule.end_datetime
+    ).subquery()
+    rows = db.session.query(ordered).filter(ordered.c.start_datetime < ordered.c.busy_until).all()
+    return [Violation('overlap', row.id, row.job_id, row.procedure_id,
+                      'Starts at {} while the procedure is busy until {}.'.format(row.start_datetime, row.busy_until)) for row in rows]
+
+def out_of_sequence_operations():
+    """
+    Operations of the current plant that start before an operation earlier in their
+    job's sequence (its routing step, otherwise the procedure's) has ended. One window
+    pass per job ordered by sequence; operations sharing a sequence are not ordered
+    """
+    Job, Procedure, Schedule, JobRouting, db = get_models()
+    sequence = db.func.coalesce(JobRouting.sequence, Procedure.sequence)
+    ordered = db.session.query(
+        Schedule.id, Schedule.job_id, Schedule.procedure_id, Schedule.start_datetime,
+        db.func.max(Schedule.end_datetime).over(partition_by=Schedule.job_id, order_by=sequence, range_=(None, -1)).label('previous_end')
+    ).join(Procedure, Schedule.procedure_id == Procedure.id).outerjoin(
+        JobRouting, db.and_(JobRouting.job_id == Schedule.job_id, JobRouting.procedure_id == Schedule.procedure_id)
+    ).filter(Procedure.plant_id == current_plant_id()).subquery()
+    rows = db.session.query(ordered).filter(ordered.c.start_datetime < ordered.c.previous_end).all()
+    return [Violation('sequence', row.id, row.job_id, row.procedure_id,
+                      'Starts at {} before an earlier step of the job ends at {}.'.format(row.start_datetime, row.previous_end)) for row in rows]
+
+def outside_working_hours(rows):
+    """
+    Operations that start or end outside the current plant's working blocks
+    A moment inside working hours survives a round trip through working minutes
+    unchanged; one outside them comes back as the next block's start
+    """
+    violations = []
+    for schedule_id, job_id, procedure_id, start, end in rows:
+        zero_length = start == end
+        if (from_working_minute(to_working_minute(start), at_end=zero_length) != start
+                or from_working_minute(to_working_minute(end), at_end=True) != end):
+            violations.append(Violation('working_hours', schedule_id, job_id, procedure_id,
+                                        'Runs from {} to {}, outside working hours.'.format(start, end)))
+    return violations
+
+def late_jobs():
+    """Jobs of the current plant whose last operation ends after their completion target"""
+    from scheduler import get_completion_target_datetime
+    Job, Procedure, Schedule, JobRouting, db = get_models()
+    rows = db.session.query(Job.id, Job.deadline_date, Job.deadline_time, db.func.max(Schedule.end_datetime)).join(
+        Schedule, Schedule.job_id == Job.id
+    ).filter(Job.plant_id == current_plant_id()).group_by(Job.id, Job.deadline_date, Job.deadline_time).all()
+    violations = []
+    for job_id, deadline_date, deadline_time, completion in rows:
+        target = get_completion_target_datetime(deadline_date, deadline_time)
+        if completion > target:
+            violations.append(Violation('late', None, job_id, None, 'Completes at {}, after its target {}.'.format(completion, target)))
+    return violations
+
+def check_schedule():
+    """
+    Check the current plant's stored plan; returns (violations, operations checked)
+    Each check is one sorted query or one pass over the rows, O(n log n) in the number
+    of operations rather than comparing them pairwise
+    """
+    Job, Procedure, Schedule, JobRouting, db = get_models()
+    rows = db.session.query(Schedule.id, Schedule.job_id, Schedule.procedure_id, Schedule.start_datetime, Schedule.end_datetime).filter(
+        Schedule.procedure_id.in_(plant_procedure_ids())).all()
+    violations = overlapping_operations() + outside_working_hours(rows) + out_of_sequence_operations() + late_jobs()
+    return violations, len(rows)
+
+def validate_after_regeneration():
+    """
+    Check the plan a regeneration just committed, with SCHEDULER_VALIDATE on
+    Logs the runtime and any problems; returns the violations
+    """
+    started = perf_counter()
+    violations, operation_count = check_schedule()
+    elapsed_ms = (perf_counter() - started) * 1000
+    counts = {check: sum(1 for violation in violations if violation.check == check) for check in CHECKS}
+    log = app.logger.warning if any(counts[check] for check in CHECKS if check != 'late') else app.logger.info
+    log('Schedule check: plant %d, %d operations in %.1f ms, %s', current_plant_id(), operation_count, elapsed_ms,
+        ', '.join('{} {}'.format(count, check) for check, count in counts.items()))
+    return violations
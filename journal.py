@@ -0,0 +1,134 @@
+import json
+from datetime import datetime, date, time as dt_time
+from uuid import uuid4
+
+from flask import has_request_context, session as flask_session
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from segments import clear_segments
+
+def get_models():
+    """Get model classes and db object - lazy import to avoid circular imports"""
+    from models import Job, Procedure, Schedule, UnscheduledJob, JobRouting, RoutingTemplateStep, ProcedureLoad, ChangeJournal, db
+    return Job, Procedure, Schedule, UnscheduledJob, JobRouting, RoutingTemplateStep, ProcedureLoad, ChangeJournal, db
+
+def journaled_models():
+    """Entity name -> model of the rows whose edits are journaled"""
+    Job, Procedure, Schedule, UnscheduledJob, JobRouting, RoutingTemplateStep, ProcedureLoad, ChangeJournal, db = get_models()
+    return {'job': Job, 'procedure': Procedure}
+
+def row_values(obj):
+    """Every column of a row as JSON-ready values, dates and times as ISO strings"""
+    values = {}
+    for column in obj.__table__.columns:
+        value = getattr(obj, column.key)
+        values[column.key] = value.isoformat() if isinstance(value, (datetime, date, dt_time)) else value
+    return values
+
+def parse_values(model, values):
+    """Column values from a journal entry, with dates and times parsed back"""
+    parsed = {}
+    for column in model.__table__.columns:
+        if column.key not in values:
+            continue
+        value = values[column.key]
+        if value is not None:
+            python_type = column.type.python_type
+            if python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif python_type is date:
+                value = date.fromisoformat(value)
+            elif python_type is dt_time:
+                value = dt_time.fromisoformat(value)
+        parsed[column.key] = value
+    return parsed
+
+@event.listens_for(Session, 'after_flush')
+def _journal_changes(session, flush_context):
+    """
+    Append a journal entry for every job and procedure created, updated or deleted
+    Runs after the flush, when new rows have their IDs, and inserts through the
+    flush's own connection, so entries commit or roll back with the change itself
+    """
+    Job, Procedure, Schedule, UnscheduledJob, JobRouting, RoutingTemplateStep, ProcedureLoad, ChangeJournal, db = get_models()
+    entities = {model: entity for entity, model in journaled_models().items()}
+    changes = [(obj, 'create') for obj in session.new]
+    changes += [(obj, 'update') for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    changes += [(obj, 'delete') for obj in session.deleted]
+    changes = [(entities[type(obj)], obj, action) for obj, action in changes if type(obj) in entities]
+    if not changes:
+        return
+
+    if 'journal_batch' not in session.info:
+        session.info['journal_batch'] = uuid4().hex
+    user_id = flask_session.get('user_id') if has_request_context() else None
+    recorded_at = datetime.utcnow()
+    session.connection().execute(ChangeJournal.__table__.insert(), [{
+        'recorded_at': recorded_at,
+        'batch': session.info['journal_batch'],
+        'entity': entity,
+        'entity_id': obj.id,
+        'action': action,
+        'values': json.dumps(row_values(obj)),
+        'user_id': user_id
+    } for entity, obj, action in changes])
+
+@event.listens_for(Session, 'after_commit')
+def _end_batch(session):
+    session.info.pop('journal_batch', None)
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_batch(session):
+    session.info.pop('journal_batch', None)
+
+def entry_dict(entry):
+    """A journal entry as exported by export-journal and read by replay"""
+    return {'id': entry.id, 'recorded_at': entry.recorded_at.isoformat(), 'batch': entry.batch, 'entity': entry.entity,
+            'entity_id': entry.entity_id, 'action': entry.action, 'values': json.loads(entry.values), 'user_id': entry.user_id}
+
+def read_batches(lines):
+    """Exported journal entries (JSON lines, in ID order) grouped into their transactions"""
+    batches = []
+    for line in lines:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        if batches and batches[-1][0]['batch'] == entry['batch']:
+            batches[-1].append(entry)
+        else:
+            batches.append([entry])
+    return batches
+
+def apply_entry(entry):
+    """
+    Apply one journal entry to the database the way the edit pages would
+    A row the journal has not seen created (it predates the journal) is created from
+    the entry's values, which hold every column. Deletes also remove what the delete
+    pages remove with the row
+    """
+    Job, Procedure, Schedule, UnscheduledJob, JobRouting, RoutingTemplateStep, ProcedureLoad, ChangeJournal, db = get_models()
+    model = journaled_models()[entry['entity']]
+    row = db.session.get(model, entry['entity_id'])
+    if entry['action'] == 'delete':
+        if row is None:
+            return
+        if model is Job:
+            UnscheduledJob.query.filter_by(job_id=row.id).delete()
+            JobRouting.query.filter_by(job_id=row.id).delete()
+            clear_segments(Schedule.query.filter_by(job_id=row.id))
+            Schedule.query.filter_by(job_id=row.id).delete()
+        else:
+            clear_segments(Schedule.query.filter_by(procedure_id=row.id))
+            Schedule.query.filter_by(procedure_id=row.id).delete()
+            JobRouting.query.filter_by(procedure_id=row.id).delete()
+            RoutingTemplateStep.query.filter_by(procedure_id=row.id).delete()
+            ProcedureLoad.query.filter_by(procedure_id=row.id).delete()
+        db.session.delete(row)
+        return
+    values = parse_values(model, entry['values'])
+    if row is None:
+        db.session.add(model(**values))
+    else:
+        for key, value in values.items():
+            setattr(row, key, value)
@@ -0,0 +1,184 @@
+from datetime import datetime, date, timedelta
+
+from app import app
+from plants import current_plant_id, plant_job_ids, plant_procedure_ids
+from profiling import count
+from work_calendar import working_blocks
+
+ONE_MINUTE = timedelta(minutes=1)
+
+# Periods shown on the manager dashboards
+DASHBOARD_DAYS = 7
+DASHBOARD_WEEKS = 6
+
+def get_models():
+    """Get model classes and db object - lazy import to avoid circular imports"""
+    from models import ProcedureLoad, PlanKpi, Progress, Schedule, UnscheduledJob, db
+    return ProcedureLoad, PlanKpi, Progress, Schedule, UnscheduledJob, db
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+def day_capacity_minutes(day):
+    """Working minutes the calendar allows on a date"""
+    return sum((block_end - block_start) // ONE_MINUTE for block_start, block_end in working_blocks(day))
+
+def dashboard_periods(today, since=None):
+    """
+    (period, period start) of every day and week from today's week to DASHBOARD_WEEKS
+    weeks on, those starting on or after since when given. Regenerations write a load
+    row for each of them even when nothing is planned, so dashboards never work out a
+    capacity themselves
+    """
+    first = week_start(today)
+    periods = [('day', first + timedelta(days=i)) for i in range(7 * DASHBOARD_WEEKS)]
+    periods += [('week', first + timedelta(weeks=i)) for i in range(DASHBOARD_WEEKS)]
+    return [(period, period_start) for period, period_start in periods if since is None or period_start >= since]
+
+def compute_loads(segments, periods=()):
+    """
+    Planned and capacity minutes per (procedure ID, period, period start) of the plan's
+    working segments (see segments), which are each within one date and all working time
+    Every procedure of the current plant also gets a row for each of periods, planned or not
+    """
+    ProcedureLoad, PlanKpi, Progress, Schedule, UnscheduledJob, db = get_models()
+    planned = {}
+    if periods:
+        for procedure_id in db.session.scalars(plant_procedure_ids()).all():
+            for period, period_start in periods:
+                planned[(procedure_id, period, period_start)] = 0
+    for procedure_id, segment_start, segment_end in segments:
+        day = segment_start.date()
+        minutes = (segment_end - segment_start) // ONE_MINUTE
+        for key in ((procedure_id, 'day', day), (procedure_id, 'week', week_start(day))):
+            planned[key] = planned.get(key, 0) + minutes
+
+    capacity = {}
+    loads = {}
+    for key, minutes in planned.items():
+        procedure_id, period, period_start = key
+        if (period, period_start) not in capacity:
+            days = [period_start] if period == 'day' else [period_start + timedelta(days=i) for i in range(7)]
+            capacity[(period, period_start)] = sum(day_capacity_minutes(day) for day in days)
+        loads[key] = (minutes, capacity[(period, period_start)])
+    return loads
+
+def write_loads(loads, since=None):
+    """
+    Bring the current plant's procedure_load rows in line with loads, writing only the rows that changed
+    A regeneration that moves a few operations rewrites a few rows, not the table. With
+    since, only the periods starting on or after that date are compared
+    """
+    ProcedureLoad, PlanKpi, Progress, Schedule, UnscheduledJob, db = get_models()
+    written = 0
+    rows = ProcedureLoad.query.filter(ProcedureLoad.procedure_id.in_(plant_procedure_ids()))
+    if since is not None:
+        rows = rows.filter(ProcedureLoad.period_start >= since)
+    for row in rows.all():
+        key = (row.procedure_id, row.period, row.period_start)
+        if key not in loads:
+            db.session.delete(row)
+            written += 1
+            continue
+        planned_minutes, capacity_minutes = loads.pop(key)
+        if (row.planned_minutes, row.capacity_minutes) != (planned_minutes, capacity_minutes):
+            row.planned_minutes = planned_minutes
+            row.capacity_minutes = capacity_minutes
+            written += 1
+    for (procedure_id, period, period_start), (planned_minutes, capacity_minutes) in loads.items():
+        db.session.add(ProcedureLoad(procedure_id=procedure_id, period=period, period_start=period_start,
+                                     planned_minutes=planned_minutes, capacity_minutes=capacity_minutes))
+        written += 1
+    count('kpi_rows_written', written)
+    return written
+
+def finished_jobs(horizon):
+    """(job ID, end, job slack, planned hours) of the current plant's jobs whose every operation ends before horizon"""
+    ProcedureLoad, PlanKpi, Progress, Schedule, UnscheduledJob, db = get_models()
+    return db.session.query(Schedule.job_id, db.func.max(Schedule.end_datetime), db.func.min(Schedule.job_slack_minutes),
+                            db.func.sum(Schedule.planned_time)).filter(Schedule.procedure_id.in_(plant_procedure_ids())).group_by(
+        Schedule.job_id).having(db.func.max(Schedule.end_datetime) < horizon).all()
+
+def write_plan_kpi(rows, target_datetimes, horizon=None):
+    """
+    Refresh the current plant's plan_kpi row: on-time rate, jobs at risk and planned versus booked hours
+    With horizon, rows leave out the jobs finished before it, which are summed by the database instead
+    """
+    ProcedureLoad, PlanKpi, Progress, Schedule, UnscheduledJob, db = get_models()
+    job_ends = {}
+    job_slack = {}
+    planned_hours = sum(row.planned_time for row in rows)
+    for row in rows:
+        job_ends[row.job_id] = max(job_ends.get(row.job_id, row.end_datetime), row.end_datetime)
+        job_slack[row.job_id] = min(job_slack.get(row.job_id, row.job_slack_minutes), row.job_slack_minutes)
+    if horizon is not None:
+        for job_id, end, slack, hours in finished_jobs(horizon):
+            job_ends[job_id] = end
+            job_slack[job_id] = slack
+            planned_hours += hours
+
+    kpi = PlanKpi.query.filter_by(plant_id=current_plant_id()).first()
+    if kpi is None:
+        kpi = PlanKpi(plant_id=current_plant_id())
+        db.session.add(kpi)
+    kpi.computed_at = datetime.utcnow()
+    kpi.job_count = len(target_datetimes)
+    kpi.scheduled_jobs = len(job_ends)
+    kpi.on_time_jobs = sum(1 for job_id, end in job_ends.items() if end <= target_datetimes[job_id])
+    kpi.late_jobs = kpi.scheduled_jobs - kpi.on_time_jobs
+    kpi.at_risk_jobs = sum(1 for slack in job_slack.values() if slack < app.config['AT_RISK_SLACK_MINUTES'])
+    kpi.unscheduled_jobs = UnscheduledJob.query.filter(UnscheduledJob.job_id.in_(plant_job_ids())).count()
+    kpi.planned_hours = planned_hours
+    kpi.actual_hours = db.session.query(db.func.coalesce(db.func.sum(Progress.actual_time), 0)).filter(
+        Progress.job_id.in_(plant_job_ids())).scalar()
+    return kpi
+
+def update_kpis(rows, segments, target_datetimes, horizon=None):
+    """
+    Recompute the current plant's dashboard KPIs from a regeneration's plan and its segments, in its transaction
+    With a frozen window's horizon, rows are those of the jobs with work at or after it and
+    segments those from the start of its week, and only the loads from that week are refreshed
+    """
+    since = week_start(horizon.date()) if horizon is not None else None
+    write_loads(compute_loads(segments, dashboard_periods(date.today(), since)), since)
+    write_plan_kpi(rows, target_datetimes, horizon)
+
+def combined_plan_kpi(kpis):
+    """The plan_kpi rows of several plants added up into one, not added to the session, or None"""
+    ProcedureLoad, PlanKpi, Progress, Schedule, UnscheduledJob, db = get_models()
+    if len(kpis) <= 1:
+        return kpis[0] if kpis else None
+    combined = PlanKpi(computed_at=min(kpi.computed_at for kpi in kpis))
+    for column in ('job_count', 'scheduled_jobs', 'on_time_jobs', 'late_jobs', 'at_risk_jobs', 'unscheduled_jobs', 'planned_hours', 'actual_hours'):
+        setattr(combined, column, sum(getattr(kpi, column) for kpi in kpis))
+    return combined
+
+def dashboard_kpis(procedures, today=None):
+    """
+    What a manager dashboard shows, read from the KPI tables only
+    Returns (plan_kpi of the procedures' plants combined or None, days, weeks, rows)
+    where each row has a procedure name and its (planned, capacity) minutes for each of
+    the days and weeks. Regenerations write the rows of every period a dashboard shows
+    (see dashboard_periods); capacity is None for one no regeneration has reached yet
+    """
+    ProcedureLoad, PlanKpi, Progress, Schedule, UnscheduledJob, db = get_models()
+    today = today or date.today()
+    days = [today + timedelta(days=i) for i in range(DASHBOARD_DAYS)]
+    weeks = [week_start(today) + timedelta(weeks=i) for i in range(DASHBOARD_WEEKS)]
+    procedure_ids = [procedure.id for procedure in procedures]
+    loads = ProcedureLoad.query.filter(
+        db.or_(
+            db.and_(ProcedureLoad.period == 'day', ProcedureLoad.period_start.between(days[0], days[-1])),
+            db.and_(ProcedureLoad.period == 'week', ProcedureLoad.period_start.between(weeks[0], weeks[-1]))
+        ),
+        ProcedureLoad.procedure_id.in_(procedure_ids)
+    ).all()
+    by_key = {(load.procedure_id, load.period, load.period_start): (load.planned_minutes, load.capacity_minutes) for load in loads}
+
+    rows = [{
+        'procedure_name': procedure.procedure_name,
+        'days': [by_key.get((procedure.id, 'day', day), (0, None)) for day in days],
+        'weeks': [by_key.get((procedure.id, 'week', week), (0, None)) for week in weeks]
+    } for procedure in procedures]
+    plant_kpis = PlanKpi.query.filter(PlanKpi.plant_id.in_({procedure.plant_id for procedure in procedures})).order_by(PlanKpi.plant_id).all()
+    return combined_plan_kpi(plant_kpis), days, weeks, rows
@@ -0,0 +1,92 @@
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from optimizer import OrderingDecoder, anneal
+
+def partition_jobs(jobs, operations_by_job):
+    """
+    Split jobs into lanes that never share a procedure
+    Production and store procedures only end up in one lane when some job is routed
+    through both, since its operations must then follow each other.
+    Jobs keep their input (priority) order inside a lane and lanes are ordered by
+    their first job, so the split is deterministic
+    """
+    parent = {}
+
+    def find(procedure_id):
+        while parent[procedure_id] != procedure_id:
+            parent[procedure_id] = parent[parent[procedure_id]]
+            procedure_id = parent[procedure_id]
+        return procedure_id
+
+    for job in jobs:
+        procedure_ids = [procedure.id for procedure, minutes in operations_by_job[job.id]]
+        for procedure_id in procedure_ids:
+            parent.setdefault(procedure_id, procedure_id)
+        for procedure_id in procedure_ids[1:]:
+            parent[find(procedure_id)] = find(procedure_ids[0])
+
+    lanes = {}
+    for job in jobs:
+        operations = operations_by_job[job.id]
+        if operations:
+            lanes.setdefault(find(operations[0][0].id), []).append(job)
+    return list(lanes.values())
+
+def deadline_groups(jobs):
+    """[start, end) positions of runs of jobs sharing a deadline, the only jobs annealing may reorder"""
+    groups = []
+    for position, job in enumerate(jobs):
+        previous = jobs[position - 1] if position else None
+        if previous and (job.deadline_date, job.deadline_time) == (previous.deadline_date, previous.deadline_time):
+            groups[-1][1] = position + 1
+        else:
+            groups.append([position, position + 1])
+    return groups
+
+def lane_task(lane, operations_by_job, targets, floors, budget_seconds, seed, base_model=None):
+    """Everything a worker needs to solve one lane, as plain picklable data"""
+    return (
+        [job.id for job in lane],
+        deadline_groups(lane),
+        {job.id: operations_by_job[job.id] for job in lane},
+        {job.id: targets[job.id] for job in lane},
+        {job.id: floors[job.id] for job in lane},
+        budget_seconds,
+        seed,
+        base_model
+    )
+
+def solve_lane(task):
+    """
+    Place one lane's jobs on its own conflict model, annealing the order when given a budget
+    Returns (job order, placements per job, iterations)
+    """
+    order, groups, operations_by_job, targets, floors, budget_seconds, seed, base_model = task
+    decoder = OrderingDecoder(operations_by_job, targets, floors, base_model)
+    iterations = 0
+    if budget_seconds > 0:
+        best_order, best, iterations = anneal(decoder, order, groups, budget_seconds, random.Random(seed))
+        decoder.decode(best_order)
+    else:
+        decoder.decode(order)
+    return decoder.order, decoder.placements, iterations
+
+def solve_lanes(lanes, operations_by_job, targets, floors, budget_ms, seed, workers, base_model=None):
+    """
+    Solve every lane, in a process pool when there is more than one lane and worker
+    Lanes share no procedure so their plans never conflict; results come back in
+    lane order whichever worker finishes first. The annealing budget is split so the
+    whole run still takes about budget_ms of wall-clock time
+    base_model holds busy intervals every lane must plan around (a frozen window)
+    """
+    workers = max(1, min(workers, len(lanes)))
+    lane_budget = budget_ms / 1000 * workers / len(lanes) if lanes else 0
+    tasks = [
+        lane_task(lane, operations_by_job, targets, floors, lane_budget, '{}:{}'.format(seed, index) if seed is not None else None, base_model)
+        for index, lane in enumerate(lanes)
+    ]
+    if workers == 1:
+        return [solve_lane(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(solve_lane, tasks))
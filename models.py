@@ -1,10 +1,27 @@
 from app import app
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, literal
+from sqlalchemy.engine import Engine
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import sqlite3
+
+from plants import DEFAULT_PLANT_ID
+from work_calendar import add_default_shifts
 
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply the SQLite settings from config to each new connection"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode={}'.format(app.config['SQLITE_JOURNAL_MODE']))
+    cursor.execute('PRAGMA busy_timeout={:d}'.format(app.config['SQLITE_BUSY_TIMEOUT_MS']))
+    cursor.execute('PRAGMA synchronous={}'.format(app.config['SQLITE_SYNCHRONOUS']))
+    cursor.close()
+
 class User(db.Model):
     __tablename__ = 'user'
     id = db.Column(db.Integer, primary_key=True)
@@ -43,17 +60,27 @@ class Supervisor(db.Model):
 
     supervisors = db.relationship('User', backref='supervisor')
 
+class Plant(db.Model):
+    __tablename__ = 'plant'
+    id = db.Column(db.Integer, primary_key=True)
+    plant_name = db.Column(db.String(120), unique=True, nullable=False)
+
 class Job(db.Model):
     __tablename__ = 'job'
     id = db.Column(db.Integer, primary_key=True)
+    plant_id = db.Column(db.Integer, db.ForeignKey('plant.id'), nullable=False, default=DEFAULT_PLANT_ID)
     job_name = db.Column(db.String(80), nullable=False)
     job_description = db.Column(db.String(200), nullable=False)
     deadline_date = db.Column(db.Date, nullable=False, default=lambda: datetime.today().date())
     deadline_time = db.Column(db.Time, nullable=False, default=lambda: datetime.utcnow().time())
 
+    # A plant's regeneration loads its jobs in priority order (see scheduler)
+    __table_args__ = (db.Index('ix_job_plant_deadline', 'plant_id', 'deadline_date', 'deadline_time'),)
+
 class Material(db.Model):
     __tablename__ = 'material'
     id = db.Column(db.Integer, primary_key=True)
+    plant_id = db.Column(db.Integer, db.ForeignKey('plant.id'), nullable=False, default=DEFAULT_PLANT_ID, index=True)
     material_name = db.Column(db.String(120), nullable=False)
     material_description = db.Column(db.String(200), nullable=False)
     material_supplier = db.Column(db.String(120), nullable=False)
@@ -62,6 +89,7 @@ class Material(db.Model):
 class Procedure(db.Model):
     __tablename__ = 'procedure'
     id = db.Column(db.Integer, primary_key=True)
+    plant_id = db.Column(db.Integer, db.ForeignKey('plant.id'), nullable=False, default=DEFAULT_PLANT_ID)
     sequence = db.Column(db.Integer, nullable=False, default=0)
     procedure_name = db.Column(db.String(120), nullable=False)
     procedure_description = db.Column(db.String(520), nullable=False)
@@ -70,6 +98,8 @@ class Procedure(db.Model):
     procedure_is_prod = db.Column(db.Boolean, nullable=False, default=False)
     procedure_is_store = db.Column(db.Boolean, nullable=False, default=False)
 
+    __table_args__ = (db.Index('ix_procedure_plant_sequence', 'plant_id', 'sequence'),)
+
 class Schedule(db.Model):
     __tablename__ = 'schedule'
     id = db.Column(db.Integer, primary_key=True)
@@ -79,10 +109,27 @@ class Schedule(db.Model):
     end_datetime = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     planned_time = db.Column(db.Integer, nullable=False, default=0)
     planned_manpower = db.Column(db.Integer, nullable=False, default=0)
+    slack_minutes = db.Column(db.Integer, nullable=False, default=0)
+    job_slack_minutes = db.Column(db.Integer, nullable=False, default=0, index=True)
+    is_critical = db.Column(db.Boolean, nullable=False, default=False)
 
     job = db.relationship('Job', backref='schedules')
     procedure = db.relationship('Procedure', backref='schedules')
 
+    # Station work queues seek on this (see work_queue)
+    __table_args__ = (db.Index('ix_schedule_procedure_start', 'procedure_id', 'start_datetime'),)
+
+class ScheduleSegment(db.Model):
+    __tablename__ = 'schedule_segment'
+    id = db.Column(db.Integer, primary_key=True)
+    schedule_id = db.Column(db.Integer, db.ForeignKey('schedule.id'), nullable=False, index=True)
+    procedure_id = db.Column(db.Integer, db.ForeignKey('procedure.id'), nullable=False)
+    segment_start = db.Column(db.DateTime, nullable=False)
+    segment_end = db.Column(db.DateTime, nullable=False)  # Same date as segment_start
+
+    # Time-window load queries are a range scan on this (see segments)
+    __table_args__ = (db.Index('ix_schedule_segment_procedure_start', 'procedure_id', 'segment_start'),)
+
 class Progress(db.Model):
     __tablename__ = 'progress'
     id = db.Column(db.Integer, primary_key=True)
@@ -92,9 +139,200 @@ class Progress(db.Model):
     actual_time = db.Column(db.Integer, nullable=False, default=0)
     actual_manpower = db.Column(db.Integer, nullable=False, default=0)
 
+class ShiftPattern(db.Model):
+    __tablename__ = 'shift_pattern'
+    id = db.Column(db.Integer, primary_key=True)
+    plant_id = db.Column(db.Integer, db.ForeignKey('plant.id'), nullable=False, default=DEFAULT_PLANT_ID, index=True)
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday ... 6 = Sunday
+    block_start = db.Column(db.Time, nullable=False)
+    block_end = db.Column(db.Time, nullable=False)
+
+class Holiday(db.Model):
+    __tablename__ = 'holiday'
+    id = db.Column(db.Integer, primary_key=True)
+    plant_id = db.Column(db.Integer, db.ForeignKey('plant.id'), nullable=False, default=DEFAULT_PLANT_ID, index=True)
+    holiday_name = db.Column(db.String(120), nullable=False)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+
+class CalendarException(db.Model):
+    __tablename__ = 'calendar_exception'
+    id = db.Column(db.Integer, primary_key=True)
+    plant_id = db.Column(db.Integer, db.ForeignKey('plant.id'), nullable=False, default=DEFAULT_PLANT_ID, index=True)
+    exception_date = db.Column(db.Date, nullable=False, index=True)
+    exception_reason = db.Column(db.String(200), nullable=False)
+    block_start = db.Column(db.Time, nullable=False)
+    block_end = db.Column(db.Time, nullable=False)
+
+class RoutingTemplate(db.Model):
+    __tablename__ = 'routing_template'
+    id = db.Column(db.Integer, primary_key=True)
+    plant_id = db.Column(db.Integer, db.ForeignKey('plant.id'), nullable=False, default=DEFAULT_PLANT_ID, index=True)
+    template_name = db.Column(db.String(120), nullable=False)
+    template_description = db.Column(db.String(200), nullable=False)
+    steps = db.relationship('RoutingTemplateStep', lazy=True)
+
+class RoutingTemplateStep(db.Model):
+    __tablename__ = 'routing_template_step'
+    id = db.Column(db.Integer, primary_key=True)
+    template_id = db.Column(db.Integer, db.ForeignKey('routing_template.id'), nullable=False, index=True)
+    procedure_id = db.Column(db.Integer, db.ForeignKey('procedure.id'), nullable=False)
+    sequence = db.Column(db.Integer, nullable=False, default=0)
+    plantime = db.Column(db.Integer, nullable=True)  # Overrides procedure_plantime when set
+
+class JobRouting(db.Model):
+    __tablename__ = 'job_routing'
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('job.id'), nullable=False, index=True)
+    procedure_id = db.Column(db.Integer, db.ForeignKey('procedure.id'), nullable=False)
+    sequence = db.Column(db.Integer, nullable=False, default=0)
+    plantime = db.Column(db.Integer, nullable=True)  # Overrides procedure_plantime when set
+
+class UnscheduledJob(db.Model):
+    __tablename__ = 'unscheduled_job'
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('job.id'), nullable=False)
+    reason = db.Column(db.String(300), nullable=False)
+    precheck = db.Column(db.Boolean, nullable=False, default=False)
+    detected_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class OptimizerRun(db.Model):
+    __tablename__ = 'optimizer_run'
+    id = db.Column(db.Integer, primary_key=True)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    budget_ms = db.Column(db.Integer, nullable=False, default=0)
+    elapsed_ms = db.Column(db.Integer, nullable=False, default=0)
+    iterations = db.Column(db.Integer, nullable=False, default=0)
+    greedy_unscheduled = db.Column(db.Integer, nullable=False, default=0)
+    greedy_overlap_minutes = db.Column(db.Integer, nullable=False, default=0)
+    greedy_tardiness_minutes = db.Column(db.Integer, nullable=False, default=0)
+    greedy_makespan_minutes = db.Column(db.Integer, nullable=False, default=0)
+    best_tardiness_minutes = db.Column(db.Integer, nullable=False, default=0)
+    best_makespan_minutes = db.Column(db.Integer, nullable=False, default=0)
+    adopted = db.Column(db.Boolean, nullable=False, default=False)
+
+class SchedulerRunLog(db.Model):
+    __tablename__ = 'scheduler_run_log'
+    id = db.Column(db.Integer, primary_key=True)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    plant_id = db.Column(db.Integer, db.ForeignKey('plant.id'), nullable=False, default=DEFAULT_PLANT_ID)
+    engine = db.Column(db.String(20), nullable=False)
+    elapsed_ms = db.Column(db.Integer, nullable=False)
+    job_count = db.Column(db.Integer, nullable=False)
+    operation_count = db.Column(db.Integer, nullable=False)
+    sql_statements = db.Column(db.Integer, nullable=False)
+    phases = db.Column(db.Text, nullable=False)  # JSON: phase -> milliseconds
+    calls = db.Column(db.Text, nullable=False)  # JSON: function -> {calls, ms}
+    counters = db.Column(db.Text, nullable=False)  # JSON: counter -> count
+    profile_path = db.Column(db.String(300), nullable=True)  # cProfile dump, when enabled
+
+class ProcedureLoad(db.Model):
+    __tablename__ = 'procedure_load'
+    id = db.Column(db.Integer, primary_key=True)
+    procedure_id = db.Column(db.Integer, db.ForeignKey('procedure.id'), nullable=False)
+    period = db.Column(db.String(10), nullable=False)  # 'day' or 'week' (starting Monday)
+    period_start = db.Column(db.Date, nullable=False)
+    planned_minutes = db.Column(db.Integer, nullable=False, default=0)
+    capacity_minutes = db.Column(db.Integer, nullable=False, default=0)  # Working minutes of the period
+
+    __table_args__ = (db.Index('ix_procedure_load_period', 'period', 'period_start', 'procedure_id'),)
+
+class PlanKpi(db.Model):
+    __tablename__ = 'plan_kpi'
+    id = db.Column(db.Integer, primary_key=True)
+    plant_id = db.Column(db.Integer, db.ForeignKey('plant.id'), nullable=False, default=DEFAULT_PLANT_ID, unique=True)  # One row per plant
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    job_count = db.Column(db.Integer, nullable=False, default=0)
+    scheduled_jobs = db.Column(db.Integer, nullable=False, default=0)
+    on_time_jobs = db.Column(db.Integer, nullable=False, default=0)
+    late_jobs = db.Column(db.Integer, nullable=False, default=0)
+    at_risk_jobs = db.Column(db.Integer, nullable=False, default=0)
+    unscheduled_jobs = db.Column(db.Integer, nullable=False, default=0)
+    planned_hours = db.Column(db.Integer, nullable=False, default=0)
+    actual_hours = db.Column(db.Integer, nullable=False, default=0)  # Booked in progress
+
+    @property
+    def on_time_rate(self):
+        return self.on_time_jobs / self.scheduled_jobs if self.scheduled_jobs else 1.0
+
+class ChangeJournal(db.Model):
+    __tablename__ = 'change_journal'
+    id = db.Column(db.Integer, primary_key=True)
+    recorded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    batch = db.Column(db.String(32), nullable=False, index=True)  # One per transaction, replayed together
+    entity = db.Column(db.String(20), nullable=False)  # 'job' or 'procedure'
+    entity_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(10), nullable=False)  # 'create', 'update' or 'delete'
+    values = db.Column(db.Text, nullable=False)  # JSON: every column of the row, as it was before a delete
+    user_id = db.Column(db.Integer, nullable=True)
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_version'
+    # Single row, bumped by every commit that wrote something (see page_cache)
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# Columns added to tables that already existed: db.create_all creates missing tables
+# but never alters an existing one, so upgrade_schema adds these to older databases
+ADDED_COLUMNS = [
+    (Schedule, 'slack_minutes'),
+    (Schedule, 'job_slack_minutes'),
+    (Schedule, 'is_critical'),
+    (Job, 'plant_id'),
+    (Material, 'plant_id'),
+    (Procedure, 'plant_id'),
+    (ShiftPattern, 'plant_id'),
+    (Holiday, 'plant_id'),
+    (CalendarException, 'plant_id'),
+    (SchedulerRunLog, 'plant_id'),
+    (PlanKpi, 'plant_id'),
+    (RoutingTemplate, 'plant_id'),
+]
+
+def upgrade_schema():
+    """
+    Add the ADDED_COLUMNS and indexes a database created by an older version lacks
+    Existing rows get the column's default. Does nothing on an up-to-date database
+    """
+    dialect = db.engine.dialect
+    quote = dialect.identifier_preparer.quote
+    inspector = inspect(db.engine)
+    existing = {table.name: {column['name'] for column in inspector.get_columns(table.name)} for table in db.metadata.sorted_tables}
+    with db.engine.begin() as connection:
+        for model, name in ADDED_COLUMNS:
+            table = model.__table__
+            if name in existing[table.name]:
+                continue
+            column = table.columns[name]
+            default = literal(column.default.arg, column.type).compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+            ddl = 'ALTER TABLE {} ADD COLUMN {} {} NOT NULL DEFAULT {}'.format(quote(table.name), quote(name), column.type.compile(dialect=dialect), default)
+            for foreign_key in column.foreign_keys:
+                ddl += ' REFERENCES {} ({})'.format(quote(foreign_key.column.table.name), quote(foreign_key.column.name))
+            connection.exec_driver_sql(ddl)
+            if column.unique:
+                connection.exec_driver_sql('CREATE UNIQUE INDEX {} ON {} ({})'.format(
+                    quote('uq_{}_{}'.format(table.name, name)), quote(table.name), quote(name)))
+            existing[table.name].add(name)
+        # Indexes declared on tables that already existed, including ones on the added columns
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if all(column.name in existing[table.name] for column in index.columns):
+                    index.create(connection, checkfirst=True)
+
 with app.app_context():
     db.create_all()
 
+    if not Plant.query.first():
+        db.session.add(Plant(id = DEFAULT_PLANT_ID, plant_name = 'Main Plant'))
+        db.session.commit()
+
+    # After the default plant exists, which the added plant_id columns refer to
+    upgrade_schema()
+
+    if not DataVersion.query.first():
+        db.session.add(DataVersion(version = 0))
+        db.session.commit()
+
     admin = User.query.filter_by(username='admin').first()
     if not admin:
         admin = User(username = 'admin', email = 'admin@gmail.com', password = 'admin', is_admin = True)
@@ -119,4 +357,7 @@ with app.app_context():
     if not storesupervisor:
         storesupervisor = User(username = 'storesupervisor', email = 'storesupervisor@gmail.com', password = 'storesupervisor', is_storesupervisor = True)
         db.session.add(storesupervisor)
+        db.session.commit()
+    if not ShiftPattern.query.first():
+        add_default_shifts(DEFAULT_PLANT_ID)
         db.session.commit()
\ No newline at end of file
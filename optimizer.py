@@ -0,0 +1,288 @@
+import math
+from datetime import timedelta
+from time import perf_counter
+
+from app import app
+from conflict_model import ConflictModel
+from feasibility import SEARCH_WINDOW_DAYS
+from plants import plant_schedules
+from work_calendar import to_working_minute, from_working_minute
+
+# One working minute late costs as much as this many minutes of makespan
+TARDINESS_WEIGHT = 100
+
+def get_models():
+    """Get model classes and db object - lazy import to avoid circular imports"""
+    from models import Schedule, OptimizerRun, db
+    return Schedule, OptimizerRun, db
+
+def job_operations(procedures):
+    """Procedures in sequence order paired with their duration in minutes"""
+    return [(procedure, procedure.procedure_plantime * 60) for procedure in sorted(procedures, key=lambda x: x.sequence)]
+
+def place_job(model, operations, target, floor):
+    """
+    Place one job on the conflict model: backward from target so every procedure ends
+    exactly when the next one starts, or, when that cannot fit after floor, forward
+    from floor as early as the procedures allow (the job is then late)
+    Returns a chronological list of (procedure, start, end) in working minutes
+    """
+    placements = []
+    end = target
+    for procedure, minutes in reversed(operations):
+        slot = model.latest_free_end(procedure.id, minutes, end, floor) if minutes else (end, end)
+        if slot is None:
+            for placed_procedure, start, placed_end in placements:
+                if placed_end > start:
+                    model.remove(placed_procedure.id, start, placed_end)
+            break
+        if minutes:
+            model.add(procedure.id, slot[0], slot[1])
+        placements.append((procedure, slot[0], slot[1]))
+        end = slot[0]
+    else:
+        return list(reversed(placements))
+    return place_forward(model, operations, floor)
+
+def place_forward(model, operations, floor):
+    """
+    Place one job on the conflict model as early as the procedures allow from floor
+    Returns a chronological list of (procedure, start, end) in working minutes
+    """
+    placements = []
+    start = floor
+    for procedure, minutes in operations:
+        slot = model.earliest_free_start(procedure.id, minutes, start) if minutes else (start, start)
+        if minutes:
+            model.add(procedure.id, slot[0], slot[1])
+        placements.append((procedure, slot[0], slot[1]))
+        start = slot[1]
+    return placements
+
+def plan_cost(tardiness, makespan):
+    return tardiness * TARDINESS_WEIGHT + makespan
+
+class OrderingDecoder:
+    """
+    Turns a job ordering into a plan on an in-memory conflict model
+    Re-decoding after a move only replays jobs from the first changed position
+    """
+    def __init__(self, operations_by_job, targets, floors, base_model=None):
+        self.operations_by_job = operations_by_job
+        self.targets = targets
+        self.floors = floors
+        self.model = base_model.copy() if base_model else ConflictModel()
+        self.order = []
+        self.placements = []
+
+    def decode(self, order, from_index=0):
+        from_index = min(from_index, len(self.order))
+        for job_placements in reversed(self.placements[from_index:]):
+            for procedure, start, end in job_placements:
+                if end > start:
+                    self.model.remove(procedure.id, start, end)
+        del self.placements[from_index:]
+
+        for job_id in order[from_index:]:
+            self.placements.append(place_job(self.model, self.operations_by_job[job_id], self.targets[job_id], self.floors[job_id]))
+        self.order = list(order)
+        return self.evaluate()
+
+    def evaluate(self):
+        """(tardiness, makespan) of the decoded plan in working minutes"""
+        return evaluate_placements(self.order, self.placements, self.targets)
+
+def evaluate_placements(order, placements, targets):
+    """(tardiness, makespan) in working minutes of jobs' placements, listed in order"""
+    tardiness = 0
+    first_start = None
+    last_end = None
+    for job_id, job_placements in zip(order, placements):
+        if not job_placements:
+            continue
+        tardiness += max(0, job_placements[-1][2] - targets[job_id])
+        first_start = job_placements[0][1] if first_start is None else min(first_start, job_placements[0][1])
+        last_end = job_placements[-1][2] if last_end is None else max(last_end, job_placements[-1][2])
+    makespan = last_end - first_start if first_start is not None else 0
+    return tardiness, makespan
+
+def add_placements(order, placements):
+    """Add Schedule rows for jobs' placements, listed in order"""
+    Schedule, OptimizerRun, db = get_models()
+    for job_id, job_placements in zip(order, placements):
+        for procedure, start, end in job_placements:
+            # A zero-length operation on a block boundary starts where it ends, at the end of the earlier block
+            db.session.add(Schedule(
+                job_id=job_id,
+                procedure_id=procedure.id,
+                start_datetime=from_working_minute(start, at_end=start == end),
+                end_datetime=from_working_minute(end, at_end=True),
+                planned_time=procedure.procedure_plantime,
+                planned_manpower=procedure.procedure_planmanpower
+            ))
+    db.session.flush()
+
+def get_targets_and_floors(jobs, target_datetimes, frozen=None):
+    """
+    Completion targets and earliest starts (search window) of jobs in working minutes
+    With a frozen window (see freeze) no job starts before its earliest replannable start
+    """
+    targets = {job.id: to_working_minute(target_datetimes[job.id]) for job in jobs}
+    floors = {job.id: to_working_minute(target_datetimes[job.id] - timedelta(days=SEARCH_WINDOW_DAYS)) for job in jobs}
+    if frozen is not None:
+        for job in jobs:
+            floors[job.id] = max(floors[job.id], to_working_minute(frozen.earliest_start(job.id)))
+    return targets, floors
+
+def solve_in_lanes(jobs, operations_by_job, target_datetimes, budget_ms, frozen=None):
+    """
+    Plan jobs with the in-memory engine, one lane of independent procedures per worker
+    Operations of a frozen window are fixed busy intervals every lane plans around
+    Returns (order, placements, (tardiness, makespan), iterations) merged over all lanes,
+    lanes in priority order of their first job
+    """
+    from lanes import partition_jobs, solve_lanes
+
+    targets, floors = get_targets_and_floors(jobs, target_datetimes, frozen)
+    lanes = partition_jobs(jobs, operations_by_job)
+    results = solve_lanes(lanes, operations_by_job, targets, floors, budget_ms,
+                          app.config['SCHEDULER_OPTIMIZER_SEED'], app.config['SCHEDULER_WORKERS'],
+                          frozen.model if frozen is not None else None)
+
+    order = []
+    placements = []
+    iterations = 0
+    for lane_order, lane_placements, lane_iterations in results:
+        order.extend(lane_order)
+        placements.extend(lane_placements)
+        iterations += lane_iterations
+    if len(lanes) > 1:
+        app.logger.info('Scheduler lanes: %d lanes of %s jobs', len(lanes), ', '.join(str(len(lane)) for lane in lanes))
+    return order, placements, evaluate_placements(order, placements, targets), iterations
+
+def evaluate_schedule_rows(rows, targets):
+    """
+    (unscheduled jobs, overlapping minutes, tardiness, makespan) of persisted Schedule rows
+    Overlaps and missing jobs rank ahead of lateness so a conflict-free plan always wins
+    """
+    job_ends = {}
+    first_start = None
+    last_end = None
+    by_procedure = {}
+    for row in rows:
+        start = to_working_minute(row.start_datetime)
+        end = to_working_minute(row.end_datetime)
+        job_ends[row.job_id] = max(job_ends.get(row.job_id, end), end)
+        first_start = start if first_start is None else min(first_start, start)
+        last_end = end if last_end is None else max(last_end, end)
+        by_procedure.setdefault(row.procedure_id, []).append((start, end))
+
+    overlap = 0
+    for intervals in by_procedure.values():
+        intervals.sort()
+        reach = None
+        for start, end in intervals:
+            if reach is not None and start < reach:
+                overlap += min(reach, end) - start
+            reach = end if reach is None else max(reach, end)
+
+    tardiness = sum(max(0, job_ends[job_id] - target) for job_id, target in targets.items() if job_id in job_ends)
+    unscheduled = sum(1 for job_id in targets if job_id not in job_ends)
+    makespan = last_end - first_start if first_start is not None else 0
+    return unscheduled, overlap, tardiness, makespan
+
+def anneal(decoder, order, groups, budget_seconds, rng):
+    """
+    Simulated annealing over swap and insert moves inside same-deadline groups
+    Returns (best order, best (tardiness, makespan), iterations)
+    """
+    current_order = list(order)
+    current = decoder.decode(current_order)
+    current_cost = plan_cost(*current)
+    best_order, best, best_cost = list(current_order), current, current_cost
+
+    movable = [group for group in groups if group[1] - group[0] >= 2]
+    if not movable:
+        return best_order, best, 0
+
+    started = perf_counter()
+    initial_temperature = max(1.0, current_cost * 0.01)
+    iterations = 0
+    while True:
+        elapsed = perf_counter() - started
+        if elapsed >= budget_seconds:
+            break
+        temperature = initial_temperature * (1 - elapsed / budget_seconds) + 1e-9
+
+        group_start, group_end = rng.choice(movable)
+        i, j = rng.sample(range(group_start, group_end), 2)
+        candidate_order = list(current_order)
+        if rng.random() < 0.5:
+            candidate_order[i], candidate_order[j] = candidate_order[j], candidate_order[i]
+        else:
+            candidate_order.insert(j, candidate_order.pop(i))
+        changed_from = min(i, j)
+
+        candidate = decoder.decode(candidate_order, changed_from)
+        candidate_cost = plan_cost(*candidate)
+        delta = candidate_cost - current_cost
+        iterations += 1
+
+        if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+            current_order, current, current_cost = candidate_order, candidate, candidate_cost
+            if current_cost < best_cost:
+                best_order, best, best_cost = list(current_order), current, current_cost
+        else:
+            decoder.decode(current_order, changed_from)
+
+    return best_order, best, iterations
+
+def optimize_schedules(jobs, operations_by_job, target_datetimes, frozen=None):
+    """
+    Improve the greedy plan currently in the session within the configured wall-clock budget
+    jobs must be in greedy priority order (deadline, then ID)
+    Replaces the Schedule rows only when the best plan found beats the greedy one,
+    and records the outcome in an OptimizerRun row
+    With a frozen window (see freeze) only the rows after its horizon are compared and replaced
+    Only the current plant's rows are compared and replaced
+    """
+    Schedule, OptimizerRun, db = get_models()
+
+    budget_ms = app.config['SCHEDULER_OPTIMIZER_BUDGET_MS']
+    started = perf_counter()
+
+    open_rows = plant_schedules() if frozen is None else plant_schedules().filter(Schedule.start_datetime >= frozen.horizon)
+    targets, floors = get_targets_and_floors(jobs, target_datetimes, frozen)
+    greedy_unscheduled, greedy_overlap, greedy_tardiness, greedy_makespan = evaluate_schedule_rows(open_rows.all(), targets)
+
+    order, placements, (best_tardiness, best_makespan), iterations = solve_in_lanes(
+        jobs, operations_by_job, target_datetimes, budget_ms, frozen)
+
+    greedy_rank = (greedy_unscheduled, greedy_overlap, plan_cost(greedy_tardiness, greedy_makespan))
+    best_rank = (0, 0, plan_cost(best_tardiness, best_makespan))
+    adopted = best_rank < greedy_rank
+
+    if adopted:
+        open_rows.delete()
+        add_placements(order, placements)
+
+    run = OptimizerRun(
+        budget_ms=budget_ms,
+        elapsed_ms=int((perf_counter() - started) * 1000),
+        iterations=iterations,
+        greedy_unscheduled=greedy_unscheduled,
+        greedy_overlap_minutes=greedy_overlap,
+        greedy_tardiness_minutes=greedy_tardiness,
+        greedy_makespan_minutes=greedy_makespan,
+        best_tardiness_minutes=best_tardiness,
+        best_makespan_minutes=best_makespan,
+        adopted=adopted
+    )
+    db.session.add(run)
+    app.logger.info(
+        'Schedule optimizer: %d moves in %d ms, tardiness %d -> %d min, makespan %d -> %d min, '
+        '%d overlapping min and %d unscheduled jobs in greedy plan, %s',
+        iterations, run.elapsed_ms, greedy_tardiness, best_tardiness, greedy_makespan, best_makespan,
+        greedy_overlap, greedy_unscheduled, 'adopted' if adopted else 'kept greedy plan'
+    )
+    return run
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import request, session, make_response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import app
+
+ROLE_FLAGS = ('is_admin', 'is_prodmanager', 'is_storemanager', 'is_prodsupervisor', 'is_storesupervisor', 'is_dispatch')
+
+def get_models():
+    """Get model classes and db object - lazy import to avoid circular imports"""
+    from models import DataVersion, db
+    return DataVersion, db
+
+def data_version():
+    """
+    The data version, bumped in the database by every commit that wrote something, in
+    that commit's transaction. Every worker process and command reads the same
+    version, so cached pages from older versions are never served
+    """
+    DataVersion, db = get_models()
+    return db.session.query(DataVersion.version).scalar() or 0
+
+def user_roles(user):
+    """The role flags a page's content depends on, stored in the session at login"""
+    return tuple(flag for flag in ROLE_FLAGS if getattr(user, flag))
+
+class PageCache:
+    """
+    LRU cache of rendered pages, capped by the total size of the stored bodies
+    Keys include the data version, so entries from before a write simply stop
+    being looked up and age out of the LRU order
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key)[0])
+            self.entries[key] = (body, mimetype)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                old_key, (old_body, old_mimetype) = self.entries.popitem(last=False)
+                self.size -= len(old_body)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'data_version': data_version()
+            }
+
+page_cache = PageCache(app.config['PAGE_CACHE_MAX_BYTES'])
+
+def cached_page(func):
+    """
+    Serve a GET page from the cache when nothing was written since it was rendered
+    Goes after auth_required. The key is the path, the viewer's roles and the data
+    version, so a hit needs neither a query nor a render. Pages are rendered fresh
+    while flash messages are pending, as those belong to one viewer only
+    """
+    @wraps(func)
+    def inner(*args, **kwargs):
+        if page_cache.max_bytes <= 0 or session.get('_flashes') or 'roles' not in session:
+            return func(*args, **kwargs)
+        key = (request.full_path, tuple(session['roles']), data_version())
+        entry = page_cache.get(key)
+        if entry is not None:
+            return make_response(entry[0], 200, {'Content-Type': entry[1]})
+        response = make_response(func(*args, **kwargs))
+        if response.status_code == 200 and not session.get('_flashes'):
+            page_cache.put(key, response.get_data(), response.headers['Content-Type'])
+        return response
+    return inner
+
+def session_has_uncommitted_writes(session):
+    """True when a session holds changes, flushed or not, that it has not committed yet"""
+    return bool(session.new or session.dirty or session.deleted or session.info.get('page_cache_dirty'))
+
+@event.listens_for(Session, 'after_flush')
+def _note_write(session, flush_context):
+    session.info['page_cache_dirty'] = True
+
+@event.listens_for(Session, 'after_bulk_delete')
+def _note_bulk_delete(delete_context):
+    delete_context.session.info['page_cache_dirty'] = True
+
+@event.listens_for(Session, 'after_bulk_update')
+def _note_bulk_update(update_context):
+    update_context.session.info['page_cache_dirty'] = True
+
+@event.listens_for(Session, 'before_commit')
+def _bump_data_version(session):
+    if session_has_uncommitted_writes(session):
+        DataVersion, db = get_models()
+        session.execute(DataVersion.__table__.update().values(version=DataVersion.version + 1))
+
+@event.listens_for(Session, 'after_commit')
+def _forget_committed_write(session):
+    session.info.pop('page_cache_dirty', None)
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_write(session):
+    session.info.pop('page_cache_dirty', None)
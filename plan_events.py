@@ -0,0 +1,83 @@
+import json
+from collections import deque
+from threading import Condition
+
+from plants import plant_procedure_ids
+
+def get_models():
+    """Get model classes and db object - lazy import to avoid circular imports"""
+    from models import Schedule, db
+    return Schedule, db
+
+class PlanBroadcaster:
+    """
+    Single publisher of plan change notices, fanned out to any number of subscribers
+    Subscribers block on one Condition between changes, so idle streams cost a
+    sleeping thread each and no polling. Recent notices are kept so a subscriber
+    that reconnects with its last seen version only misses what it has not seen
+    """
+    def __init__(self, history=50):
+        self.condition = Condition()
+        self.version = 0
+        self.notices = deque(maxlen=history)
+
+    def publish(self, added, changed, removed):
+        with self.condition:
+            self.version += 1
+            notice = {'version': self.version, 'added': added, 'changed': changed, 'removed': removed}
+            self.notices.append(notice)
+            self.condition.notify_all()
+            return notice
+
+    def wait_for(self, after_version, timeout):
+        """
+        Notices newer than after_version, waiting up to timeout seconds for one
+        Returns [] on timeout, or None when the subscriber is too far behind to
+        catch up from the kept notices and should reload the whole plan
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.version > after_version, timeout)
+            if self.version <= after_version:
+                return []
+            if not self.notices or self.notices[0]['version'] > after_version + 1:
+                return None
+            return [notice for notice in self.notices if notice['version'] > after_version]
+
+plan_broadcaster = PlanBroadcaster()
+
+def plan_snapshot():
+    """Current plant's plan as {(job ID, procedure ID): (start, end)}"""
+    Schedule, db = get_models()
+    rows = db.session.query(Schedule.job_id, Schedule.procedure_id, Schedule.start_datetime, Schedule.end_datetime).filter(
+        Schedule.procedure_id.in_(plant_procedure_ids())).all()
+    return {(job_id, procedure_id): (start.isoformat(), end.isoformat()) for job_id, procedure_id, start, end in rows}
+
+def publish_plan_changes(old_plan, new_plan):
+    """Publish the operations added, moved and removed by a regeneration, if any"""
+    added = [[job_id, procedure_id, start, end] for (job_id, procedure_id), (start, end) in new_plan.items() if (job_id, procedure_id) not in old_plan]
+    changed = [[job_id, procedure_id, start, end] for (job_id, procedure_id), (start, end) in new_plan.items()
+               if (job_id, procedure_id) in old_plan and old_plan[(job_id, procedure_id)] != (start, end)]
+    removed = [[job_id, procedure_id] for (job_id, procedure_id) in old_plan if (job_id, procedure_id) not in new_plan]
+    if added or changed or removed:
+        return plan_broadcaster.publish(sorted(added), sorted(changed), sorted(removed))
+    return None
+
+def stream_plan_changes(last_version, keepalive_seconds):
+    """Server-Sent Events for plan notices after last_version, with comment keepalives while idle"""
+    yield 'retry: 5000\n\n'
+    if last_version > plan_broadcaster.version:
+        # Seen before a server restart, so the client's plan cannot be patched
+        last_version = plan_broadcaster.version
+        yield 'id: {}\nevent: reload\ndata: {{}}\n\n'.format(last_version)
+    while True:
+        notices = plan_broadcaster.wait_for(last_version, keepalive_seconds)
+        if notices is None:
+            last_version = plan_broadcaster.version
+            yield 'id: {}\nevent: reload\ndata: {{}}\n\n'.format(last_version)
+            continue
+        if not notices:
+            yield ': keepalive\n\n'
+            continue
+        for notice in notices:
+            last_version = notice['version']
+            yield 'id: {}\nevent: plan\ndata: {}\n\n'.format(last_version, json.dumps(notice, separators=(',', ':')))
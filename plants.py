@@ -0,0 +1,67 @@
+import threading
+from contextlib import contextmanager
+
+# Plant seeded on first run; rows created without a plant belong to it
+DEFAULT_PLANT_ID = 1
+
+# Plant whose calendar and rows the code running on this thread works with
+_state = threading.local()
+
+def get_models():
+    """Get model classes and db object - lazy import to avoid circular imports"""
+    from models import Plant, Job, Procedure, Schedule, db
+    return Plant, Job, Procedure, Schedule, db
+
+def current_plant_id():
+    return getattr(_state, 'plant_id', DEFAULT_PLANT_ID)
+
+@contextmanager
+def use_plant(plant_id):
+    """
+    Work with one plant on this thread: its working calendar (see work_calendar) and
+    the plant-scoped queries below. Plants share no job, procedure or calendar
+    """
+    previous = current_plant_id()
+    _state.plant_id = plant_id
+    try:
+        yield
+    finally:
+        _state.plant_id = previous
+
+def plant_ids():
+    """IDs of every plant, oldest first"""
+    Plant, Job, Procedure, Schedule, db = get_models()
+    return [plant_id for plant_id, in db.session.query(Plant.id).order_by(Plant.id).all()]
+
+def all_plants():
+    Plant, Job, Procedure, Schedule, db = get_models()
+    return Plant.query.order_by(Plant.id).all()
+
+def plant_job_ids(plant_id=None):
+    """Subquery of the IDs of a plant's jobs, the current plant's by default"""
+    Plant, Job, Procedure, Schedule, db = get_models()
+    return db.select(Job.id).where(Job.plant_id == (plant_id or current_plant_id()))
+
+def plant_procedure_ids(plant_id=None):
+    """Subquery of the IDs of a plant's procedures, the current plant's by default"""
+    Plant, Job, Procedure, Schedule, db = get_models()
+    return db.select(Procedure.id).where(Procedure.plant_id == (plant_id or current_plant_id()))
+
+def plant_schedules(plant_id=None):
+    """
+    Schedule rows of a plant, the current plant's by default
+    A plant's operations are the ones on its procedures, so this seeks on
+    ix_schedule_procedure_start and Schedule needs no plant column of its own
+    """
+    Plant, Job, Procedure, Schedule, db = get_models()
+    return Schedule.query.filter(Schedule.procedure_id.in_(plant_procedure_ids(plant_id)))
+
+def parse_plant_arg(args, name='plant'):
+    """Plant ID from request arguments or a form, the default plant when absent, or an error message"""
+    Plant, Job, Procedure, Schedule, db = get_models()
+    value = args.get(name, '')
+    if value == '':
+        return DEFAULT_PLANT_ID, None
+    if not value.isdigit() or db.session.get(Plant, int(value)) is None:
+        return None, 'Plant not found.'
+    return int(value), None
@@ -0,0 +1,101 @@
+import cProfile
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from time import perf_counter
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Profile of the regeneration running on this thread, if profiling is on
+_state = threading.local()
+
+class SchedulerProfile:
+    """Per-phase wall time, per-function calls and search counters of one regeneration"""
+    def __init__(self):
+        self.phases = {}
+        self.calls = Counter()
+        self.call_ms = Counter()
+        self.counters = Counter()
+        self.sql_statements = 0
+
+    def as_dict(self):
+        return {
+            'phases_ms': {name: round(seconds * 1000, 2) for name, seconds in self.phases.items()},
+            'calls': {name: {'calls': calls, 'ms': round(self.call_ms[name], 2)} for name, calls in self.calls.most_common()},
+            'counters': dict(self.counters),
+            'sql_statements': self.sql_statements
+        }
+
+def current_profile():
+    return getattr(_state, 'profile', None)
+
+def count(name, amount=1):
+    """Add to a search counter of the running profile; a no-op when not profiling"""
+    profile = getattr(_state, 'profile', None)
+    if profile is not None:
+        profile.counters[name] += amount
+
+@contextmanager
+def phase(name):
+    """Time a phase of the regeneration; phases entered more than once add up"""
+    profile = getattr(_state, 'profile', None)
+    if profile is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        profile.phases[name] = profile.phases.get(name, 0.0) + perf_counter() - started
+
+def profiled(func):
+    """Count calls to a scheduler function, and their inclusive time, while profiling"""
+    @wraps(func)
+    def inner(*args, **kwargs):
+        profile = getattr(_state, 'profile', None)
+        if profile is None:
+            return func(*args, **kwargs)
+        started = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.calls[func.__name__] += 1
+            profile.call_ms[func.__name__] += (perf_counter() - started) * 1000
+    return inner
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_sql(conn, cursor, statement, parameters, context, executemany):
+    profile = getattr(_state, 'profile', None)
+    if profile is not None:
+        profile.sql_statements += 1
+
+def run_profiled(func, dump_dir=None):
+    """
+    Run func with profiling on for this thread
+    Returns (result, profile, elapsed seconds, cProfile dump path or None); the
+    cProfile dump is only written when dump_dir is given
+    """
+    profile = SchedulerProfile()
+    _state.profile = profile
+    profiler = cProfile.Profile() if dump_dir else None
+    started = perf_counter()
+    try:
+        if profiler:
+            profiler.enable()
+        result = func()
+    finally:
+        if profiler:
+            profiler.disable()
+        elapsed = perf_counter() - started
+        _state.profile = None
+
+    dump_path = None
+    if profiler:
+        os.makedirs(dump_dir, exist_ok=True)
+        dump_path = os.path.join(dump_dir, 'regenerate-{:%Y%m%d-%H%M%S-%f}.prof'.format(datetime.now()))
+        profiler.dump_stats(dump_path)
+    return result, profile, elapsed, dump_path
@@ -0,0 +1,220 @@
+from collections import namedtuple
+from datetime import datetime, date, timedelta
+from threading import Lock
+
+import page_cache
+from app import app
+from conflict_model import ConflictModel
+from feasibility import job_window_shortfall
+from freeze import FrozenWindow, freeze_horizon
+from plants import current_plant_id, plant_schedules
+from optimizer import job_operations, place_job, place_forward, get_targets_and_floors
+from routing import procedure_operations, steps_to_operations, get_job_operations
+from work_calendar import has_shift_pattern, to_working_minute, from_working_minute
+
+def get_models():
+    """Get model classes and db object - lazy import to avoid circular imports"""
+    from models import Job, Procedure, Schedule, RoutingTemplate, RoutingTemplateStep, db
+    return Job, Procedure, Schedule, RoutingTemplate, RoutingTemplateStep, db
+
+# Job-like stand-in for the job being quoted; real job IDs start at 1
+QuoteJob = namedtuple('QuoteJob', ['id', 'job_name', 'deadline_date', 'deadline_time'])
+QUOTE_JOB_ID = 0
+
+# How far past the completion a promisable deadline is looked for
+PROMISE_SEARCH_DAYS = 30
+
+class CapacityCache:
+    """
+    Each plant's stored plan as a conflict model, rebuilt only when the data version changes
+    Quotes place on a copy, so the cached models are never modified
+    """
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self):
+        """The current plant's model"""
+        version = page_cache.data_version()
+        plant_id = current_plant_id()
+        with self.lock:
+            entry = self.entries.get(plant_id)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        Job, Procedure, Schedule, RoutingTemplate, RoutingTemplateStep, db = get_models()
+        model = ConflictModel()
+        for row in plant_schedules().with_entities(Schedule.procedure_id, Schedule.start_datetime, Schedule.end_datetime).all():
+            model.add_fixed(row.procedure_id, to_working_minute(row.start_datetime), to_working_minute(row.end_datetime))
+        with self.lock:
+            self.entries[plant_id] = (version, model)
+        return model
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+capacity_cache = CapacityCache()
+
+def quote_operations(procedure_ids=None, template_id=None):
+    """
+    Operations of the job being quoted in the current plant: a routing template's steps,
+    the given procedures in sequence order, or every procedure like a job without a
+    routing. Returns (operations, error message or None)
+    """
+    Job, Procedure, Schedule, RoutingTemplate, RoutingTemplateStep, db = get_models()
+    procedures = Procedure.query.filter_by(plant_id=current_plant_id()).order_by(Procedure.sequence).all()
+    procedures_by_id = {procedure.id: procedure for procedure in procedures}
+    if template_id is not None:
+        template = db.session.get(RoutingTemplate, template_id)
+        if template is None or template.plant_id != current_plant_id():
+            return None, 'Routing template not found in this plant.'
+        steps = RoutingTemplateStep.query.filter_by(template_id=template_id).all()
+        if not steps:
+            return None, 'The routing template has no steps.'
+        operations = steps_to_operations(steps, procedures_by_id)
+        if not operations:
+            return None, 'The routing template has no procedures left.'
+        return operations, None
+    if procedure_ids:
+        unknown = [procedure_id for procedure_id in procedure_ids if procedure_id not in procedures_by_id]
+        if unknown:
+            return None, 'Unknown procedure IDs: {}.'.format(', '.join(str(procedure_id) for procedure_id in unknown))
+        return procedure_operations([procedures_by_id[procedure_id] for procedure_id in set(procedure_ids)]), None
+    if not procedures:
+        return None, 'There are no procedures to quote.'
+    return procedure_operations(procedures), None
+
+def quote_floor(now):
+    """Earliest working minute a new job may start: now, or the end of the frozen window when it is on"""
+    if app.config['SCHEDULER_FREEZE_WINDOW']:
+        return to_working_minute(freeze_horizon(now))
+    return to_working_minute(now)
+
+def promisable_deadline(completion):
+    """Earliest deadline date whose completion target (see get_completion_target_datetime) is not before completion"""
+    from scheduler import get_completion_target_datetime
+    day = completion.date()
+    for _ in range(PROMISE_SEARCH_DAYS):
+        day += timedelta(days=1)
+        if get_completion_target_datetime(day, datetime.min.time()) >= completion:
+            return day
+    return None
+
+def replan(jobs, operations_by_job, target_datetimes, frozen):
+    """
+    The single-pass plan (see scheduler.schedule_single_pass) of jobs in memory
+    Returns {job ID: completion in working minutes} of every job that gets placed
+    """
+    capacity = frozen.model.copy() if frozen is not None else ConflictModel()
+    candidates = [job for job in jobs if operations_by_job[job.id] and not job_window_shortfall(operations_by_job[job.id], target_datetimes[job.id])]
+    targets, floors = get_targets_and_floors(candidates, target_datetimes, frozen)
+    return {job.id: place_job(capacity, job_operations(operations_by_job[job.id]), targets[job.id], floors[job.id])[-1][2] for job in candidates}
+
+def plan_impact(operations, deadline_date, deadline_time, now):
+    """
+    How adding the job with this deadline would move existing jobs of the current plant
+    Every job is replanned in memory with the single pass, once as things are and once
+    with the new job in its priority place (after jobs with the same deadline), so the
+    difference is the new job's alone. Returns (new job's completion or None, list of
+    moved jobs as dicts)
+    """
+    from scheduler import get_completion_target_datetime
+    Job, Procedure, Schedule, RoutingTemplate, RoutingTemplateStep, db = get_models()
+    jobs = Job.query.filter_by(plant_id=current_plant_id()).order_by(Job.deadline_date, Job.deadline_time, Job.id).all()
+    procedures = Procedure.query.filter_by(plant_id=current_plant_id()).order_by(Procedure.sequence).all()
+    operations_by_job = get_job_operations(jobs, procedures) if jobs else {}
+    target_datetimes = {job.id: get_completion_target_datetime(job.deadline_date, job.deadline_time) for job in jobs}
+
+    frozen = None
+    if app.config['SCHEDULER_FREEZE_WINDOW']:
+        # The window a regeneration would keep, without deleting what it would replan
+        horizon = freeze_horizon(now)
+        frozen = FrozenWindow(horizon, plant_schedules().filter(Schedule.start_datetime < horizon).order_by(Schedule.start_datetime).all()).load_model()
+        operations_by_job = {job.id: frozen.remaining(job.id, operations_by_job[job.id]) for job in jobs}
+
+    new_job = QuoteJob(QUOTE_JOB_ID, 'Quote', deadline_date, deadline_time)
+    with_new_job = sorted(jobs + [new_job], key=lambda job: (job.deadline_date, job.deadline_time, job.id == QUOTE_JOB_ID, job.id))
+    before = replan(jobs, operations_by_job, target_datetimes, frozen)
+    operations_by_job[QUOTE_JOB_ID] = operations
+    target_datetimes[QUOTE_JOB_ID] = get_completion_target_datetime(deadline_date, deadline_time)
+    after = replan(with_new_job, operations_by_job, target_datetimes, frozen)
+
+    moved = []
+    for job in jobs:
+        if before.get(job.id) == after.get(job.id):
+            continue
+        target = to_working_minute(target_datetimes[job.id])
+        moved.append({
+            'job_id': job.id,
+            'job_name': job.job_name,
+            'completion_before': from_working_minute(before[job.id], at_end=True) if job.id in before else None,
+            'completion_after': from_working_minute(after[job.id], at_end=True) if job.id in after else None,
+            'late_before': job.id in before and before[job.id] > target,
+            'late_after': job.id in after and after[job.id] > target
+        })
+    completion = from_working_minute(after[QUOTE_JOB_ID], at_end=True) if QUOTE_JOB_ID in after else None
+    return completion, moved
+
+def quote_job(operations, deadline_date=None, deadline_time=None, impact=False, now=None):
+    """
+    Capable-to-promise quote for a job that would come in now, without writing anything
+    The job is placed as early as possible around the stored plan (the cached capacity
+    picture), which moves nobody; its completion gives the earliest deadline that can be
+    promised. With impact, existing jobs are replanned in memory with the new job at the
+    requested deadline, or the promised one, to show whose completion would move
+    """
+    now = now or datetime.now()
+    model = capacity_cache.get().copy()
+    placements = place_forward(model, job_operations(operations), quote_floor(now))
+    completion = from_working_minute(placements[-1][2], at_end=True)
+    promise = promisable_deadline(completion)
+
+    quote = {
+        'quoted_at': now,
+        'earliest_start': from_working_minute(placements[0][1]),
+        'earliest_completion': completion,
+        'promisable_deadline': promise,
+        'working_minutes': sum(minutes for procedure, minutes in job_operations(operations)),
+        'operations': [{'procedure_id': procedure.id, 'start_datetime': from_working_minute(start, at_end=start == end), 'end_datetime': from_working_minute(end, at_end=True)}
+                       for procedure, start, end in placements]
+    }
+    if deadline_date is not None:
+        from scheduler import get_completion_target_datetime
+        quote['requested_deadline_feasible'] = completion <= get_completion_target_datetime(deadline_date, deadline_time)
+    if impact:
+        impact_date = deadline_date if deadline_date is not None else promise
+        if impact_date is not None:
+            impact_time = deadline_time if deadline_time is not None else datetime.min.time()
+            quote['impact'] = dict(zip(('completion', 'moved_jobs'), plan_impact(operations, impact_date, impact_time, now)),
+                                   deadline_date=impact_date)
+    return quote
+
+def parse_quote_args(args):
+    """
+    (operations, deadline date or None, deadline time or None, impact) from request
+    arguments, or an error message
+    """
+    if not has_shift_pattern():
+        return None, 'The plant has no shifts on its calendar.'
+    template = args.get('template')
+    procedure_ids = args.getlist('procedure')
+    if template is not None and not template.isdigit():
+        return None, 'Template must be a routing template ID.'
+    if not all(procedure_id.isdigit() for procedure_id in procedure_ids):
+        return None, 'Procedures must be procedure IDs.'
+    operations, error = quote_operations([int(procedure_id) for procedure_id in procedure_ids], int(template) if template else None)
+    if error:
+        return None, error
+    try:
+        deadline_date = date.fromisoformat(args['deadline']) if args.get('deadline') else None
+        deadline_time = datetime.strptime(args['time'], '%H:%M').time() if args.get('time') else None
+    except ValueError:
+        return None, 'Deadline must be a valid date and time a valid HH:MM time.'
+    if deadline_time is not None and deadline_date is None:
+        return None, 'A deadline time needs a deadline date.'
+    impact = args.get('impact', '').lower() in ('true', '1', 'yes')
+    return (operations, deadline_date, deadline_time, impact), None
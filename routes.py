@@ -1,12 +1,24 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response
+import json
 from werkzeug.security import check_password_hash, generate_password_hash
 from functools import wraps
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from scheduler import generate_schedule, generate_schedule_for_deadline, regenerate_all_schedules
+from work_calendar import invalidate_calendar, MAX_CLOSED_DAYS
+from page_cache import cached_page, page_cache, user_roles
+from plan_events import plan_broadcaster, stream_plan_changes
+from bulk_import import import_csv, JOB_COLUMNS, PROCEDURE_COLUMNS
+from kpi import dashboard_kpis
+from heatmap import utilisation_heatmap, parse_heatmap_args
+from segments import clear_segments
+from quote import quote_job, parse_quote_args, capacity_cache
+from templating import fragment_cache
+from work_queue import station_procedures, station_queues, queue_length, queue_cache
+from plants import all_plants, use_plant, parse_plant_arg, plant_procedure_ids
 
 from app import app
 
-from models import db, User, Procedure, Job, Schedule
+from models import db, User, Procedure, Job, Schedule, ShiftPattern, Holiday, CalendarException, UnscheduledJob, JobRouting, RoutingTemplate, RoutingTemplateStep, ProcedureLoad, SchedulerRunLog
 
 def auth_required(func):
     @wraps(func)
@@ -22,6 +34,10 @@ def get_current_user():
         return User.query.get(session['user_id'])
     return None
 
+def get_unscheduled_jobs():
+    unscheduled = db.session.query(UnscheduledJob, Job).join(Job, UnscheduledJob.job_id == Job.id).order_by(Job.deadline_date, Job.deadline_time, Job.id).all()
+    return [{'job_name': job.job_name, 'deadline_date': job.deadline_date, 'deadline_time': job.deadline_time, 'reason': u.reason, 'detected_at': u.detected_at} for u, job in unscheduled]
+
 @app.route('/login')
 def login():
     return render_template('login.html', user=None)
@@ -42,6 +58,7 @@ def login_post():
         return redirect(url_for('login'))
     
     session['user_id'] = user.id
+    session['roles'] = user_roles(user)
 
     if user.is_admin:
         return redirect(url_for('admin'))
@@ -65,7 +82,7 @@ def admin():
     if not user.is_admin:
         flash('You are not authorized to access this page.')
         return redirect(url_for('index'))
-    return render_template('admin.html', user=user)
+    return render_template('admin.html', user=user, unscheduled=get_unscheduled_jobs(), kpis=dashboard_kpis(Procedure.query.order_by(Procedure.sequence).all()))
 
 @app.route('/prodmanager')
 @auth_required
@@ -74,7 +91,7 @@ def prodmanager():
     if not user.is_prodmanager:
         flash('You are not authorized to access this page.')
         return redirect(url_for('index'))
-    return render_template('prodmanager.html', user=user)
+    return render_template('prodmanager.html', user=user, unscheduled=get_unscheduled_jobs(), kpis=dashboard_kpis(Procedure.query.filter_by(procedure_is_prod=True).order_by(Procedure.sequence).all()))
 
 @app.route('/storemanager')
 @auth_required
@@ -83,7 +100,7 @@ def storemanager():
     if not user.is_storemanager:
         flash('You are not authorized to access this page.')
         return redirect(url_for('index'))
-    return render_template('storemanager.html', user=user)
+    return render_template('storemanager.html', user=user, unscheduled=get_unscheduled_jobs(), kpis=dashboard_kpis(Procedure.query.filter_by(procedure_is_store=True).order_by(Procedure.sequence).all()))
 
 @app.route('/prodsupervisor')
 @auth_required
@@ -92,7 +109,7 @@ def prodsupervisor():
     if not user.is_prodsupervisor:
         flash('You are not authorized to access this page.')
         return redirect(url_for('index'))
-    return render_template('prodsupervisor.html', user=user)
+    return render_template('prodsupervisor.html', user=user, queues=station_queues(station_procedures(user)), now=datetime.now())
 
 @app.route('/storesupervisor')
 @auth_required
@@ -101,7 +118,7 @@ def storesupervisor():
     if not user.is_storesupervisor:
         flash('You are not authorized to access this page.')
         return redirect(url_for('index'))
-    return render_template('storesupervisor.html', user=user)
+    return render_template('storesupervisor.html', user=user, queues=station_queues(station_procedures(user)), now=datetime.now())
 
 @app.route('/dispatch')
 @auth_required
@@ -141,14 +158,160 @@ def grn():
 
 @app.route('/schedule')
 @auth_required
+@cached_page
 def schedule():
     schedules = db.session.query(Schedule, Job.job_name, Procedure.procedure_name).join(Job, Schedule.job_id == Job.id).join(Procedure, Schedule.procedure_id == Procedure.id).all()
 
     schedule_list = []
     for s, job_name, procedure_name in schedules:
-        schedule_list.append({'job_name': job_name, 'procedure_name': procedure_name, 'start_datetime': s.start_datetime, 'end_datetime': s.end_datetime, 'planned_time': s.planned_time, 'planned_manpower': s.planned_manpower})
+        schedule_list.append({'job_name': job_name, 'procedure_name': procedure_name, 'start_datetime': s.start_datetime, 'end_datetime': s.end_datetime, 'planned_time': s.planned_time, 'planned_manpower': s.planned_manpower, 'slack_minutes': s.slack_minutes, 'is_critical': s.is_critical})
+
+    return render_template('schedule.html', user=User.query.get(session['user_id']), schedules=schedule_list, unscheduled=get_unscheduled_jobs(), plan_version=plan_broadcaster.version)
+
+@app.route('/schedule/stream')
+@auth_required
+def schedule_stream():
+    # EventSource sends Last-Event-ID when it reconnects; the page passes the version it was rendered at
+    last_version = request.headers.get('Last-Event-ID', request.args.get('version', ''))
+    last_version = int(last_version) if last_version.isdigit() else plan_broadcaster.version
+    # The stream never touches the database, so it holds no connection while idle
+    return Response(stream_plan_changes(last_version, app.config['PLAN_STREAM_KEEPALIVE_SECONDS']),
+                    mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/schedule/at-risk')
+@auth_required
+def schedule_at_risk():
+    user = User.query.get(session['user_id'])
+    if not (user.is_admin or user.is_prodmanager or user.is_storemanager):
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+
+    # job_slack_minutes is indexed, so this is a range seek rather than a replan
+    at_risk = db.session.query(Job, db.func.min(Schedule.job_slack_minutes), db.func.max(Schedule.end_datetime)).join(Schedule, Schedule.job_id == Job.id).filter(Schedule.job_slack_minutes < app.config['AT_RISK_SLACK_MINUTES']).group_by(Job.id).order_by(db.func.min(Schedule.job_slack_minutes)).all()
+
+    job_list = []
+    for job, job_slack_minutes, planned_end in at_risk:
+        job_list.append({'job_name': job.job_name, 'deadline_date': job.deadline_date, 'deadline_time': job.deadline_time, 'planned_end': planned_end, 'job_slack_minutes': job_slack_minutes})
+
+    return render_template('at_risk.html', user=user, jobs=job_list, threshold_minutes=app.config['AT_RISK_SLACK_MINUTES'])
+
+def queue_json(queue):
+    """A station work queue with its datetimes as ISO strings"""
+    def operation(op):
+        return dict(op, start_datetime=op['start_datetime'].isoformat(), end_datetime=op['end_datetime'].isoformat())
+    return dict(queue, current=operation(queue['current']) if queue['current'] else None, next=[operation(op) for op in queue['next']])
+
+@app.route('/station/queue')
+@auth_required
+def station_queue_list():
+    user = User.query.get(session['user_id'])
+    procedures = station_procedures(user)
+    if not procedures:
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    # Current and next operations of every station the user supervises or manages
+    return jsonify([queue_json(queue) for queue in station_queues(procedures, queue_length(request.args.get('limit')))])
 
-    return render_template('schedule.html', user=User.query.get(session['user_id']), schedules=schedule_list)
+@app.route('/station/<int:id>/queue')
+@auth_required
+def station_queue(id):
+    user = User.query.get(session['user_id'])
+    procedures = [procedure for procedure in station_procedures(user) if procedure.id == id]
+    if not procedures:
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    return jsonify(queue_json(station_queues(procedures, queue_length(request.args.get('limit')))[0]))
+
+def managed_procedures(user, plant_id):
+    """Procedures of a plant a manager plans for: all for admins, otherwise those of the manager's type"""
+    procedures = Procedure.query.filter_by(plant_id=plant_id).order_by(Procedure.sequence).all()
+    if user.is_admin:
+        return procedures
+    return [procedure for procedure in procedures if (user.is_prodmanager and procedure.procedure_is_prod) or (user.is_storemanager and procedure.procedure_is_store)]
+
+@app.route('/schedule/heatmap')
+@auth_required
+def schedule_heatmap():
+    user = User.query.get(session['user_id'])
+    if not (user.is_admin or user.is_prodmanager or user.is_storemanager):
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    heatmap_range, error = parse_heatmap_args(request.args)
+    plant_id, plant_error = parse_plant_arg(request.args)
+    if error or plant_error:
+        flash(error or plant_error)
+        return redirect(url_for('schedule_heatmap'))
+    first_day, last_day, bucket = heatmap_range
+    # One plant at a time, as capacity comes from the plant's calendar
+    with use_plant(plant_id):
+        heatmap = utilisation_heatmap(managed_procedures(user, plant_id), first_day, last_day, bucket)
+    return render_template('heatmap.html', user=user, heatmap=heatmap, first_day=first_day, last_day=last_day, plants=all_plants(), plant_id=plant_id)
+
+@app.route('/schedule/heatmap/data')
+@auth_required
+def schedule_heatmap_data():
+    user = User.query.get(session['user_id'])
+    if not (user.is_admin or user.is_prodmanager or user.is_storemanager):
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    heatmap_range, error = parse_heatmap_args(request.args)
+    plant_id, plant_error = parse_plant_arg(request.args)
+    if error or plant_error:
+        return jsonify({'error': error or plant_error}), 400
+    with use_plant(plant_id):
+        heatmap = utilisation_heatmap(managed_procedures(user, plant_id), *heatmap_range)
+    return jsonify(dict(heatmap, buckets=[bucket.isoformat() for bucket in heatmap['buckets']]))
+
+@app.route('/schedule/quote')
+@auth_required
+def schedule_quote():
+    user = User.query.get(session['user_id'])
+    if not (user.is_admin or user.is_prodmanager):
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    # What-if for a job coming in now at one plant: nothing is written, see quote.quote_job
+    plant_id, error = parse_plant_arg(request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    with use_plant(plant_id):
+        quote_request, error = parse_quote_args(request.args)
+        if error:
+            return jsonify({'error': error}), 400
+        quote = quote_job(*quote_request)
+
+    def moved_job(job):
+        return dict(job, completion_before=job['completion_before'].isoformat() if job['completion_before'] else None,
+                    completion_after=job['completion_after'].isoformat() if job['completion_after'] else None)
+    result = dict(quote, quoted_at=quote['quoted_at'].isoformat(), earliest_start=quote['earliest_start'].isoformat(),
+                  earliest_completion=quote['earliest_completion'].isoformat(),
+                  promisable_deadline=quote['promisable_deadline'].isoformat() if quote['promisable_deadline'] else None,
+                  operations=[dict(op, start_datetime=op['start_datetime'].isoformat(), end_datetime=op['end_datetime'].isoformat()) for op in quote['operations']])
+    if 'impact' in quote:
+        impact = quote['impact']
+        result['impact'] = {'deadline_date': impact['deadline_date'].isoformat(),
+                            'completion': impact['completion'].isoformat() if impact['completion'] else None,
+                            'moved_jobs': [moved_job(job) for job in impact['moved_jobs']]}
+    return jsonify(result)
+
+@app.route('/cache/stats')
+@auth_required
+def cache_stats():
+    user = User.query.get(session['user_id'])
+    if not user.is_admin:
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    return jsonify(dict(page_cache.stats(), station_queues=queue_cache.stats(), quote_capacity=capacity_cache.stats(), template_fragments=fragment_cache.stats()))
+
+@app.route('/scheduler/runs')
+@auth_required
+def scheduler_runs():
+    user = User.query.get(session['user_id'])
+    if not user.is_admin:
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    # Profiled regenerations (SCHEDULER_PROFILE), newest first
+    runs = SchedulerRunLog.query.order_by(SchedulerRunLog.id.desc()).limit(20).all()
+    return jsonify([{'run_at': run.run_at.isoformat(), 'plant_id': run.plant_id, 'engine': run.engine, 'elapsed_ms': run.elapsed_ms, 'job_count': run.job_count, 'operation_count': run.operation_count, 'sql_statements': run.sql_statements, 'phases_ms': json.loads(run.phases), 'calls': json.loads(run.calls), 'counters': json.loads(run.counters), 'profile_path': run.profile_path} for run in runs])
 
 @app.route('/progress')
 @auth_required
@@ -157,6 +320,7 @@ def progress():
 
 @app.route('/procedure')
 @auth_required
+@cached_page
 def procedure():
     user = User.query.get(session['user_id'])
     if not (user.is_admin or user.is_prodmanager or user.is_storemanager):
@@ -166,6 +330,7 @@ def procedure():
 
 @app.route('/job')
 @auth_required
+@cached_page
 def job():
     return render_template('job.html', user=User.query.get(session['user_id']), jobs=Job.query.all())
 
@@ -218,6 +383,7 @@ def profile_post():
 @auth_required
 def logout():
     session.pop('user_id')
+    session.pop('roles', None)
     return redirect(url_for('login'))
 
 @app.route('/procedure/add')
@@ -227,7 +393,7 @@ def add_procedure():
     if not (user.is_admin or user.is_prodmanager or user.is_storemanager):
         flash('You are not authorized to access this page.')
         return redirect(url_for('index'))
-    return render_template('procedure/add.html', user=user)
+    return render_template('procedure/add.html', user=user, plants=all_plants())
 
 @app.route('/procedure/add', methods=['POST'])
 @auth_required
@@ -242,6 +408,11 @@ def add_procedure_post():
     procedure_plantime = request.form.get('procedure_plantime')
     procedure_planmanpower = request.form.get('procedure_planmanpower')
     sequence = request.form.get('sequence')
+    plant_id, error = parse_plant_arg(request.form)
+
+    if error:
+        flash(error)
+        return redirect(url_for('add_procedure'))
 
     if procedure_name == '':
         flash('Procedure Name cannot be empty.')
@@ -264,14 +435,14 @@ def add_procedure_post():
         return redirect(url_for('add_procedure'))
     
     if user.is_prodmanager:
-        procedure = Procedure(procedure_name=procedure_name, procedure_description=procedure_description, procedure_plantime=int(procedure_plantime), procedure_planmanpower=int(procedure_planmanpower), sequence=int(sequence), procedure_is_prod=True, procedure_is_store=False)
+        procedure = Procedure(procedure_name=procedure_name, procedure_description=procedure_description, procedure_plantime=int(procedure_plantime), procedure_planmanpower=int(procedure_planmanpower), sequence=int(sequence), procedure_is_prod=True, procedure_is_store=False, plant_id=plant_id)
     elif user.is_storemanager:
-        procedure = Procedure(procedure_name=procedure_name, procedure_description=procedure_description, procedure_plantime=int(procedure_plantime), procedure_planmanpower=int(procedure_planmanpower), sequence=int(sequence), procedure_is_prod=False, procedure_is_store=True)
+        procedure = Procedure(procedure_name=procedure_name, procedure_description=procedure_description, procedure_plantime=int(procedure_plantime), procedure_planmanpower=int(procedure_planmanpower), sequence=int(sequence), procedure_is_prod=False, procedure_is_store=True, plant_id=plant_id)
     db.session.add(procedure)
     db.session.commit()
     
-    # Regenerate all schedules since procedures have changed
-    regenerate_all_schedules()
+    # Regenerate the plant's schedules since its procedures have changed
+    regenerate_all_schedules(plant_id)
     
     flash('Procedure added successfully.')
     return redirect(url_for('procedure'))
@@ -328,8 +499,8 @@ def edit_procedure_post(id):
     procedure.sequence = int(sequence)
     db.session.commit()
     
-    # Regenerate all schedules since procedures have changed
-    regenerate_all_schedules()
+    # Regenerate the plant's schedules since its procedures have changed
+    regenerate_all_schedules(procedure.plant_id)
     
     flash('Procedure updated successfully.')
     return redirect(url_for('procedure'))
@@ -355,11 +526,18 @@ def delete_procedure_post(id):
     if not procedure:
         flash('Procedure not found.')
         return redirect(url_for('procedure'))
+    # Rows that point at this procedure; schedules are rebuilt by the regeneration below
+    clear_segments(Schedule.query.filter_by(procedure_id=id))
+    Schedule.query.filter_by(procedure_id=id).delete()
+    JobRouting.query.filter_by(procedure_id=id).delete()
+    RoutingTemplateStep.query.filter_by(procedure_id=id).delete()
+    ProcedureLoad.query.filter_by(procedure_id=id).delete()
+    plant_id = procedure.plant_id
     db.session.delete(procedure)
     db.session.commit()
     
-    # Regenerate all schedules since procedures have changed
-    regenerate_all_schedules()
+    # Regenerate the plant's schedules since its procedures have changed
+    regenerate_all_schedules(plant_id)
     
     flash('Procedure deleted successfully.')
     return redirect(url_for('procedure'))
@@ -371,7 +549,7 @@ def add_job():
     if not (user.is_admin or user.is_prodmanager):
         flash('You are not authorized to access this page.')
         return redirect(url_for('index'))
-    return render_template('job/add.html', user=user)
+    return render_template('job/add.html', user=user, plants=all_plants())
 
 @app.route('/job/add', methods=['POST'])
 @auth_required
@@ -385,6 +563,11 @@ def add_job_post():
     job_description = request.form.get('job_description')
     deadline_date = request.form.get('deadline_date')
     deadline_time = request.form.get('deadline_time')
+    plant_id, error = parse_plant_arg(request.form)
+    
+    if error:
+        flash(error)
+        return redirect(url_for('add_job'))
     
     if job_name == '':
         flash('Job Name cannot be empty.')
@@ -405,12 +588,12 @@ def add_job_post():
     deadline_date_obj = date.fromisoformat(deadline_date)
     deadline_time_obj = datetime.strptime(deadline_time, '%H:%M').time()
 
-    job = Job(job_name=job_name, job_description=job_description, deadline_date=deadline_date_obj, deadline_time=deadline_time_obj)
+    job = Job(job_name=job_name, job_description=job_description, deadline_date=deadline_date_obj, deadline_time=deadline_time_obj, plant_id=plant_id)
     db.session.add(job)
     db.session.commit()
     
-    # Regenerate all schedules since a new job has been added
-    regenerate_all_schedules()
+    # Regenerate the plant's schedules since a new job has been added
+    regenerate_all_schedules(plant_id)
 
     flash('Job added successfully.')
     return redirect(url_for('job'))
@@ -461,8 +644,8 @@ def edit_job_post(id):
     job.deadline_time = datetime.strptime(deadline_time, '%H:%M').time()
     db.session.commit()
     
-    # Regenerate all schedules since job has been updated
-    regenerate_all_schedules()
+    # Regenerate the plant's schedules since job has been updated
+    regenerate_all_schedules(job.plant_id)
     
     flash('Job updated successfully.')
     return redirect(url_for('job'))
@@ -488,11 +671,472 @@ def delete_job_post(id):
     if not job:
         flash('Job not found.')
         return redirect(url_for('job'))
+    # Rows that point at this job; schedules are rebuilt by the regeneration below
+    clear_segments(Schedule.query.filter_by(job_id=id))
+    Schedule.query.filter_by(job_id=id).delete()
+    UnscheduledJob.query.filter_by(job_id=id).delete()
+    JobRouting.query.filter_by(job_id=id).delete()
+    plant_id = job.plant_id
     db.session.delete(job)
     db.session.commit()
     
-    # Regenerate all schedules since job has been deleted
-    regenerate_all_schedules()
+    # Regenerate the plant's schedules since job has been deleted
+    regenerate_all_schedules(plant_id)
     
     flash('Job deleted successfully.')
-    return redirect(url_for('job'))
\ No newline at end of file
+    return redirect(url_for('job'))
+
+def can_import(user, kind):
+    if kind == 'jobs':
+        return user.is_admin or user.is_prodmanager
+    return user.is_admin or user.is_prodmanager or user.is_storemanager
+
+@app.route('/import/<kind>')
+@auth_required
+def bulk_import(kind):
+    user = User.query.get(session['user_id'])
+    if kind not in ('jobs', 'procedures') or not can_import(user, kind):
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    columns = JOB_COLUMNS if kind == 'jobs' else PROCEDURE_COLUMNS + (['procedure_type'] if user.is_admin else [])
+    return render_template('import.html', user=user, kind=kind, columns=columns, plants=all_plants())
+
+@app.route('/import/<kind>', methods=['POST'])
+@auth_required
+def bulk_import_post(kind):
+    user = User.query.get(session['user_id'])
+    if kind not in ('jobs', 'procedures') or not can_import(user, kind):
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+
+    csv_file = request.files.get('csv_file')
+    if not csv_file or csv_file.filename == '':
+        flash('Please choose a CSV file.')
+        return redirect(url_for('bulk_import', kind=kind))
+
+    try:
+        text = csv_file.read().decode('utf-8')
+    except UnicodeDecodeError:
+        flash('The file must be a UTF-8 encoded CSV.')
+        return redirect(url_for('bulk_import', kind=kind))
+
+    plant_id, error = parse_plant_arg(request.form)
+    if error:
+        flash(error)
+        return redirect(url_for('bulk_import', kind=kind))
+
+    # Managers may only import procedures of their own type; admins give it per row
+    procedure_type = None
+    if kind == 'procedures' and not user.is_admin:
+        procedure_type = 'prod' if user.is_prodmanager else 'store'
+
+    # One transaction and one regeneration of the plant for the whole file
+    added, updated, errors = import_csv(kind, text, procedure_type, plant_id)
+    if errors:
+        for error in errors[:20]:
+            flash(error)
+        if len(errors) > 20:
+            flash('... and {} more errors. Nothing was imported.'.format(len(errors) - 20))
+        return redirect(url_for('bulk_import', kind=kind))
+
+    flash('Imported {} new and {} updated {}.'.format(added, updated, kind))
+    return redirect(url_for('job' if kind == 'jobs' else 'procedure'))
+
+def parse_routing_form(procedures):
+    """
+    Read the routing editor form: one include checkbox, sequence and optional
+    plantime override per procedure. Returns (steps, error message)
+    """
+    steps = []
+    for procedure in procedures:
+        if not request.form.get('include_{}'.format(procedure.id)):
+            continue
+        sequence = request.form.get('sequence_{}'.format(procedure.id), '')
+        plantime = request.form.get('plantime_{}'.format(procedure.id), '')
+        if sequence == '' or not sequence.isdigit():
+            return None, 'Sequence of {} must be a valid number.'.format(procedure.procedure_name)
+        if plantime != '' and not plantime.isdigit():
+            return None, 'Time Required of {} must be a valid number.'.format(procedure.procedure_name)
+        steps.append({'procedure_id': procedure.id, 'sequence': int(sequence), 'plantime': int(plantime) if plantime != '' else None})
+    return steps, None
+
+@app.route('/job/<int:id>/routing')
+@auth_required
+def job_routing(id):
+    user = User.query.get(session['user_id'])
+    if not (user.is_admin or user.is_prodmanager):
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    job = Job.query.get(id)
+    if not job:
+        flash('Job not found.')
+        return redirect(url_for('job'))
+    steps = {step.procedure_id: step for step in JobRouting.query.filter_by(job_id=id).all()}
+    procedures = Procedure.query.filter_by(plant_id=job.plant_id).order_by(Procedure.sequence).all()
+    return render_template('routing/edit.html', user=user, job=job, template=None, steps=steps, procedures=procedures, templates=RoutingTemplate.query.filter_by(plant_id=job.plant_id).all())
+
+@app.route('/job/<int:id>/routing', methods=['POST'])
+@auth_required
+def job_routing_post(id):
+    user = User.query.get(session['user_id'])
+    if not (user.is_admin or user.is_prodmanager):
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    job = Job.query.get(id)
+    if not job:
+        flash('Job not found.')
+        return redirect(url_for('job'))
+
+    template_id = request.form.get('template_id')
+    if template_id:
+        template = RoutingTemplate.query.get(int(template_id)) if template_id.isdigit() else None
+        if not template:
+            flash('Routing Template not found.')
+            return redirect(url_for('job_routing', id=id))
+        if template.plant_id != job.plant_id:
+            flash('The Routing Template belongs to another plant.')
+            return redirect(url_for('job_routing', id=id))
+        # A template only lists its plant's procedures, but one from before templates had a plant may hold others
+        template_steps = RoutingTemplateStep.query.filter_by(template_id=template.id).filter(RoutingTemplateStep.procedure_id.in_(plant_procedure_ids(job.plant_id))).all()
+        steps = [{'procedure_id': step.procedure_id, 'sequence': step.sequence, 'plantime': step.plantime} for step in template_steps]
+    else:
+        steps, error = parse_routing_form(Procedure.query.filter_by(plant_id=job.plant_id).all())
+        if error:
+            flash(error)
+            return redirect(url_for('job_routing', id=id))
+
+    JobRouting.query.filter_by(job_id=id).delete()
+    for step in steps:
+        db.session.add(JobRouting(job_id=id, **step))
+    db.session.commit()
+
+    # Regenerate the plant's schedules since the job's procedures have changed
+    regenerate_all_schedules(job.plant_id)
+
+    flash('Job routing updated successfully.')
+    return redirect(url_for('job'))
+
+@app.route('/routing')
+@auth_required
+def routing():
+    user = User.query.get(session['user_id'])
+    if not (user.is_admin or user.is_prodmanager):
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    return render_template('routing.html', user=user, templates=RoutingTemplate.query.order_by(RoutingTemplate.plant_id, RoutingTemplate.id).all(), plants=all_plants())
+
+@app.route('/routing/add', methods=['POST'])
+@auth_required
+def add_routing_template_post():
+    user = User.query.get(session['user_id'])
+    if not (user.is_admin or user.is_prodmanager):
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+
+    plant_id, error = parse_plant_arg(request.form)
+    if error:
+        flash(error)
+        return redirect(url_for('routing'))
+
+    template_name = request.form.get('template_name')
+    template_description = request.form.get('template_description')
+
+    if template_name == '':
+        flash('Template Name cannot be empty.')
+        return redirect(url_for('routing'))
+
+    if template_description == '':
+        flash('Template Description cannot be empty.')
+        return redirect(url_for('routing'))
+
+    template = RoutingTemplate(plant_id=plant_id, template_name=template_name, template_description=template_description)
+    db.session.add(template)
+    db.session.commit()
+
+    flash('Routing Template added successfully.')
+    return redirect(url_for('edit_routing_template', id=template.id))
+
+@app.route('/routing/<int:id>/edit')
+@auth_required
+def edit_routing_template(id):
+    user = User.query.get(session['user_id'])
+    if not (user.is_admin or user.is_prodmanager):
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    template = RoutingTemplate.query.get(id)
+    if not template:
+        flash('Routing Template not found.')
+        return redirect(url_for('routing'))
+    steps = {step.procedure_id: step for step in RoutingTemplateStep.query.filter_by(template_id=id).all()}
+    return render_template('routing/edit.html', user=user, job=None, template=template, steps=steps, procedures=Procedure.query.filter_by(plant_id=template.plant_id).order_by(Procedure.sequence).all(), templates=[])
+
+@app.route('/routing/<int:id>/edit', methods=['POST'])
+@auth_required
+def edit_routing_template_post(id):
+    user = User.query.get(session['user_id'])
+    if not (user.is_admin or user.is_prodmanager):
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    template = RoutingTemplate.query.get(id)
+    if not template:
+        flash('Routing Template not found.')
+        return redirect(url_for('routing'))
+
+    steps, error = parse_routing_form(Procedure.query.filter_by(plant_id=template.plant_id).all())
+    if error:
+        flash(error)
+        return redirect(url_for('edit_routing_template', id=id))
+
+    RoutingTemplateStep.query.filter_by(template_id=id).delete()
+    for step in steps:
+        db.session.add(RoutingTemplateStep(template_id=id, **step))
+    db.session.commit()
+
+    # Templates are copied into jobs when applied, so no regeneration is needed here
+    flash('Routing Template updated successfully.')
+    return redirect(url_for('routing'))
+
+@app.route('/routing/<int:id>/delete', methods=['POST'])
+@auth_required
+def delete_routing_template_post(id):
+    user = User.query.get(session['user_id'])
+    if not (user.is_admin or user.is_prodmanager):
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    template = RoutingTemplate.query.get(id)
+    if not template:
+        flash('Routing Template not found.')
+        return redirect(url_for('routing'))
+    RoutingTemplateStep.query.filter_by(template_id=id).delete()
+    db.session.delete(template)
+    db.session.commit()
+
+    flash('Routing Template deleted successfully.')
+    return redirect(url_for('routing'))
+
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+def calendar_changed(plant_id):
+    """Recompile a plant's working calendar and replan the plant after a calendar edit"""
+    invalidate_calendar(plant_id)
+    regenerate_all_schedules(plant_id)
+
+@app.route('/calendar')
+@auth_required
+def calendar():
+    user = User.query.get(session['user_id'])
+    if not user.is_admin:
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+    plant_id, error = parse_plant_arg(request.args)
+    if error:
+        flash(error)
+        return redirect(url_for('calendar'))
+    # Every plant has its own calendar
+    shifts = ShiftPattern.query.filter_by(plant_id=plant_id).order_by(ShiftPattern.weekday, ShiftPattern.block_start).all()
+    holidays = Holiday.query.filter_by(plant_id=plant_id).order_by(Holiday.start_date).all()
+    exceptions = CalendarException.query.filter_by(plant_id=plant_id).order_by(CalendarException.exception_date, CalendarException.block_start).all()
+    return render_template('calendar.html', user=user, shifts=shifts, holidays=holidays, exceptions=exceptions, weekday_names=WEEKDAY_NAMES, plants=all_plants(), plant_id=plant_id)
+
+@app.route('/calendar/shift/add', methods=['POST'])
+@auth_required
+def add_shift_post():
+    user = User.query.get(session['user_id'])
+    if not user.is_admin:
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+
+    plant_id, error = parse_plant_arg(request.form)
+    if error:
+        flash(error)
+        return redirect(url_for('calendar'))
+
+    weekday = request.form.get('weekday')
+    block_start = request.form.get('block_start')
+    block_end = request.form.get('block_end')
+
+    if weekday == '' or not weekday.isdigit() or int(weekday) > 6:
+        flash('Weekday must be a valid day.')
+        return redirect(url_for('calendar', plant=plant_id))
+
+    if block_start == '' or not block_start or block_end == '' or not block_end:
+        flash('Shift Start and End must be valid times.')
+        return redirect(url_for('calendar', plant=plant_id))
+
+    block_start_obj = datetime.strptime(block_start, '%H:%M').time()
+    block_end_obj = datetime.strptime(block_end, '%H:%M').time()
+    if block_start_obj >= block_end_obj:
+        flash('Shift End must be after Shift Start.')
+        return redirect(url_for('calendar', plant=plant_id))
+
+    if ShiftPattern.query.filter(ShiftPattern.plant_id == plant_id, ShiftPattern.weekday == int(weekday),
+                                 ShiftPattern.block_start < block_end_obj, ShiftPattern.block_end > block_start_obj).first():
+        flash('The shift overlaps another shift on that day.')
+        return redirect(url_for('calendar', plant=plant_id))
+
+    shift = ShiftPattern(plant_id=plant_id, weekday=int(weekday), block_start=block_start_obj, block_end=block_end_obj)
+    db.session.add(shift)
+    db.session.commit()
+
+    calendar_changed(plant_id)
+
+    flash('Shift added successfully.')
+    return redirect(url_for('calendar', plant=plant_id))
+
+@app.route('/calendar/shift/<int:id>/delete', methods=['POST'])
+@auth_required
+def delete_shift_post(id):
+    user = User.query.get(session['user_id'])
+    if not user.is_admin:
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+
+    shift = ShiftPattern.query.get(id)
+    if not shift:
+        flash('Shift not found.')
+        return redirect(url_for('calendar'))
+    plant_id = shift.plant_id
+    db.session.delete(shift)
+    db.session.commit()
+
+    calendar_changed(plant_id)
+
+    flash('Shift deleted successfully.')
+    return redirect(url_for('calendar', plant=plant_id))
+
+@app.route('/calendar/holiday/add', methods=['POST'])
+@auth_required
+def add_holiday_post():
+    user = User.query.get(session['user_id'])
+    if not user.is_admin:
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+
+    plant_id, error = parse_plant_arg(request.form)
+    if error:
+        flash(error)
+        return redirect(url_for('calendar'))
+
+    holiday_name = request.form.get('holiday_name')
+    start_date = request.form.get('start_date')
+    end_date = request.form.get('end_date')
+
+    if holiday_name == '':
+        flash('Holiday Name cannot be empty.')
+        return redirect(url_for('calendar', plant=plant_id))
+
+    if start_date == '' or not start_date:
+        flash('Start Date must be a valid date.')
+        return redirect(url_for('calendar', plant=plant_id))
+
+    start_date_obj = date.fromisoformat(start_date)
+    end_date_obj = date.fromisoformat(end_date) if end_date else start_date_obj
+    if end_date_obj < start_date_obj:
+        flash('End Date cannot be before Start Date.')
+        return redirect(url_for('calendar', plant=plant_id))
+
+    if end_date_obj - start_date_obj >= timedelta(days=MAX_CLOSED_DAYS):
+        flash('A holiday cannot be longer than {} days.'.format(MAX_CLOSED_DAYS))
+        return redirect(url_for('calendar', plant=plant_id))
+
+    holiday = Holiday(plant_id=plant_id, holiday_name=holiday_name, start_date=start_date_obj, end_date=end_date_obj)
+    db.session.add(holiday)
+    db.session.commit()
+
+    calendar_changed(plant_id)
+
+    flash('Holiday added successfully.')
+    return redirect(url_for('calendar', plant=plant_id))
+
+@app.route('/calendar/holiday/<int:id>/delete', methods=['POST'])
+@auth_required
+def delete_holiday_post(id):
+    user = User.query.get(session['user_id'])
+    if not user.is_admin:
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+
+    holiday = Holiday.query.get(id)
+    if not holiday:
+        flash('Holiday not found.')
+        return redirect(url_for('calendar'))
+    plant_id = holiday.plant_id
+    db.session.delete(holiday)
+    db.session.commit()
+
+    calendar_changed(plant_id)
+
+    flash('Holiday deleted successfully.')
+    return redirect(url_for('calendar', plant=plant_id))
+
+@app.route('/calendar/exception/add', methods=['POST'])
+@auth_required
+def add_calendar_exception_post():
+    user = User.query.get(session['user_id'])
+    if not user.is_admin:
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+
+    plant_id, error = parse_plant_arg(request.form)
+    if error:
+        flash(error)
+        return redirect(url_for('calendar'))
+
+    exception_date = request.form.get('exception_date')
+    exception_reason = request.form.get('exception_reason')
+    block_start = request.form.get('block_start')
+    block_end = request.form.get('block_end')
+
+    if exception_date == '' or not exception_date:
+        flash('Date must be a valid date.')
+        return redirect(url_for('calendar', plant=plant_id))
+
+    if exception_reason == '':
+        flash('Reason cannot be empty.')
+        return redirect(url_for('calendar', plant=plant_id))
+
+    if block_start == '' or not block_start or block_end == '' or not block_end:
+        flash('Shift Start and End must be valid times.')
+        return redirect(url_for('calendar', plant=plant_id))
+
+    block_start_obj = datetime.strptime(block_start, '%H:%M').time()
+    block_end_obj = datetime.strptime(block_end, '%H:%M').time()
+    if block_start_obj >= block_end_obj:
+        flash('Shift End must be after Shift Start.')
+        return redirect(url_for('calendar', plant=plant_id))
+
+    exception_date_obj = date.fromisoformat(exception_date)
+    if CalendarException.query.filter(CalendarException.plant_id == plant_id, CalendarException.exception_date == exception_date_obj,
+                                      CalendarException.block_start < block_end_obj, CalendarException.block_end > block_start_obj).first():
+        flash('The shift overlaps another exception shift on that date.')
+        return redirect(url_for('calendar', plant=plant_id))
+
+    exception = CalendarException(plant_id=plant_id, exception_date=exception_date_obj, exception_reason=exception_reason, block_start=block_start_obj, block_end=block_end_obj)
+    db.session.add(exception)
+    db.session.commit()
+
+    calendar_changed(plant_id)
+
+    flash('Calendar exception added successfully.')
+    return redirect(url_for('calendar', plant=plant_id))
+
+@app.route('/calendar/exception/<int:id>/delete', methods=['POST'])
+@auth_required
+def delete_calendar_exception_post(id):
+    user = User.query.get(session['user_id'])
+    if not user.is_admin:
+        flash('You are not authorized to access this page.')
+        return redirect(url_for('index'))
+
+    exception = CalendarException.query.get(id)
+    if not exception:
+        flash('Calendar exception not found.')
+        return redirect(url_for('calendar'))
+    plant_id = exception.plant_id
+    db.session.delete(exception)
+    db.session.commit()
+
+    calendar_changed(plant_id)
+
+    flash('Calendar exception deleted successfully.')
+    return redirect(url_for('calendar', plant=plant_id))
\ No newline at end of file
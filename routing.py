@@ -0,0 +1,48 @@
+from collections import namedtuple
+
+# Procedure-like view of one step of a job's routing, so the slot search functions
+# can take it in place of a Procedure (id is the procedure id)
+Operation = namedtuple('Operation', ['id', 'sequence', 'procedure_plantime', 'procedure_planmanpower'])
+
+def get_routing_models():
+    """Get routing model classes - lazy import to avoid circular imports"""
+    from models import JobRouting, RoutingTemplateStep
+    return JobRouting, RoutingTemplateStep
+
+def procedure_operations(procedures):
+    """Default routing: every procedure in the plant, in procedure sequence order"""
+    return [Operation(p.id, p.sequence, p.procedure_plantime, p.procedure_planmanpower)
+            for p in sorted(procedures, key=lambda x: x.sequence)]
+
+def steps_to_operations(steps, procedures_by_id):
+    """Turn routing steps (job or template) into operations, skipping deleted procedures"""
+    operations = []
+    for step in sorted(steps, key=lambda x: x.sequence):
+        procedure = procedures_by_id.get(step.procedure_id)
+        if procedure is None:
+            continue
+        plantime = step.plantime if step.plantime is not None else procedure.procedure_plantime
+        operations.append(Operation(procedure.id, step.sequence, plantime, procedure.procedure_planmanpower))
+    return operations
+
+def get_job_operations(jobs, procedures):
+    """
+    Map each job ID to the operations it actually needs
+    Jobs with a routing get only their routed procedures (with any plantime overrides);
+    jobs without one keep the full procedure list
+    """
+    JobRouting, RoutingTemplateStep = get_routing_models()
+
+    procedures_by_id = {procedure.id: procedure for procedure in procedures}
+    steps_by_job = {}
+    for step in JobRouting.query.filter(JobRouting.job_id.in_([job.id for job in jobs])).all():
+        steps_by_job.setdefault(step.job_id, []).append(step)
+
+    default_operations = procedure_operations(procedures)
+    operations_by_job = {}
+    for job in jobs:
+        if job.id in steps_by_job:
+            operations_by_job[job.id] = steps_to_operations(steps_by_job[job.id], procedures_by_id)
+        else:
+            operations_by_job[job.id] = default_operations
+    return operations_by_job
@@ -1,4 +1,23 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date, time as dt_time
+from app import app
+from optimizer import optimize_schedules, job_operations, place_job, get_targets_and_floors, solve_in_lanes, add_placements
+from slack import compute_slack
+from kpi import update_kpis, week_start
+from segments import clear_segments, write_segments, plant_segments
+from plan_events import plan_snapshot, publish_plan_changes
+from page_cache import session_has_uncommitted_writes
+from profiling import profiled, phase, count, run_profiled
+from conflict_model import ConflictModel
+from freeze import get_frozen_window
+from compact_plan import CompactPlan
+from feasibility import SEARCH_WINDOW_DAYS, job_window_shortfall, procedures_over_capacity
+from routing import get_job_operations
+from integrity import validate_after_regeneration
+from plants import current_plant_id, use_plant, plant_ids, plant_job_ids, plant_procedure_ids, plant_schedules
+from work_calendar import (working_blocks, is_working_date, previous_working_date, next_working_date,
+                           largest_block_minutes, has_shift_pattern, to_working_minute, from_working_minute, MAX_CLOSED_DAYS)
 
 def get_models():
     """Get model classes and db object - lazy import to avoid circular imports"""
@@ -7,42 +26,29 @@ def get_models():
 
 def get_working_hours(date):
     """
-    Get working hours for a given date
+    Get working hours for a given date from the compiled shift calendar
+    Default plant week (editable from the admin calendar page):
     Monday-Friday: 8:15 AM - 1:00 PM, 1:30 PM - 5:00 PM (8.75 hours total)
     Saturday: 8:15 AM - 1:00 PM, 1:30 PM - 3:30 PM (6.75 hours total)
-    Sunday: No work
+    Sunday, holidays and shutdowns: No work
     """
-    if date.weekday() == 6:  # Sunday
-        return []
-    
-    start_time = datetime.combine(date, dt_time(8, 15))  # 8:15 AM
-    lunch_start = datetime.combine(date, dt_time(13, 0))  # 1:00 PM
-    lunch_end = datetime.combine(date, dt_time(13, 30))   # 1:30 PM
-    
-    if date.weekday() < 5:  # Monday to Friday
-        end_time = datetime.combine(date, dt_time(17, 0))  # 5:00 PM
-    else:  # Saturday
-        end_time = datetime.combine(date, dt_time(15, 30))  # 3:30 PM
-    
-    return [(start_time, lunch_start), (lunch_end, end_time)]
+    return working_blocks(date)
 
 def is_working_day(date):
-    """Check if the given date is a working day (Monday to Saturday)"""
-    return date.weekday() < 6  # 0-5 for Monday-Saturday
+    """Check if the given date has any working hours in the shift calendar"""
+    return is_working_date(date)
 
 def get_previous_working_day(date):
-    """Get the previous working day before the given date"""
-    prev_date = date - timedelta(days=1)
-    while not is_working_day(prev_date):
-        prev_date -= timedelta(days=1)
-    return prev_date
+    """
+    Get the previous working day before the given date
+    Past MAX_CLOSED_DAYS of closed days this is the closed day beyond them, which callers
+    treat like any day without working hours and which ends their bounded searches
+    """
+    return previous_working_date(date) or date - timedelta(days=MAX_CLOSED_DAYS + 1)
 
 def get_next_working_day(date):
-    """Get the next working day after the given date"""
-    next_date = date + timedelta(days=1)
-    while not is_working_day(next_date):
-        next_date += timedelta(days=1)
-    return next_date
+    """Get the next working day after the given date, or the closed day past MAX_CLOSED_DAYS of them"""
+    return next_working_date(date) or date + timedelta(days=MAX_CLOSED_DAYS + 1)
 
 def get_completion_target_datetime(deadline_date, deadline_time):
     """
@@ -61,6 +67,7 @@ def minutes_to_timedelta(minutes):
     """Convert minutes to timedelta"""
     return timedelta(minutes=minutes)
 
+@profiled
 def find_available_slot_backward(procedure_id, procedure_duration_minutes, target_end_datetime):
     """
     Find the latest available slot for a procedure working backwards from target end time
@@ -110,6 +117,7 @@ def find_available_slot_backward(procedure_id, procedure_duration_minutes, targe
                 # Ensure it doesn't go before block start
                 if candidate_start >= block_start:
                     # Check for conflicts with existing schedules for this procedure (across all jobs)
+                    count('slot_candidates')
                     conflicts = Schedule.query.filter(
                         Schedule.procedure_id == procedure_id,
                         Schedule.start_datetime < candidate_end,
@@ -119,6 +127,7 @@ def find_available_slot_backward(procedure_id, procedure_duration_minutes, targe
                     if not conflicts:
                         return candidate_start, candidate_end
                     else:
+                        count('conflicts')
                         # Find the earliest start time of conflicting schedules
                         earliest_conflict_start = min(conflict.start_datetime for conflict in conflicts)
                         current_datetime = earliest_conflict_start
@@ -161,6 +170,7 @@ def find_available_slot_backward(procedure_id, procedure_duration_minutes, targe
     
     return None
 
+@profiled
 def find_available_slot_forward(procedure_id, procedure_duration_minutes, start_from_datetime):
     """
     Find the earliest available slot for a procedure starting from a given datetime
@@ -207,6 +217,7 @@ def find_available_slot_forward(procedure_id, procedure_duration_minutes, start_
                 candidate_end = candidate_start + procedure_duration
                 
                 # Check for conflicts with existing schedules for this procedure
+                count('slot_candidates')
                 conflicts = Schedule.query.filter(
                     Schedule.procedure_id == procedure_id,
                     Schedule.start_datetime < candidate_end,
@@ -216,6 +227,7 @@ def find_available_slot_forward(procedure_id, procedure_duration_minutes, start_
                 if not conflicts:
                     return candidate_start, candidate_end
                 else:
+                    count('conflicts')
                     # Find the earliest end time of conflicting schedules
                     latest_conflict = max(conflict.end_datetime for conflict in conflicts)
                     current_datetime = latest_conflict
@@ -258,6 +270,7 @@ def find_available_slot_forward(procedure_id, procedure_duration_minutes, start_
     
     return None
 
+@profiled
 def find_available_slot_backward_multiday(procedure_id, procedure_duration_minutes, target_end_datetime):
     """
     Find the latest available slot for a procedure that may span multiple days
@@ -310,6 +323,7 @@ def find_available_slot_backward_multiday(procedure_id, procedure_duration_minut
                 block_start_time = effective_end - time_to_use
                 
                 # Check for conflicts in this block
+                count('slot_candidates')
                 conflicts = Schedule.query.filter(
                     Schedule.procedure_id == procedure_id,
                     Schedule.start_datetime < effective_end,
@@ -317,6 +331,7 @@ def find_available_slot_backward_multiday(procedure_id, procedure_duration_minut
                 ).all()
                 
                 if conflicts:
+                    count('conflicts')
                     # Find earliest conflict start and try before it
                     earliest_conflict = min(conflict.start_datetime for conflict in conflicts)
                     if earliest_conflict <= block_start:
@@ -360,10 +375,12 @@ def find_available_slot_backward_multiday(procedure_id, procedure_duration_minut
             return overall_start, overall_end
         
         # Try again with an earlier end time
+        count('multiday_retries')
         current_end_time = current_end_time - timedelta(hours=1)
     
     return None
 
+@profiled
 def find_available_slot_forward_multiday(procedure_id, procedure_duration_minutes, start_from_datetime):
     """
     Find the earliest available slot for a procedure that may span multiple days
@@ -437,10 +454,12 @@ def find_available_slot_forward_multiday(procedure_id, procedure_duration_minute
             return overall_start, overall_end
         
         # Try again with a later start time
+        count('multiday_retries')
         current_start_time = current_start_time + timedelta(hours=1)
     
     return None
 
+@profiled
 def find_available_slot_forward_with_memory_conflicts(procedure_id, procedure_duration_minutes, start_from_datetime, memory_conflicts):
     """
     Find the earliest available slot for a procedure starting from a given datetime
@@ -487,6 +506,7 @@ def find_available_slot_forward_with_memory_conflicts(procedure_id, procedure_du
                 candidate_end = candidate_start + procedure_duration
                 
                 # Check for conflicts with existing database schedules for this procedure
+                count('slot_candidates')
                 db_conflicts = Schedule.query.filter(
                     Schedule.procedure_id == procedure_id,
                     Schedule.start_datetime < candidate_end,
@@ -504,6 +524,7 @@ def find_available_slot_forward_with_memory_conflicts(procedure_id, procedure_du
                 if not db_conflicts and not memory_conflicts_found:
                     return candidate_start, candidate_end
                 else:
+                    count('conflicts')
                     # Find the earliest end time of conflicting schedules
                     latest_conflict_end = current_datetime
                     
@@ -555,6 +576,7 @@ def find_available_slot_forward_with_memory_conflicts(procedure_id, procedure_du
     
     return None
 
+@profiled
 def find_available_slot_forward_multiday_with_memory_conflicts(procedure_id, procedure_duration_minutes, start_from_datetime, memory_conflicts):
     """
     Find the earliest available slot for a procedure that may span multiple days
@@ -629,10 +651,12 @@ def find_available_slot_forward_multiday_with_memory_conflicts(procedure_id, pro
             return overall_start, overall_end
         
         # Try again with a later start time
+        count('multiday_retries')
         current_start_time = current_start_time + timedelta(hours=1)
     
     return None
 
+@profiled
 def calculate_single_job_schedule_backward(job, procedures, target_completion_datetime):
     """
     Calculate schedule for a single job working backwards from target completion
@@ -670,6 +694,7 @@ def calculate_single_job_schedule_backward(job, procedures, target_completion_da
     # Reverse the list to get chronological order (first procedure first)
     return list(reversed(job_schedules))
 
+@profiled
 def calculate_job_schedule_forward(job, procedures, earliest_start_datetime):
     """
     Calculate schedule for a job working forward from an earliest start time
@@ -680,9 +705,9 @@ def calculate_job_schedule_forward(job, procedures, earliest_start_datetime):
     current_start = earliest_start_datetime
     
     for procedure in procedures_sorted:
-        # Check if procedure duration exceeds largest single working block (4.75 hours = 285 minutes)
-        # This accounts for the lunch break - procedures > 4.75h need multi-day scheduling  
-        largest_single_block_minutes = 4.75 * 60  # 285 minutes
+        # Check if procedure duration exceeds largest single working block in the shift calendar
+        # This accounts for the lunch break - longer procedures need multi-day scheduling
+        largest_single_block_minutes = largest_block_minutes()
         procedure_minutes = procedure.procedure_plantime * 60
         
         if procedure_minutes > largest_single_block_minutes:
@@ -718,121 +743,380 @@ def calculate_job_schedule_forward(job, procedures, earliest_start_datetime):
     
     return job_schedules
 
-def handle_same_deadline_jobs(jobs, procedures, target_completion_datetime):
+@profiled
+def handle_same_deadline_jobs(jobs, procedures, target_completion_datetime, capacity=None, operations_by_job=None, floors=None):
     """
     Handle multiple jobs with the same deadline using backward scheduling
     Each job is scheduled to complete by the target completion time
+    capacity is an optional ConflictModel of operations already placed in this run,
+    used for the cheap feasibility pre-check and kept up to date with new placements
+    operations_by_job optionally maps job IDs to their routed operations (see routing)
+    floors optionally maps job IDs to the earliest start a frozen window allows (see freeze),
+    and needs capacity
     """
     Job, Schedule, Procedure, db = get_models()
     
     # Sort jobs by ID (priority order) 
     jobs_sorted = sorted(jobs, key=lambda x: x.id)
     procedures_sorted = sorted(procedures, key=lambda x: x.sequence)
-    all_schedules = []
+    all_schedules = CompactPlan()
     
     # Schedule each job individually using backward scheduling
     # Higher priority jobs (lower ID) get scheduled first and claim their optimal slots
     for job in jobs_sorted:
-        job_schedules = calculate_single_job_schedule_backward(job, procedures_sorted, target_completion_datetime)
+        if operations_by_job is not None:
+            job_procedures = sorted(operations_by_job[job.id], key=lambda x: x.sequence)
+        else:
+            job_procedures = procedures_sorted
+        if not job_procedures:
+            continue  # Nothing routed for this job
         
-        if not job_schedules:
-            # If backward scheduling fails, try forward scheduling from a reasonable start time
-            # Calculate total duration needed for this job
-            job_duration_minutes = sum(proc.procedure_plantime * 60 for proc in procedures_sorted)
-            job_start_time = find_start_time_for_duration(job_duration_minutes, target_completion_datetime)
+        reason = job_window_shortfall(job_procedures, target_completion_datetime)
+        if reason:
+            record_unscheduled(job, reason, precheck=True)
+            continue
+        
+        if capacity is not None and procedures_over_capacity(job_procedures, target_completion_datetime, capacity):
+            # Some procedure has less free time before the target than this job needs, so backward
+            # placement is bound to collide - go straight to the earliest forward placement
+            count('forward_over_capacity')
+            window_start = target_completion_datetime - timedelta(days=SEARCH_WINDOW_DAYS)
+            job_schedules = calculate_job_schedule_forward(job, job_procedures, window_start)
+        else:
+            job_schedules = calculate_single_job_schedule_backward(job, job_procedures, target_completion_datetime)
+        
+            if not job_schedules:
+                # If backward scheduling fails, try forward scheduling from a reasonable start time
+                # Calculate total duration needed for this job
+                job_duration_minutes = sum(proc.procedure_plantime * 60 for proc in job_procedures)
+                job_start_time = find_start_time_for_duration(job_duration_minutes, target_completion_datetime)
             
-            if job_start_time:
-                job_schedules = calculate_job_schedule_forward(job, procedures_sorted, job_start_time)
+                if job_start_time:
+                    count('forward_after_backward_failure')
+                    job_schedules = calculate_job_schedule_forward(job, job_procedures, job_start_time)
         
-        if job_schedules:
-            # Check for conflicts with already scheduled jobs
-            conflicts_found = False
-            for schedule_data in job_schedules:
-                # Check for conflicts with existing schedules for the same procedure
-                existing_conflicts = Schedule.query.filter(
-                    Schedule.procedure_id == schedule_data['procedure_id'],
-                    Schedule.start_datetime < schedule_data['end_datetime'],
-                    Schedule.end_datetime > schedule_data['start_datetime']
-                ).all()
+            if job_schedules:
+                # Check for conflicts with already scheduled jobs
+                conflicts_found = False
+                for schedule_data in job_schedules:
+                    # Check for conflicts with existing schedules for the same procedure
+                    existing_conflicts = Schedule.query.filter(
+                        Schedule.procedure_id == schedule_data['procedure_id'],
+                        Schedule.start_datetime < schedule_data['end_datetime'],
+                        Schedule.end_datetime > schedule_data['start_datetime']
+                    ).all()
                 
-                # Also check conflicts with schedules from current batch
-                memory_conflicts = [
-                    s for s in all_schedules 
-                    if s['procedure_id'] == schedule_data['procedure_id'] and
-                    s['start_datetime'] < schedule_data['end_datetime'] and
-                    s['end_datetime'] > schedule_data['start_datetime']
-                ]
+                    # Also check conflicts with schedules from current batch
+                    memory_conflicts = all_schedules.overlapping(
+                        schedule_data['procedure_id'], schedule_data['start_datetime'], schedule_data['end_datetime']
+                    )
                 
-                if existing_conflicts or memory_conflicts:
-                    conflicts_found = True
-                    break
+                    if existing_conflicts or memory_conflicts:
+                        conflicts_found = True
+                        break
             
-            if conflicts_found:
-                # Reschedule this job using conflict-aware forward scheduling
-                # Find the latest end time of all conflicting procedures
-                latest_conflict_end = target_completion_datetime - timedelta(days=30)  # Start from way back
+                if conflicts_found:
+                    count('forward_after_conflict')
+                    # Reschedule this job using conflict-aware forward scheduling
+                    # Find the latest end time of all conflicting procedures
+                    latest_conflict_end = target_completion_datetime - timedelta(days=30)  # Start from way back
                 
-                for schedule_data in job_schedules:
-                    procedure_id = schedule_data['procedure_id']
+                    for schedule_data in job_schedules:
+                        procedure_id = schedule_data['procedure_id']
                     
-                    # Check database conflicts
-                    db_conflicts = Schedule.query.filter(
-                        Schedule.procedure_id == procedure_id
-                    ).all()
+                        # Check database conflicts
+                        db_conflicts = Schedule.query.filter(
+                            Schedule.procedure_id == procedure_id
+                        ).all()
                     
-                    # Check memory conflicts  
-                    memory_conflicts = [
-                        s for s in all_schedules 
-                        if s['procedure_id'] == procedure_id
-                    ]
+                        # Check memory conflicts  
+                        memory_conflicts = all_schedules.on_procedure(procedure_id)
                     
-                    if db_conflicts:
-                        latest_conflict_end = max(latest_conflict_end, 
-                                                max(c.end_datetime for c in db_conflicts))
+                        if db_conflicts:
+                            latest_conflict_end = max(latest_conflict_end, 
+                                                    max(c.end_datetime for c in db_conflicts))
                     
-                    if memory_conflicts:
-                        latest_conflict_end = max(latest_conflict_end,
-                                                max(c['end_datetime'] for c in memory_conflicts))
+                        if memory_conflicts:
+                            latest_conflict_end = max(latest_conflict_end,
+                                                    all_schedules.latest_end(memory_conflicts))
                 
-                # Try scheduling after all conflicts
-                job_schedules = calculate_job_schedule_forward(job, procedures_sorted, latest_conflict_end)
+                    # Try scheduling after all conflicts
+                    job_schedules = calculate_job_schedule_forward(job, job_procedures, latest_conflict_end)
                 
-                # If this job still extends beyond the deadline, we need to compress the schedule
-                if job_schedules and job_schedules[-1]['end_datetime'] > target_completion_datetime:
-                    # Try to fit the job by working backwards from deadline with conflict awareness
-                    job_schedules = calculate_job_schedule_backward_with_conflicts(
-                        job, procedures_sorted, target_completion_datetime, all_schedules
-                    )
+                    # If this job still extends beyond the deadline, we need to compress the schedule
+                    if job_schedules and job_schedules[-1]['end_datetime'] > target_completion_datetime:
+                        # Try to fit the job by working backwards from deadline with conflict awareness
+                        count('backward_with_conflicts')
+                        job_schedules = calculate_job_schedule_backward_with_conflicts(
+                            job, job_procedures, target_completion_datetime, all_schedules
+                        )
             
-            # Add successful schedules to the batch
-            if job_schedules:
-                for schedule_data in job_schedules:
-                    schedule = Schedule(**schedule_data)
-                    db.session.add(schedule)
-                    all_schedules.append(schedule_data)
+        job_schedules = schedule_from_floor(job, job_procedures, job_schedules, target_completion_datetime, capacity, floors)
+        
+        # Add successful schedules to the batch
+        if job_schedules:
+            for schedule_data in job_schedules:
+                schedule = Schedule(**schedule_data)
+                db.session.add(schedule)
+                all_schedules.append_row(schedule_data)
+                book_capacity(capacity, schedule_data)
+        else:
+            record_unscheduled(job, NO_SLOT_REASON)
     
     db.session.flush()
     return all_schedules
 
-def regenerate_all_schedules():
+NO_SLOT_REASON = 'No free slot found for every procedure within the search limits.'
+
+def record_unscheduled(job, reason, precheck=False):
+    """Keep a job that could not be placed in the unscheduled-jobs report"""
+    count('unscheduled_precheck' if precheck else 'unscheduled')
+    Job, Schedule, Procedure, db = get_models()
+    from models import UnscheduledJob
+    db.session.add(UnscheduledJob(job_id=job.id, reason=reason, precheck=precheck))
+
+CLOSED_PLANT_REASON = 'The plant has no shifts on its calendar.'
+
+def clear_closed_plant(old_plan):
+    """Clear the plan of a plant without shifts, reporting every job unscheduled, and commit"""
+    Job, Schedule, Procedure, db = get_models()
+    from models import UnscheduledJob
+    clear_segments(plant_schedules())
+    plant_schedules().delete()
+    UnscheduledJob.query.filter(UnscheduledJob.job_id.in_(plant_job_ids())).delete()
+    for job in Job.query.filter_by(plant_id=current_plant_id()).order_by(Job.id).all():
+        record_unscheduled(job, CLOSED_PLANT_REASON, precheck=True)
+    update_kpis([], [], {})
+    db.session.commit()
+    publish_plan_changes(old_plan, {})
+    return []
+
+def schedule_from_floor(job, procedures, job_schedules, target_completion_datetime, capacity, floors):
+    """
+    Replace a job's placement when it starts before the job's floor
+    floors maps job IDs to the earliest start a frozen window allows, or is None. The
+    job is placed again on the capacity model, which holds the frozen operations and
+    everything placed so far in this run, so it cannot land on any of them
+    """
+    if floors is None or not job_schedules or min(s['start_datetime'] for s in job_schedules) >= floors[job.id]:
+        return job_schedules
+    count('replaced_before_floor')
+    placements = place_job(capacity, job_operations(procedures), to_working_minute(target_completion_datetime), to_working_minute(floors[job.id]))
+    return [{
+        'job_id': job.id,
+        'procedure_id': procedure.id,
+        'start_datetime': from_working_minute(start, at_end=start == end),
+        'end_datetime': from_working_minute(end, at_end=True),
+        'planned_time': procedure.procedure_plantime,
+        'planned_manpower': procedure.procedure_planmanpower
+    } for procedure, start, end in placements]
+
+def book_capacity(capacity, schedule_data):
+    """Add a placed operation to the pre-check capacity model"""
+    if capacity is not None:
+        capacity.add_fixed(
+            schedule_data['procedure_id'],
+            to_working_minute(schedule_data['start_datetime']),
+            to_working_minute(schedule_data['end_datetime'])
+        )
+
+def regenerate_all_schedules(plant_id=None):
     """
-    Regenerate all schedules for all jobs based on priority and constraints
+    Regenerate the schedules of one plant, or of every plant when plant_id is None
     This is the main function called when jobs/procedures are added/edited
+    Plants share no job, procedure or calendar, so an edit only replans its own plant,
+    and every plant is regenerated concurrently (SCHEDULER_PLANT_WORKERS), each in
+    its own session and transaction. Plants go one after another in the caller's
+    session instead on SQLite, which has a single writer, while profiling, and when
+    the session holds writes that are not committed yet
     """
+    if plant_id is not None:
+        return regenerate_plant(plant_id)
+    
     Job, Schedule, Procedure, db = get_models()
+    plants = plant_ids()
+    workers = min(app.config['SCHEDULER_PLANT_WORKERS'], len(plants))
+    if (workers <= 1 or app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+            or app.config['SCHEDULER_PROFILE'] or session_has_uncommitted_writes(db.session)):
+        return [schedule for plant in plants for schedule in regenerate_plant(plant)]
     
-    # Clear all existing schedules
-    Schedule.query.delete()
-    db.session.flush()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [schedule for schedules in pool.map(regenerate_plant_in_worker, plants) for schedule in schedules]
+
+def regenerate_plant(plant_id):
+    """
+    Regenerate one plant's schedules in the current session
+    With SCHEDULER_PROFILE on, the run is timed per phase and logged (see profiling)
+    """
+    with use_plant(plant_id):
+        if not app.config['SCHEDULER_PROFILE']:
+            return build_all_schedules()
+        
+        schedules, profile, elapsed, dump_path = run_profiled(build_all_schedules, app.config['SCHEDULER_PROFILE_DIR'] or None)
+        log_profiled_run(profile, elapsed, len(schedules), dump_path)
+        return schedules
+
+def regenerate_plant_in_worker(plant_id):
+    """regenerate_plant on a pool thread, in an app context and so a session of its own"""
+    with app.app_context():
+        return regenerate_plant(plant_id)
+
+def build_all_schedules():
+    """Clear the current plant's plan and schedule its jobs again, committing the new plan"""
+    Job, Schedule, Procedure, db = get_models()
+    from models import UnscheduledJob
+    
+    # Plan before this run, to push only what changed to schedule screens
+    with phase('snapshot'):
+        old_plan = plan_snapshot()
+    
+    # A plant with no weekly shifts is closed: none of its plan is kept and no job is placed
+    if not has_shift_pattern():
+        return clear_closed_plant(old_plan)
+    
+    # Clear the plant's schedules and their segments, or only those after the frozen window when it is on
+    with phase('clear'):
+        frozen = get_frozen_window()
+        if frozen is None:
+            clear_segments(plant_schedules())
+            plant_schedules().delete()
+        UnscheduledJob.query.filter(UnscheduledJob.job_id.in_(plant_job_ids())).delete()
+        db.session.flush()
     
     # Get all jobs grouped by deadline, then by priority (ID)
-    jobs = Job.query.order_by(Job.deadline_date, Job.deadline_time, Job.id).all()
-    procedures = Procedure.query.order_by(Procedure.sequence).all()
+    with phase('load'):
+        jobs = Job.query.filter_by(plant_id=current_plant_id()).order_by(Job.deadline_date, Job.deadline_time, Job.id).all()
+        procedures = Procedure.query.filter_by(plant_id=current_plant_id()).order_by(Procedure.sequence).all()
     
     if not jobs or not procedures:
+        update_kpis(plant_schedules().all(), plant_segments(), {})
         db.session.commit()
+        publish_plan_changes(old_plan, {})
         return []
     
+    # Only the procedures each job is routed through get scheduled
+    with phase('load'):
+        operations_by_job = get_job_operations(jobs, procedures)
+    
+    target_datetimes = {job.id: get_completion_target_datetime(job.deadline_date, job.deadline_time) for job in jobs}
+    
+    # Earliest start of each job's replanned operations
+    floors = None
+    if frozen is not None:
+        # Only operations after the frozen window are replanned, so finished jobs drop out
+        operations_by_job = {job.id: frozen.remaining(job.id, operations_by_job[job.id]) for job in jobs}
+        floors = {job.id: frozen.earliest_start(job.id) for job in jobs}
+        jobs = [job for job in jobs if operations_by_job[job.id]]
+        # Frozen operations that end before every replanned job's search window cannot be in its way
+        window_starts = [target_datetimes[job.id] - timedelta(days=SEARCH_WINDOW_DAYS) for job in jobs]
+        frozen.load_model(min(window_starts) if window_starts else frozen.horizon)
+    
+    # Operations placed so far in this run, placed on by the single pass and used for the
+    # chain's feasibility pre-check
+    capacity = frozen.model.copy() if frozen is not None else ConflictModel()
+    
+    with phase('place'):
+        if app.config['SCHEDULER_ENGINE'] == 'lanes':
+            # Anneals within each lane itself when the optimizer is on
+            schedule_in_lanes(jobs, operations_by_job, target_datetimes, frozen)
+        elif app.config['SCHEDULER_ENGINE'] == 'chain':
+            schedule_fallback_chain(jobs, procedures, operations_by_job, capacity, floors)
+        else:
+            schedule_single_pass(jobs, operations_by_job, target_datetimes, capacity, frozen)
+    
+    if app.config['SCHEDULER_OPTIMIZER'] == 'anneal' and app.config['SCHEDULER_ENGINE'] != 'lanes':
+        with phase('optimize'):
+            # Jobs rejected by the pre-check cannot fit their search window in any order
+            plant_unscheduled = UnscheduledJob.query.filter(UnscheduledJob.job_id.in_(plant_job_ids()))
+            rejected = {row.job_id for row in plant_unscheduled.filter_by(precheck=True).all()}
+            candidates = [job for job in jobs if job.id not in rejected and operations_by_job[job.id]]
+            run = optimize_schedules(candidates, {job.id: job_operations(operations_by_job[job.id]) for job in candidates}, target_datetimes, frozen)
+            if run.adopted:
+                # The optimized plan places every candidate job
+                plant_unscheduled.filter_by(precheck=False).delete()
+    
+    # Rows of the jobs with work at or after the frozen window's horizon, and the operations
+    # of finished jobs from their first one on, which bound their slack; jobs the window
+    # finished keep their slack and segments, so the rest of the history is not read
+    context = []
+    if frozen is None:
+        rows = plant_schedules().all()
+    else:
+        open_jobs = db.select(Schedule.job_id).where(Schedule.procedure_id.in_(plant_procedure_ids()), Schedule.end_datetime >= frozen.horizon)
+        rows = plant_schedules().filter(Schedule.job_id.in_(open_jobs)).all()
+        context = plant_schedules().filter(Schedule.start_datetime >= min([row.start_datetime for row in rows], default=frozen.horizon),
+                                           Schedule.job_id.not_in(open_jobs)).with_entities(
+            Schedule.id, Schedule.job_id, Schedule.procedure_id, Schedule.start_datetime, Schedule.end_datetime).all()
+    
+    # Slack of every operation against its job's completion target
+    with phase('slack'):
+        job_ids = {row.job_id for row in rows} | {row.job_id for row in context}
+        compute_slack(rows, {job_id: to_working_minute(target_datetimes[job_id]) for job_id in job_ids}, context)
+    
+    # Working segments of the operations placed in this run, so load queries never need the calendar
+    with phase('segments'):
+        write_segments(rows if frozen is None else [row for row in rows if row.start_datetime >= frozen.horizon])
+    
+    # Dashboard KPIs, so dashboards never aggregate the plan themselves
+    with phase('kpi'):
+        if frozen is None:
+            update_kpis(rows, plant_segments(), target_datetimes)
+        else:
+            update_kpis(rows, plant_segments(datetime.combine(week_start(frozen.horizon.date()), dt_time())), target_datetimes, frozen.horizon)
+    
+    with phase('commit'):
+        db.session.commit()
+    with phase('publish'):
+        publish_plan_changes(old_plan, plan_snapshot())
+    
+    # Integrity check of the committed plan, timed like the other phases
+    if app.config['SCHEDULER_VALIDATE']:
+        with phase('validate'):
+            violations = validate_after_regeneration()
+        count('integrity_violations', len(violations))
+    return plant_schedules().all()
+
+def schedule_single_pass(jobs, operations_by_job, target_datetimes, capacity, frozen=None):
+    """
+    Place every job once, in priority order (deadline, then ID), on the capacity model
+    A job goes backward from its completion target around everything placed before it,
+    and is right-shifted forward from its search window start only when that cannot fit
+    (see optimizer.place_job), so every operation is searched for once instead of going
+    through the fallback chain. Operations of a frozen window (see freeze) are already
+    on capacity and no job starts before its floor
+    """
+    candidates = []
+    for job in jobs:
+        if not operations_by_job[job.id]:
+            continue  # Nothing routed for this job
+        reason = job_window_shortfall(operations_by_job[job.id], target_datetimes[job.id])
+        if reason:
+            record_unscheduled(job, reason, precheck=True)
+        else:
+            candidates.append(job)
+    
+    targets, floors = get_targets_and_floors(candidates, target_datetimes, frozen)
+    order = []
+    placements = []
+    for job in candidates:
+        job_placements = place_job(capacity, job_operations(operations_by_job[job.id]), targets[job.id], floors[job.id])
+        count('slot_searches', len(job_placements))
+        if job_placements[-1][2] > targets[job.id]:
+            count('right_shifted')
+        order.append(job.id)
+        placements.append(job_placements)
+    with phase('flush'):
+        add_placements(order, placements)
+
+def schedule_fallback_chain(jobs, procedures, operations_by_job, capacity, floors=None):
+    """
+    Schedule jobs with the original fallback chain, selected with SCHEDULER_ENGINE=chain
+    A job is placed backward ignoring conflicts, checked for overlaps, and on a conflict
+    placed forward and then retried backward around the batch, so an operation can be
+    searched for several times. jobs must be in priority order (deadline, then ID)
+    """
+    Job, Schedule, Procedure, db = get_models()
+    
     # Group jobs by deadline
     deadline_groups = {}
     for job in jobs:
@@ -847,18 +1131,81 @@ def regenerate_all_schedules():
         
         if len(deadline_jobs) == 1:
             # Single job with this deadline - schedule backward
-            job_schedules = calculate_single_job_schedule_backward(deadline_jobs[0], procedures, target_completion)
+            job = deadline_jobs[0]
+            job_procedures = operations_by_job[job.id]
+            if not job_procedures:
+                continue  # Nothing routed for this job
+            
+            reason = job_window_shortfall(job_procedures, target_completion)
+            if reason:
+                record_unscheduled(job, reason, precheck=True)
+                continue
+            
+            if procedures_over_capacity(job_procedures, target_completion, capacity):
+                # Backward placement is bound to collide - go straight to the earliest forward placement
+                count('forward_over_capacity')
+                window_start = target_completion - timedelta(days=SEARCH_WINDOW_DAYS)
+                job_schedules = calculate_job_schedule_forward(job, job_procedures, window_start)
+            else:
+                job_schedules = calculate_single_job_schedule_backward(job, job_procedures, target_completion)
+            job_schedules = schedule_from_floor(job, job_procedures, job_schedules, target_completion, capacity, floors)
+            
             if job_schedules:
                 for schedule_data in job_schedules:
                     schedule = Schedule(**schedule_data)
                     db.session.add(schedule)
-                db.session.flush()
+                    book_capacity(capacity, schedule_data)
+                with phase('flush'):
+                    db.session.flush()
+            else:
+                record_unscheduled(job, NO_SLOT_REASON)
         else:
             # Multiple jobs with same deadline - handle priority
-            handle_same_deadline_jobs(deadline_jobs, procedures, target_completion)
+            handle_same_deadline_jobs(deadline_jobs, procedures, target_completion, capacity, operations_by_job, floors)
+
+def log_profiled_run(profile, elapsed, operation_count, dump_path):
+    """Store a profiled regeneration in the run log and the app log"""
+    Job, Schedule, Procedure, db = get_models()
+    from models import SchedulerRunLog
     
+    report = profile.as_dict()
+    db.session.add(SchedulerRunLog(
+        plant_id=current_plant_id(),
+        engine=app.config['SCHEDULER_ENGINE'],
+        elapsed_ms=int(elapsed * 1000),
+        job_count=Job.query.filter_by(plant_id=current_plant_id()).count(),
+        operation_count=operation_count,
+        sql_statements=report['sql_statements'],
+        phases=json.dumps(report['phases_ms']),
+        calls=json.dumps(report['calls']),
+        counters=json.dumps(report['counters']),
+        profile_path=dump_path
+    ))
     db.session.commit()
-    return Schedule.query.all()
+    app.logger.info('Scheduler profile: plant %d, %d ms, %d SQL statements, phases %s, counters %s',
+                    current_plant_id(), elapsed * 1000, report['sql_statements'], report['phases_ms'], report['counters'])
+
+def schedule_in_lanes(jobs, operations_by_job, target_datetimes, frozen=None):
+    """
+    Schedule every job with the in-memory engine instead of the greedy loop
+    Jobs are split into lanes of procedures no other lane uses (see lanes) and the
+    lanes are solved concurrently, annealed as well when the optimizer is on
+    Operations of a frozen window (see freeze) stay put and are planned around
+    """
+    candidates = []
+    for job in jobs:
+        if not operations_by_job[job.id]:
+            continue  # Nothing routed for this job
+        reason = job_window_shortfall(operations_by_job[job.id], target_datetimes[job.id])
+        if reason:
+            record_unscheduled(job, reason, precheck=True)
+        else:
+            candidates.append(job)
+    
+    budget_ms = app.config['SCHEDULER_OPTIMIZER_BUDGET_MS'] if app.config['SCHEDULER_OPTIMIZER'] == 'anneal' else 0
+    order, placements, cost, iterations = solve_in_lanes(
+        candidates, {job.id: job_operations(operations_by_job[job.id]) for job in candidates}, target_datetimes, budget_ms, frozen)
+    add_placements(order, placements)
 
 def generate_schedule_for_deadline(deadline_date, deadline_time, procedures):
     """
@@ -870,32 +1217,15 @@ def generate_schedule_for_deadline(deadline_date, deadline_time, procedures):
 def generate_schedule(job, procedures):
     """
     Generate schedule for a single job (backward compatibility)
-    This now triggers a full regeneration to maintain constraints
+    This now triggers a full regeneration of the job's plant to maintain constraints
     """
-    return regenerate_all_schedules()
+    return regenerate_all_schedules(job.plant_id)
 
 def calculate_working_duration_in_span(start_datetime, end_datetime):
     """Calculate actual working hours between two datetimes"""
-    total_working_minutes = 0
-    current_date = start_datetime.date()
-    end_date = end_datetime.date()
-    
-    while current_date <= end_date:
-        working_blocks = get_working_hours(current_date)
-        
-        for block_start, block_end in working_blocks:
-            # Find overlap between this block and our span
-            overlap_start = max(block_start, start_datetime)
-            overlap_end = min(block_end, end_datetime)
-            
-            if overlap_start < overlap_end:
-                overlap_minutes = (overlap_end - overlap_start).total_seconds() / 60
-                total_working_minutes += overlap_minutes
-        
-        current_date += timedelta(days=1)
-    
-    return total_working_minutes / 60  # Convert to hours
+    return (to_working_minute(end_datetime) - to_working_minute(start_datetime)) / 60  # Convert to hours
 
+@profiled
 def find_start_time_for_duration(duration_minutes, target_end_time):
     """
     Find the start time that would result in exactly the specified duration 
@@ -963,9 +1293,11 @@ def find_start_time_for_duration(duration_minutes, target_end_time):
     
     return None
 
+@profiled
 def calculate_job_schedule_backward_with_conflicts(job, procedures, target_completion_datetime, existing_schedules):
     """
     Calculate schedule for a job working backward from target completion, avoiding conflicts
+    existing_schedules is the CompactPlan of the current batch
     """
     # Sort procedures by sequence in reverse order (last procedure first)
     procedures_sorted = sorted(procedures, key=lambda x: x.sequence, reverse=True)
@@ -976,10 +1308,10 @@ def calculate_job_schedule_backward_with_conflicts(job, procedures, target_compl
         procedure_minutes = procedure.procedure_plantime * 60
         
         # Find available slot working backwards, considering conflicts
-        largest_single_block_minutes = 4.75 * 60  # 285 minutes
+        largest_single_block_minutes = largest_block_minutes()
         
-        # Create a list of all conflicts for this procedure
-        all_conflicts = []
+        # Collect all conflicts for this procedure
+        all_conflicts = CompactPlan(existing_schedules.epoch)
         
         # Add database conflicts
         Job, Schedule, Procedure, db = get_models()
@@ -988,18 +1320,10 @@ def calculate_job_schedule_backward_with_conflicts(job, procedures, target_compl
         ).all()
         
         for conflict in db_conflicts:
-            all_conflicts.append({
-                'procedure_id': conflict.procedure_id,
-                'start_datetime': conflict.start_datetime,
-                'end_datetime': conflict.end_datetime
-            })
+            all_conflicts.append_schedule(conflict)
         
         # Add memory conflicts
-        memory_conflicts = [
-            s for s in existing_schedules 
-            if s['procedure_id'] == procedure.id
-        ]
-        all_conflicts.extend(memory_conflicts)
+        all_conflicts.extend_from(existing_schedules, existing_schedules.on_procedure(procedure.id))
         
         # Try to find slot using backward scheduling with conflict awareness
         slot = None
@@ -1021,6 +1345,7 @@ def calculate_job_schedule_backward_with_conflicts(job, procedures, target_compl
             
             if not slot:
                 # Move search time earlier and try again
+                count('backward_retries')
                 search_end_time = search_end_time - timedelta(hours=4)
                 attempts += 1
         
@@ -1045,6 +1370,7 @@ def calculate_job_schedule_backward_with_conflicts(job, procedures, target_compl
     # Reverse the list to get chronological order (first procedure first)
     return list(reversed(job_schedules))
 
+@profiled
 def find_available_slot_backward_with_conflicts(procedure_id, procedure_duration_minutes, target_end_datetime, conflicts):
     """
     Find the latest available slot for a procedure working backwards, considering given conflicts
@@ -1092,18 +1418,15 @@ def find_available_slot_backward_with_conflicts(procedure_id, procedure_duration
                 # Ensure it doesn't go before block start
                 if candidate_start >= block_start:
                     # Check for conflicts with given conflicts list
-                    conflicts_found = [
-                        c for c in conflicts 
-                        if c['procedure_id'] == procedure_id and
-                        c['start_datetime'] < candidate_end and
-                        c['end_datetime'] > candidate_start
-                    ]
+                    count('slot_candidates')
+                    conflicts_found = conflicts.overlapping(procedure_id, candidate_start, candidate_end)
                     
                     if not conflicts_found:
                         return candidate_start, candidate_end
                     else:
+                        count('conflicts')
                         # Find the earliest start time of conflicting schedules
-                        earliest_conflict_start = min(conflict['start_datetime'] for conflict in conflicts_found)
+                        earliest_conflict_start = conflicts.earliest_start(conflicts_found)
                         current_datetime = earliest_conflict_start
                         break  # Restart search from before this conflict
             else:
@@ -1144,6 +1467,7 @@ def find_available_slot_backward_with_conflicts(procedure_id, procedure_duration
     
     return None
 
+@profiled
 def find_available_slot_backward_multiday_with_conflicts(procedure_id, procedure_duration_minutes, target_end_datetime, conflicts):
     """
     Find the latest available slot for a procedure that may span multiple days, considering conflicts
@@ -1195,16 +1519,13 @@ def find_available_slot_backward_multiday_with_conflicts(procedure_id, procedure
                 block_start_time = effective_end - time_to_use
                 
                 # Check for conflicts in this block
-                conflicts_found = [
-                    c for c in conflicts 
-                    if c['procedure_id'] == procedure_id and
-                    c['start_datetime'] < effective_end and
-                    c['end_datetime'] > block_start_time
-                ]
+                count('slot_candidates')
+                conflicts_found = conflicts.overlapping(procedure_id, block_start_time, effective_end)
                 
                 if conflicts_found:
+                    count('conflicts')
                     # Find earliest conflict start and try before it
-                    earliest_conflict = min(conflict['start_datetime'] for conflict in conflicts_found)
+                    earliest_conflict = conflicts.earliest_start(conflicts_found)
                     if earliest_conflict <= block_start:
                         # Entire block is blocked, try previous block
                         continue
@@ -1246,6 +1567,7 @@ def find_available_slot_backward_multiday_with_conflicts(procedure_id, procedure
             return overall_start, overall_end
         
         # Try again with an earlier end time
+        count('multiday_retries')
         current_end_time = current_end_time - timedelta(hours=1)
     
     return None
\ No newline at end of file
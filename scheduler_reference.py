@@ -0,0 +1,117 @@
+"""
+Frozen reference of the default scheduling logic, for checking faster engines against
+
+This is the plan regenerate_all_schedules makes with SCHEDULER_ENGINE=greedy, no
+frozen window and the optimizer off, written as plainly as possible: busy intervals
+are unsorted lists scanned in full, nothing is cached and nothing touches the
+database. Do not optimize it or change what it plans; an engine that is meant to
+plan differently is compared with allow_better (see benchmarks/scheduler_equivalence.py)
+instead. Only the working calendar (work_calendar) is shared with the engines.
+"""
+from collections import namedtuple
+from datetime import timedelta
+
+from work_calendar import working_blocks, to_working_minute, from_working_minute
+
+SEARCH_WINDOW_DAYS = 60
+
+# One operation of a job: procedure ID, sequence and planned hours
+ReferenceOperation = namedtuple('ReferenceOperation', ['procedure_id', 'sequence', 'plantime'])
+
+def reference_target(deadline_date):
+    """End of the last working block two working days before the deadline"""
+    day = deadline_date
+    for _ in range(2):
+        day -= timedelta(days=1)
+        while not working_blocks(day):
+            day -= timedelta(days=1)
+    return working_blocks(day)[-1][1]
+
+def reference_operations(job, procedures, routing_steps):
+    """
+    A job's operations in sequence order: its routing steps when it has any (skipping
+    deleted procedures, plantime overrides applied), otherwise every procedure
+    """
+    by_id = {procedure.id: procedure for procedure in procedures}
+    steps = [step for step in routing_steps if step.job_id == job.id]
+    if not steps:
+        return [ReferenceOperation(p.id, p.sequence, p.procedure_plantime) for p in sorted(procedures, key=lambda p: p.sequence)]
+    operations = []
+    for step in sorted(steps, key=lambda step: step.sequence):
+        if step.procedure_id in by_id:
+            plantime = step.plantime if step.plantime is not None else by_id[step.procedure_id].procedure_plantime
+            operations.append(ReferenceOperation(step.procedure_id, step.sequence, plantime))
+    return sorted(operations, key=lambda operation: operation.sequence)
+
+def overlapping(busy, start, end):
+    return [(busy_start, busy_end) for busy_start, busy_end in busy if busy_start < end and start < busy_end]
+
+def latest_slot(busy, minutes, end, floor):
+    """Latest [start, end) of minutes ending by end, starting at or after floor and free of busy"""
+    while end - minutes >= floor:
+        conflicts = overlapping(busy, end - minutes, end)
+        if not conflicts:
+            return end - minutes, end
+        end = min(busy_start for busy_start, busy_end in conflicts)
+    return None
+
+def earliest_slot(busy, minutes, start):
+    """Earliest [start, end) of minutes starting at or after start and free of busy"""
+    while True:
+        conflicts = overlapping(busy, start, start + minutes)
+        if not conflicts:
+            return start, start + minutes
+        start = max(busy_end for busy_start, busy_end in conflicts)
+
+def reference_plan(jobs, procedures, routing_steps):
+    """
+    Plan jobs the way the default engine does
+    Jobs go in priority order (deadline, then ID). A job whose operations need more
+    working time than the 60 days before its target is unscheduled. Otherwise its
+    operations are placed backward from the target, each ending where the next starts
+    or earlier; when that cannot fit after the window start, they are placed forward
+    from the window start instead. Returns (operations as a set of (job ID, procedure
+    ID, start, end) datetimes, {unscheduled job ID: True when rejected up front})
+    """
+    busy = {}
+    operations = set()
+    unscheduled = {}
+    for job in sorted(jobs, key=lambda job: (job.deadline_date, job.deadline_time, job.id)):
+        job_operations = [(operation, operation.plantime * 60) for operation in reference_operations(job, procedures, routing_steps)]
+        if not job_operations:
+            continue
+        target_datetime = reference_target(job.deadline_date)
+        target = to_working_minute(target_datetime)
+        floor = to_working_minute(target_datetime - timedelta(days=SEARCH_WINDOW_DAYS))
+        if sum(minutes for operation, minutes in job_operations) > target - floor:
+            unscheduled[job.id] = True
+            continue
+
+        placements = []
+        end = target
+        for operation, minutes in reversed(job_operations):
+            slot = latest_slot(busy.get(operation.procedure_id, []), minutes, end, floor) if minutes else (end, end)
+            if slot is None:
+                break
+            placements.append((operation, slot))
+            if minutes:
+                busy.setdefault(operation.procedure_id, []).append(slot)
+            end = slot[0]
+        else:
+            placements.reverse()
+        if len(placements) < len(job_operations):
+            # Release what the backward attempt booked, then go forward from the window start
+            for operation, slot in placements:
+                if slot[1] > slot[0]:
+                    busy[operation.procedure_id].remove(slot)
+            placements = []
+            start = floor
+            for operation, minutes in job_operations:
+                slot = earliest_slot(busy.get(operation.procedure_id, []), minutes, start) if minutes else (start, start)
+                placements.append((operation, slot))
+                if minutes:
+                    busy.setdefault(operation.procedure_id, []).append(slot)
+                start = slot[1]
+        for operation, (start, end) in placements:
+            operations.add((job.id, operation.procedure_id, from_working_minute(start, at_end=start == end), from_working_minute(end, at_end=True)))
+    return operations, unscheduled
@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+from plants import plant_procedure_ids
+from profiling import count
+from work_calendar import working_blocks
+
+# Working blocks never cross midnight, so neither does a segment
+MAX_SEGMENT_LENGTH = timedelta(days=1)
+
+def get_models():
+    """Get model classes and db object - lazy import to avoid circular imports"""
+    from models import Schedule, ScheduleSegment, db
+    return Schedule, ScheduleSegment, db
+
+def operation_segments(start, end):
+    """The working blocks an operation from start to end occupies, clipped to it, as (start, end) datetimes"""
+    segments = []
+    day = start.date()
+    while day <= end.date():
+        for block_start, block_end in working_blocks(day):
+            if block_start < end and start < block_end:
+                segments.append((max(start, block_start), min(end, block_end)))
+        day += timedelta(days=1)
+    return segments
+
+def clear_segments(schedules):
+    """Delete the segments of the rows of a Schedule query, which must go before the rows themselves"""
+    Schedule, ScheduleSegment, db = get_models()
+    ScheduleSegment.query.filter(ScheduleSegment.schedule_id.in_(schedules.with_entities(Schedule.id).statement)).delete(synchronize_session=False)
+
+def write_segments(rows):
+    """
+    Store the segments of the Schedule rows a regeneration inserted, in one bulk insert
+    Rows it kept (a frozen window) keep the segments they already have
+    """
+    Schedule, ScheduleSegment, db = get_models()
+    values = [{'schedule_id': row.id, 'procedure_id': row.procedure_id, 'segment_start': segment_start, 'segment_end': segment_end}
+              for row in rows for segment_start, segment_end in operation_segments(row.start_datetime, row.end_datetime)]
+    if values:
+        db.session.execute(ScheduleSegment.__table__.insert(), values)
+    count('segments_written', len(values))
+
+def plant_segments(since=None):
+    """The current plant's segments, those starting at or after since when given, as (procedure ID, start, end)"""
+    Schedule, ScheduleSegment, db = get_models()
+    query = db.session.query(ScheduleSegment.procedure_id, ScheduleSegment.segment_start, ScheduleSegment.segment_end).filter(
+        ScheduleSegment.procedure_id.in_(plant_procedure_ids()))
+    if since is not None:
+        query = query.filter(ScheduleSegment.segment_start >= since)
+    return query.all()
+
+def segments_between(procedure_ids, start, end):
+    """
+    Segments of the procedures that overlap [start, end), as (procedure ID, start, end)
+    Segments are shorter than MAX_SEGMENT_LENGTH, so this is a bounded range scan on
+    ix_schedule_segment_procedure_start with no working calendar involved
+    """
+    Schedule, ScheduleSegment, db = get_models()
+    return db.session.query(ScheduleSegment.procedure_id, ScheduleSegment.segment_start, ScheduleSegment.segment_end).filter(
+        ScheduleSegment.procedure_id.in_(procedure_ids),
+        ScheduleSegment.segment_start > start - MAX_SEGMENT_LENGTH,
+        ScheduleSegment.segment_start < end,
+        ScheduleSegment.segment_end > start
+    ).all()
@@ -0,0 +1,57 @@
+from work_calendar import to_working_minute
+
+def compute_slack(rows, targets, context=()):
+    """
+    Fill slack_minutes, job_slack_minutes and is_critical on Schedule rows
+    targets maps job_id to the completion target in working minutes of every job in
+    rows and context; context rows take part in the plan order but are not written
+
+    Slack is how many working minutes an operation can slip before some job misses
+    its target, given the plan's order on every procedure. The forward pass orders
+    the operations and links each one to the next operation of its job and the next
+    operation on its procedure; the backward pass walks that order in reverse and
+    propagates latest finish times. A job's slack is the smallest slack among its
+    operations, and the operations at that minimum are its critical path.
+    """
+    operations = []
+    for row in list(rows) + list(context):
+        operations.append((to_working_minute(row.start_datetime), to_working_minute(row.end_datetime), row.id or 0, row))
+    operations.sort(key=lambda operation: operation[:3])
+
+    # Forward pass: successor links in plan order
+    job_next = {}
+    procedure_next = {}
+    last_of_job = {}
+    last_on_procedure = {}
+    for position, (start, end, row_id, row) in enumerate(operations):
+        if row.job_id in last_of_job:
+            job_next[last_of_job[row.job_id]] = position
+        if row.procedure_id in last_on_procedure:
+            procedure_next[last_on_procedure[row.procedure_id]] = position
+        last_of_job[row.job_id] = position
+        last_on_procedure[row.procedure_id] = position
+
+    # Backward pass: latest start each operation can have without making any job late
+    latest_start = [None] * len(operations)
+    slack = [0] * len(operations)
+    job_slack = {}
+    for position in range(len(operations) - 1, -1, -1):
+        start, end, row_id, row = operations[position]
+        if position in job_next:
+            latest_finish = latest_start[job_next[position]]
+        else:
+            latest_finish = targets[row.job_id]
+        if position in procedure_next:
+            latest_finish = min(latest_finish, latest_start[procedure_next[position]])
+        latest_start[position] = latest_finish - (end - start)
+        slack[position] = latest_finish - end
+        job_slack[row.job_id] = min(job_slack.get(row.job_id, slack[position]), slack[position])
+
+    written = {id(row) for row in rows}
+    for position, (start, end, row_id, row) in enumerate(operations):
+        if id(row) not in written:
+            continue
+        row.slack_minutes = slack[position]
+        row.job_slack_minutes = job_slack[row.job_id]
+        row.is_critical = slack[position] == job_slack[row.job_id]
+    return job_slack
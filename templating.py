@@ -0,0 +1,62 @@
+import os
+from threading import Lock
+
+from flask import request, session
+from jinja2 import FileSystemBytecodeCache, pass_context
+from markupsafe import Markup
+
+from app import app
+
+NAV_TEMPLATE = 'nav-auth.html'
+
+# Compiled templates kept on disk, so a restarted worker loads bytecode instead of
+# parsing and compiling every template again
+if app.config['TEMPLATE_BYTECODE_CACHE']:
+    if app.config['TEMPLATE_BYTECODE_CACHE_DIR']:
+        os.makedirs(app.config['TEMPLATE_BYTECODE_CACHE_DIR'], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_BYTECODE_CACHE_DIR'] or None)
+
+class FragmentCache:
+    """
+    Rendered template fragments by key, each kept while its template is unchanged
+    A fragment from an older template (reloaded in debug) is rendered again on lookup
+    """
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def render(self, name, key, context):
+        template = app.jinja_env.get_template(name)
+        with self.lock:
+            entry = self.entries.get((name, key))
+            if entry is not None and entry[0] is template:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        fragment = Markup(template.render(context))
+        with self.lock:
+            self.entries[(name, key)] = (template, fragment)
+        return fragment
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+fragment_cache = FragmentCache()
+
+@app.template_global()
+@pass_context
+def navigation(context):
+    """
+    The navigation bar, rendered once per role combination
+    Its output depends only on whether someone is logged in and their role flags
+    (stored in the session at login). Pages rendered without the user, and sessions
+    from before roles were stored, get it rendered every time
+    """
+    logged_in = 'user_id' in session
+    if not app.config['TEMPLATE_NAV_CACHE'] or (logged_in and ('roles' not in session or context.get('user') is None)):
+        return Markup(app.jinja_env.get_template(NAV_TEMPLATE).render(context.get_all()))
+    key = (request.script_root, tuple(session['roles']) if logged_in else None)
+    return fragment_cache.render(NAV_TEMPLATE, key, context.get_all())
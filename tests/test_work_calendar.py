@@ -0,0 +1,74 @@
+import unittest
+from datetime import datetime, date, timedelta, time as dt_time
+
+import work_calendar
+from plants import use_plant
+from work_calendar import (CalendarRules, CompiledCalendar, DEFAULT_SHIFT_PATTERN, MAX_CLOSED_DAYS, merge_blocks,
+                           next_working_date, previous_working_date, to_working_minute, from_working_minute)
+
+# A plant no database row uses, so its compiled calendar never meets a real one
+PLANT_ID = -1
+MONDAY = date(2026, 10, 19)
+
+def at(day, hour, minute=0):
+    return datetime.combine(day, dt_time(hour, minute))
+
+class CompiledMinuteIndexTest(unittest.TestCase):
+    """Working minutes of a compiled calendar built from rules, without the database"""
+
+    def compile(self, weekly=None, closed_ranges=(), exceptions=None):
+        weekly = weekly if weekly is not None else {weekday: list(blocks) for weekday, blocks in DEFAULT_SHIFT_PATTERN.items()}
+        rules = CalendarRules(weekly, list(closed_ranges), exceptions or {})
+        work_calendar._compiled[PLANT_ID] = CompiledCalendar(rules, MONDAY - timedelta(days=30), MONDAY + timedelta(days=30), MONDAY)
+
+    def setUp(self):
+        plant = use_plant(PLANT_ID)
+        plant.__enter__()
+        self.addCleanup(plant.__exit__, None, None, None)
+        self.addCleanup(work_calendar._compiled.pop, PLANT_ID, None)
+
+    def test_merge_blocks(self):
+        self.assertEqual(merge_blocks([(dt_time(13, 30), dt_time(17, 0)), (dt_time(8, 15), dt_time(13, 0)), (dt_time(9, 0), dt_time(12, 0))]),
+                         [(dt_time(8, 15), dt_time(13, 0)), (dt_time(13, 30), dt_time(17, 0))])
+        self.assertEqual(merge_blocks([(dt_time(8, 0), dt_time(12, 0)), (dt_time(12, 0), dt_time(16, 0))]), [(dt_time(8, 0), dt_time(16, 0))])
+        self.assertEqual(merge_blocks([(dt_time(8, 0), dt_time(12, 0)), (dt_time(11, 0), dt_time(14, 0)), (dt_time(10, 0), dt_time(10, 0))]),
+                         [(dt_time(8, 0), dt_time(14, 0))])
+
+    def test_default_day(self):
+        self.compile()
+        self.assertEqual(to_working_minute(at(MONDAY, 17)) - to_working_minute(at(MONDAY, 8, 15)), 495)
+        self.assertEqual(to_working_minute(at(MONDAY, 13, 15)), to_working_minute(at(MONDAY, 13)))
+        # Sunday has no shifts
+        self.assertEqual(to_working_minute(at(MONDAY - timedelta(days=1), 12)), 0)
+
+    def test_overlapping_shifts_count_once(self):
+        weekly = {weekday: list(blocks) for weekday, blocks in DEFAULT_SHIFT_PATTERN.items()}
+        weekly[0].append((dt_time(9, 0), dt_time(12, 0)))
+        self.compile(weekly)
+        self.assertEqual(to_working_minute(at(MONDAY, 17)) - to_working_minute(at(MONDAY, 8, 15)), 495)
+        self.assertEqual(work_calendar.largest_block_minutes(), 285)
+
+    def test_overlapping_exception_shifts_count_once(self):
+        self.compile(exceptions={MONDAY: [(dt_time(8, 0), dt_time(12, 0)), (dt_time(10, 0), dt_time(14, 0))]})
+        self.assertEqual(to_working_minute(at(MONDAY, 23)) - to_working_minute(at(MONDAY, 0)), 360)
+
+    def test_round_trip(self):
+        self.compile()
+        for moment in (at(MONDAY, 8, 15), at(MONDAY, 10, 40), at(MONDAY, 13, 30), at(MONDAY + timedelta(days=5), 15, 0)):
+            self.assertEqual(from_working_minute(to_working_minute(moment)), moment)
+        # An end on a block boundary stays with the earlier block
+        self.assertEqual(from_working_minute(to_working_minute(at(MONDAY, 13)), at_end=True), at(MONDAY, 13))
+
+    def test_working_dates_across_a_holiday(self):
+        self.compile(closed_ranges=[(MONDAY, MONDAY + timedelta(days=9))])
+        self.assertEqual(next_working_date(MONDAY), MONDAY + timedelta(days=10))
+        self.assertEqual(previous_working_date(MONDAY + timedelta(days=10)), MONDAY - timedelta(days=2))
+
+    def test_no_working_date_within_reach(self):
+        self.compile(closed_ranges=[(MONDAY, date(2126, 12, 31))])
+        self.assertIsNone(next_working_date(MONDAY))
+        self.assertIsNone(previous_working_date(MONDAY + timedelta(days=2 * MAX_CLOSED_DAYS)))
+        self.assertLess(len(work_calendar._compiled[PLANT_ID].day_blocks), 4 * (MAX_CLOSED_DAYS + work_calendar.HORIZON_EXTENSION_DAYS))
+
+if __name__ == '__main__':
+    unittest.main()
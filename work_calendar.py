@@ -0,0 +1,275 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, date, time as dt_time
+from threading import Lock
+
+from plants import current_plant_id
+
+# Plant week a new plant starts with (0 = Monday); see add_default_shifts
+DEFAULT_SHIFT_PATTERN = {
+    0: [(dt_time(8, 15), dt_time(13, 0)), (dt_time(13, 30), dt_time(17, 0))],
+    1: [(dt_time(8, 15), dt_time(13, 0)), (dt_time(13, 30), dt_time(17, 0))],
+    2: [(dt_time(8, 15), dt_time(13, 0)), (dt_time(13, 30), dt_time(17, 0))],
+    3: [(dt_time(8, 15), dt_time(13, 0)), (dt_time(13, 30), dt_time(17, 0))],
+    4: [(dt_time(8, 15), dt_time(13, 0)), (dt_time(13, 30), dt_time(17, 0))],
+    5: [(dt_time(8, 15), dt_time(13, 0)), (dt_time(13, 30), dt_time(15, 30))],
+}
+
+# Extra days compiled on either side when a lookup falls outside the horizon
+HORIZON_EXTENSION_DAYS = 365
+
+# Longest run of closed days a working-date lookup looks across; the holiday form accepts no longer holiday
+MAX_CLOSED_DAYS = 366
+
+# Compiled calendar of each plant, for the plant the calling thread works with (see plants.use_plant)
+_compiled = {}
+_compile_lock = Lock()
+calendar_version = 0
+
+def get_calendar_models():
+    """Get calendar model classes - lazy import to avoid circular imports"""
+    from models import ShiftPattern, Holiday, CalendarException
+    return ShiftPattern, Holiday, CalendarException
+
+class CalendarRules:
+    """
+    Snapshot of the editable calendar tables
+    Weekly shift pattern, closed date ranges (holidays and shutdowns)
+    and per-date exceptions that replace the weekly pattern for that date
+    """
+    def __init__(self, weekly, closed_ranges, exceptions):
+        self.weekly = weekly
+        self.closed_ranges = closed_ranges
+        self.exceptions = exceptions
+
+    def blocks_for(self, day):
+        """Working blocks (as times) for a date, exceptions first, then holidays, then the weekly pattern"""
+        if day in self.exceptions:
+            return self.exceptions[day]
+        for start_date, end_date in self.closed_ranges:
+            if start_date <= day <= end_date:
+                return []
+        return self.weekly.get(day.weekday(), [])
+
+def merge_blocks(blocks):
+    """
+    A day's (start, end) time blocks in order, with overlapping or touching blocks joined
+    Shifts added on top of each other would otherwise count their common minutes twice
+    """
+    merged = []
+    for start, end in sorted(blocks):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+class CompiledCalendar:
+    """
+    Per-date lookup arrays over a date range
+    Every lookup is an index into a list: working blocks, cumulative working
+    minutes and the previous/next working day for each date
+    """
+    def __init__(self, rules, first_day, last_day, anchor):
+        self.rules = rules
+        self.epoch = first_day
+        self.anchor = anchor
+        self.day_blocks = []
+        self.minutes_before = [0]
+        self.largest_block_minutes = 0
+
+        day = first_day
+        while day <= last_day:
+            blocks = [(datetime.combine(day, start), datetime.combine(day, end))
+                      for start, end in merge_blocks(rules.blocks_for(day))]
+            self.day_blocks.append(blocks)
+            day_minutes = 0
+            for block_start, block_end in blocks:
+                block_minutes = (block_end - block_start) // timedelta(minutes=1)
+                day_minutes += block_minutes
+                self.largest_block_minutes = max(self.largest_block_minutes, block_minutes)
+            self.minutes_before.append(self.minutes_before[-1] + day_minutes)
+            day += timedelta(days=1)
+
+        # Working minutes are counted from the anchor date so values stay stable when the horizon grows
+        offset = self.minutes_before[(anchor - first_day).days]
+        self.minutes_before = [minutes - offset for minutes in self.minutes_before]
+
+        days = len(self.day_blocks)
+        self.prev_working = [-1] * days
+        self.next_working = [days] * days
+        last_seen = -1
+        for i in range(days):
+            self.prev_working[i] = last_seen
+            if self.day_blocks[i]:
+                last_seen = i
+        last_seen = days
+        for i in range(days - 1, -1, -1):
+            self.next_working[i] = last_seen
+            if self.day_blocks[i]:
+                last_seen = i
+
+    @property
+    def last_day(self):
+        return self.epoch + timedelta(days=len(self.day_blocks) - 1)
+
+    def covers(self, day):
+        return self.epoch <= day <= self.last_day
+
+    def index(self, day):
+        return (day - self.epoch).days
+
+def load_calendar_rules(plant_id=None):
+    """Read a plant's calendar tables (the current plant's by default) into a CalendarRules snapshot"""
+    ShiftPattern, Holiday, CalendarException = get_calendar_models()
+    plant_id = plant_id or current_plant_id()
+
+    weekly = {}
+    for shift in ShiftPattern.query.filter_by(plant_id=plant_id).all():
+        weekly.setdefault(shift.weekday, []).append((shift.block_start, shift.block_end))
+
+    closed_ranges = [(holiday.start_date, holiday.end_date) for holiday in Holiday.query.filter_by(plant_id=plant_id).all()]
+
+    exceptions = {}
+    for exception in CalendarException.query.filter_by(plant_id=plant_id).all():
+        exceptions.setdefault(exception.exception_date, []).append((exception.block_start, exception.block_end))
+
+    return CalendarRules(weekly, closed_ranges, exceptions)
+
+def add_default_shifts(plant_id):
+    """Add DEFAULT_SHIFT_PATTERN as a new plant's shift rows; the caller commits"""
+    from models import ShiftPattern, db
+    for weekday, blocks in sorted(DEFAULT_SHIFT_PATTERN.items()):
+        for block_start, block_end in blocks:
+            db.session.add(ShiftPattern(plant_id=plant_id, weekday=weekday, block_start=block_start, block_end=block_end))
+
+def compile_calendar(rules=None):
+    """Compile the calendar over the configured planning horizon around today"""
+    from app import app
+
+    if rules is None:
+        rules = load_calendar_rules()
+    today = date.today()
+    first_day = today - timedelta(days=app.config['CALENDAR_HORIZON_PAST_DAYS'])
+    last_day = today + timedelta(days=app.config['CALENDAR_HORIZON_FUTURE_DAYS'])
+    return CompiledCalendar(rules, first_day, last_day, today)
+
+def get_calendar():
+    """Get the current plant's compiled calendar, compiling it on first use after a change"""
+    plant_id = current_plant_id()
+    compiled = _compiled.get(plant_id)
+    if compiled is None:
+        with _compile_lock:
+            if plant_id not in _compiled:
+                _compiled[plant_id] = compile_calendar()
+            compiled = _compiled[plant_id]
+    return compiled
+
+def invalidate_calendar(plant_id=None):
+    """
+    Drop a plant's compiled calendar, or every plant's when plant_id is None
+    Call after any shift, holiday or exception edit
+    """
+    global calendar_version
+    with _compile_lock:
+        if plant_id is None:
+            _compiled.clear()
+        else:
+            _compiled.pop(plant_id, None)
+        calendar_version += 1
+
+def _calendar_covering(day):
+    """Get a compiled calendar whose range includes day, extending the horizon if needed"""
+    compiled = get_calendar()
+    if compiled.covers(day):
+        return compiled
+    plant_id = current_plant_id()
+    with _compile_lock:
+        compiled = _compiled.get(plant_id, compiled)
+        if not compiled.covers(day):
+            first_day = min(compiled.epoch, day - timedelta(days=HORIZON_EXTENSION_DAYS))
+            last_day = max(compiled.last_day, day + timedelta(days=HORIZON_EXTENSION_DAYS))
+            compiled = CompiledCalendar(compiled.rules, first_day, last_day, compiled.anchor)
+            _compiled[plant_id] = compiled
+    return compiled
+
+def working_blocks(day):
+    """List of (start_datetime, end_datetime) working blocks for a date"""
+    compiled = _calendar_covering(day)
+    return compiled.day_blocks[compiled.index(day)]
+
+def is_working_date(day):
+    """True when the date has at least one working block"""
+    compiled = _calendar_covering(day)
+    return bool(compiled.day_blocks[compiled.index(day)])
+
+def previous_working_date(day):
+    """Latest working date strictly before day, or None when the MAX_CLOSED_DAYS before it are all closed"""
+    _calendar_covering(day - timedelta(days=MAX_CLOSED_DAYS))
+    compiled = _calendar_covering(day)
+    i = compiled.prev_working[compiled.index(day)]
+    if i < 0 or compiled.index(day) - i > MAX_CLOSED_DAYS:
+        return None
+    return compiled.epoch + timedelta(days=i)
+
+def next_working_date(day):
+    """Earliest working date strictly after day, or None when the MAX_CLOSED_DAYS after it are all closed"""
+    _calendar_covering(day + timedelta(days=MAX_CLOSED_DAYS))
+    compiled = _calendar_covering(day)
+    i = compiled.next_working[compiled.index(day)]
+    if i >= len(compiled.day_blocks) or i - compiled.index(day) > MAX_CLOSED_DAYS:
+        return None
+    return compiled.epoch + timedelta(days=i)
+
+def has_shift_pattern():
+    """
+    True when the current plant has weekly shifts. A plant whose shifts have all been
+    deleted is closed: it has no working time and nothing is scheduled on it
+    """
+    return bool(get_calendar().rules.weekly)
+
+def largest_block_minutes():
+    """Length of the longest single working block in the compiled calendar"""
+    return get_calendar().largest_block_minutes
+
+def to_working_minute(moment):
+    """Working minutes elapsed between the calendar anchor and a datetime"""
+    compiled = _calendar_covering(moment.date())
+    i = compiled.index(moment.date())
+    minutes = compiled.minutes_before[i]
+    for block_start, block_end in compiled.day_blocks[i]:
+        if moment >= block_end:
+            minutes += (block_end - block_start) // timedelta(minutes=1)
+        else:
+            if moment > block_start:
+                minutes += (moment - block_start) // timedelta(minutes=1)
+            break
+    return minutes
+
+def from_working_minute(minutes, at_end=False):
+    """
+    Datetime at which the given working minute count is reached
+    With at_end=True a count that lands on a block boundary resolves to the end of
+    the earlier block (an operation end), otherwise to the start of the next block
+    """
+    compiled = get_calendar()
+    while True:
+        if at_end:
+            i = bisect_left(compiled.minutes_before, minutes) - 1
+        else:
+            i = bisect_right(compiled.minutes_before, minutes) - 1
+        if i < 0:
+            compiled = _calendar_covering(compiled.epoch - timedelta(days=1))
+        elif i >= len(compiled.day_blocks):
+            compiled = _calendar_covering(compiled.last_day + timedelta(days=1))
+        else:
+            break
+
+    remaining = minutes - compiled.minutes_before[i]
+    for block_start, block_end in compiled.day_blocks[i]:
+        block_minutes = (block_end - block_start) // timedelta(minutes=1)
+        if remaining < block_minutes or (at_end and remaining == block_minutes):
+            return block_start + timedelta(minutes=remaining)
+        remaining -= block_minutes
+    return compiled.day_blocks[i][-1][1]
@@ -0,0 +1,103 @@
+from datetime import datetime
+from threading import Lock
+
+import page_cache
+
+def get_models():
+    """Get model classes and db object - lazy import to avoid circular imports"""
+    from models import Job, Procedure, Schedule, db
+    return Job, Procedure, Schedule, db
+
+DEFAULT_QUEUE_LENGTH = 5
+MAX_QUEUE_LENGTH = 50
+
+def station_procedures(user):
+    """Stations (procedures) whose work queues a user may see, in sequence order"""
+    Job, Procedure, Schedule, db = get_models()
+    query = Procedure.query.order_by(Procedure.sequence, Procedure.id)
+    if user.is_admin or user.is_prodmanager or user.is_storemanager:
+        return query.all()
+    if user.is_prodsupervisor and user.is_storesupervisor:
+        return query.all()
+    if user.is_prodsupervisor:
+        return query.filter(Procedure.procedure_is_prod == True).all()
+    if user.is_storesupervisor:
+        return query.filter(Procedure.procedure_is_store == True).all()
+    return []
+
+def operation_dict(schedule, job_name):
+    return {'job_id': schedule.job_id, 'job_name': job_name, 'start_datetime': schedule.start_datetime, 'end_datetime': schedule.end_datetime,
+            'planned_time': schedule.planned_time, 'planned_manpower': schedule.planned_manpower, 'is_critical': schedule.is_critical}
+
+def load_queue(procedure_id, now, length):
+    """
+    Operation running on a station at now, and the next length operations after it
+    Both are seeks on the (procedure_id, start_datetime) index. Returns (current or
+    None, next list, time until which the answer holds or None)
+    """
+    Job, Procedure, Schedule, db = get_models()
+    latest = db.session.query(Schedule, Job.job_name).join(Job, Schedule.job_id == Job.id).filter(
+        Schedule.procedure_id == procedure_id,
+        Schedule.start_datetime <= now
+    ).order_by(Schedule.start_datetime.desc()).first()
+    upcoming = db.session.query(Schedule, Job.job_name).join(Job, Schedule.job_id == Job.id).filter(
+        Schedule.procedure_id == procedure_id,
+        Schedule.start_datetime > now
+    ).order_by(Schedule.start_datetime).limit(length).all()
+
+    current = None
+    boundaries = []
+    if latest and latest[0].end_datetime > now:
+        current = operation_dict(*latest)
+        boundaries.append(current['end_datetime'])
+    next_operations = [operation_dict(schedule, job_name) for schedule, job_name in upcoming]
+    if next_operations:
+        boundaries.append(next_operations[0]['start_datetime'])
+    return current, next_operations, min(boundaries) if boundaries else None
+
+class QueueCache:
+    """
+    Station work queues, each kept until the data changes or its current operation ends
+    or the next one starts, whichever comes first; entries from an older data version
+    are replaced on their next lookup
+    """
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, procedure_id, length, now):
+        key = (procedure_id, length)
+        version = page_cache.data_version()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version and (entry[1] is None or now < entry[1]):
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        current, next_operations, valid_until = load_queue(procedure_id, now, length)
+        queue = {'current': current, 'next': next_operations}
+        with self.lock:
+            self.entries[key] = (version, valid_until, queue)
+        return queue
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+queue_cache = QueueCache()
+
+def station_queues(procedures, length=DEFAULT_QUEUE_LENGTH, now=None):
+    """Work queue of each station, as dicts with the procedure's id and name"""
+    now = now or datetime.now()
+    queues = []
+    for procedure in procedures:
+        queue = queue_cache.get(procedure.id, length, now)
+        queues.append({'procedure_id': procedure.id, 'procedure_name': procedure.procedure_name,
+                       'current': queue['current'], 'next': queue['next']})
+    return queues
+
+def queue_length(value):
+    """Queue length from a request argument, clamped to 1..MAX_QUEUE_LENGTH"""
+    return max(1, min(MAX_QUEUE_LENGTH, int(value))) if value and value.isdigit() else DEFAULT_QUEUE_LENGTH